@@ -0,0 +1,352 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import NamedTuple, Optional
+
+import pandas as pd
+from pulp import value  # type: ignore
+from pulp.constants import (  # type: ignore
+    LpSolution,
+    LpSolutionInfeasible,
+    LpSolutionIntegerFeasible,
+    LpSolutionOptimal,
+)
+
+from lp import (
+    CONSULTANT_MAX_HOURS,
+    CONSULTANT_MIN_HOURS,
+    DAILY_MAX_HOURS,
+    PREFERENCE_COSTS,
+    SHIFT_CHANGE_PENALTY,
+    ScheduleModel,
+    precheck,
+)
+from overrides import apply_overrides, load_overrides, parse_day, parse_level
+from read_csv import (
+    allocate_feasible_blocks,
+    ingest_responses,
+    write_failures,
+)
+from sched_format import ScheduleFormatter
+from sched_setup import BLOCK_MINUTES, SUNLAB_HOURS, blocks_to_hours, hours_to_blocks
+from solvers import DEFAULT_BACKEND
+from tracing import span, tracing
+
+logger = logging.getLogger(__name__)
+
+# directory the schedules (and the summary) are written to, relative to the manifest
+DEFAULT_OUTPUT_DIR = "schedules"
+
+BATCH_SUMMARY = "batch_summary.csv"
+
+# seconds a job gets on top of its solver time limit (for parsing, building and exporting) before
+# it's stopped
+JOB_GRACE = 60
+
+
+class BatchJob(NamedTuple):
+    """
+    One scheduler run in a batch manifest, e.g. one lab for one term
+    """
+
+    name: str  # used for the output file names
+    csv_file: str  # responses CSV
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS  # the lab's opening hours
+    block_minutes: int = BLOCK_MINUTES
+    min_hours: int = CONSULTANT_MIN_HOURS
+    max_hours: int = CONSULTANT_MAX_HOURS
+    daily_max_hours: float = DAILY_MAX_HOURS
+    preference_costs: dict[int, int] = PREFERENCE_COSTS
+    shift_change_penalty: float = SHIFT_CHANGE_PENALTY
+    corrections_file: Optional[str] = None
+    overrides_file: Optional[str] = None
+    time_limit: Optional[float] = None  # solver time limit in seconds
+    gap_rel: Optional[float] = None
+    backend: str = DEFAULT_BACKEND
+    formats: tuple[str, ...] = ("csv",)  # export formats (see ScheduleFormatter)
+    trace: bool = False  # also write a trace of the job (see tracing.py)
+
+
+class JobResult(NamedTuple):
+    """
+    Outcome of a batch job, one row of the summary table
+    """
+
+    name: str
+    status: str  # PuLP solution status (see pulp.constants.LpSolution), "failed" or "timed out"
+    consultants: int
+    objective: Optional[float]
+    seconds: float
+    outputs: list[str]  # files written
+    error: Optional[str] = None
+
+
+def _parse_job(entry: dict, base_dir: str) -> BatchJob:
+    """
+    Converts a manifest entry to a BatchJob. Paths are relative to base_dir, days of the hours
+    are weekday names or numbers and preference cost levels are level numbers or names (same as
+    an overrides file)
+    """
+    entry = dict(entry)
+    unknown = set(entry) - set(BatchJob._fields)
+    if unknown:
+        raise ValueError(f"unknown job settings {sorted(unknown)}")
+
+    for path in ("csv_file", "corrections_file", "overrides_file"):
+        if entry.get(path) is not None:
+            entry[path] = os.path.join(base_dir, entry[path])
+    if "hours" in entry:
+        entry["hours"] = {
+            parse_day(str(day)): (open_time, close_time)
+            for day, (open_time, close_time) in entry["hours"].items()
+        }
+    if "preference_costs" in entry:
+        entry["preference_costs"] = {
+            **PREFERENCE_COSTS,
+            **{
+                parse_level(str(level)): cost
+                for level, cost in entry["preference_costs"].items()
+            },
+        }
+    if "formats" in entry:
+        entry["formats"] = tuple(entry["formats"])
+
+    return BatchJob(**entry)
+
+
+def load_manifest(manifest_file: str) -> tuple[list[BatchJob], str]:
+    """
+    Reads a batch manifest: a JSON file with a list of jobs (see BatchJob for their settings),
+    settings shared by every job and the output directory, e.g.
+
+        {
+          "output_dir": "schedules",
+          "defaults": {"time_limit": 120, "formats": ["csv", "ics"]},
+          "jobs": [
+            {"name": "sunlab-spring", "csv_file": "sunlab.csv"},
+            {
+              "name": "cit-spring",
+              "csv_file": "cit.csv",
+              "hours": {"Monday": ["09:00", "17:00"], "Tuesday": ["09:00", "17:00"]},
+              "max_hours": 12,
+              "preference_costs": {"not_preferred": 20}
+            }
+          ]
+        }
+
+    Returns (jobs, output directory). Paths are relative to the manifest
+    """
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    defaults = manifest.get("defaults", {})
+    jobs = [_parse_job({**defaults, **entry}, base_dir) for entry in manifest["jobs"]]
+
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"job names must be unique (repeated: {duplicates})")
+
+    output_dir = os.path.join(base_dir, manifest.get("output_dir", DEFAULT_OUTPUT_DIR))
+    return jobs, output_dir
+
+
+def _timeout(signum, frame):
+    raise TimeoutError("job ran past its time limit")
+
+
+def _stop_solver():
+    """
+    Stops any solver subprocess still running in the worker's process group, without stopping the
+    worker itself
+    """
+    handler = signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        os.killpg(os.getpgrp(), signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+
+
+def _terminated(signum, frame):
+    # Pool.terminate() (e.g. after Ctrl-C in run_batch) only signals the worker
+    _stop_solver()
+    raise SystemExit(1)
+
+
+def schedule_job(job: BatchJob, output_dir: str) -> JobResult:
+    """
+    Runs one job headlessly (the same pipeline as main.run, without prompts) and writes its
+    schedule in each of job.formats, plus its parse failures if there are any
+    """
+    outputs = []
+    path = os.path.join(output_dir, job.name)
+
+    with span("ingest"):
+        responses = ingest_responses(
+            job.csv_file, False, job.corrections_file, job.block_minutes, job.hours
+        )
+    availability = responses.availability
+    if responses.failures:
+        write_failures(responses.failures, f"{path}.parse_failures.csv")
+        outputs.append(f"{path}.parse_failures.csv")
+
+    with span("allocate"):
+        feasible_blocks = allocate_feasible_blocks(
+            responses.requested_hours,
+            blocks_to_hours(availability.num_blocks, job.block_minutes),
+            block_minutes=job.block_minutes,
+            min_hours=job.min_hours,
+            max_hours=job.max_hours,
+        )
+    if job.overrides_file is not None:
+        apply_overrides(availability, load_overrides(job.overrides_file))
+
+    daily_max_blocks = int(hours_to_blocks(job.daily_max_hours, job.block_minutes))
+    num_consultants = len(availability.consultants)
+
+    violations = precheck(availability, feasible_blocks, daily_max_blocks)
+    if violations:
+        return JobResult(
+            job.name,
+            LpSolution[LpSolutionInfeasible],
+            num_consultants,
+            None,
+            0.0,
+            outputs,
+            violations[0].message,
+        )
+
+    with span("build"):
+        model = ScheduleModel(
+            availability,
+            feasible_blocks,
+            presolve=True,
+            daily_max_blocks=daily_max_blocks,
+        )
+        model.set_preference_costs(job.preference_costs)
+        model.set_shift_change_penalty(job.shift_change_penalty)
+
+    with span("solve"):
+        model.solve(
+            job.backend, time_limit=job.time_limit, gap_rel=job.gap_rel, msg=False
+        )
+
+    sol_status = model.prob.sol_status
+    if sol_status not in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+        return JobResult(
+            job.name, LpSolution[sol_status], num_consultants, None, 0.0, outputs
+        )
+
+    with span("export"):
+        formatter = ScheduleFormatter(model.x, availability.to_df())
+        for export_format in job.formats:
+            getattr(formatter, f"export_{export_format}")(f"{path}.{export_format}")
+            outputs.append(f"{path}.{export_format}")
+
+    return JobResult(
+        job.name,
+        LpSolution[sol_status],
+        num_consultants,
+        value(model.prob.objective),
+        0.0,
+        outputs,
+    )
+
+
+def _run_job(job: BatchJob, output_dir: str) -> JobResult:
+    """
+    Pool worker: runs a job with a hard time limit, reporting any failure as the job's result
+    rather than raising, so one bad job doesn't stop the batch
+    """
+    # own process group, so the solver subprocess can be stopped along with the worker: on a
+    # timeout, or when the pool is terminated. The group no longer gets the terminal's Ctrl-C,
+    # which reaches the pool through the parent instead
+    own_group = hasattr(os, "setsid")
+    if own_group:
+        if os.getpgrp() != os.getpid():
+            os.setsid()
+        signal.signal(signal.SIGTERM, _terminated)
+
+    has_alarm = job.time_limit is not None and hasattr(signal, "SIGALRM")
+    if has_alarm:
+        signal.signal(signal.SIGALRM, _timeout)
+        signal.alarm(int(job.time_limit) + JOB_GRACE)
+
+    trace_file = (
+        os.path.join(output_dir, f"{job.name}.trace.jsonl") if job.trace else None
+    )
+    start = time.perf_counter()
+    try:
+        with tracing(trace_file), span("job", job=job.name):
+            result = schedule_job(job, output_dir)
+    except TimeoutError as e:
+        result = JobResult(job.name, "timed out", 0, None, 0.0, [], str(e))
+    except Exception as e:
+        result = JobResult(job.name, "failed", 0, None, 0.0, [], repr(e))
+    finally:
+        if has_alarm:
+            signal.alarm(0)
+        if own_group:
+            _stop_solver()
+
+    if trace_file is not None:
+        result = result._replace(outputs=result.outputs + [trace_file])
+    return result._replace(seconds=time.perf_counter() - start)
+
+
+def _run_job_star(args: tuple) -> JobResult:
+    return _run_job(*args)
+
+
+def run_batch(
+    jobs: list[BatchJob] | str,
+    output_dir: Optional[str] = None,
+    processes: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Runs every job of a batch in a process pool (one job per core by default) and writes each
+    job's schedule to output_dir, followed by a summary of every job to BATCH_SUMMARY there.
+
+    jobs: list of BatchJobs, or the path to a manifest (see load_manifest())
+    output_dir: where to write the schedules (defaults to the manifest's output_dir)
+
+    Returns the summary table, one row per job in manifest order
+    """
+    if isinstance(jobs, str):
+        jobs, manifest_output_dir = load_manifest(jobs)
+        output_dir = output_dir or manifest_output_dir
+    if output_dir is None:
+        output_dir = DEFAULT_OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_processes = min(processes or os.cpu_count() or 1, len(jobs)) or 1
+    logger.info(f"Running {len(jobs)} jobs on {num_processes} processes")
+
+    results = []
+    # a fresh worker per job, so one job's state (or crash) never leaks into the next
+    with multiprocessing.Pool(num_processes, maxtasksperchild=1) as pool:
+        tasks = [(job, output_dir) for job in jobs]
+        for result in pool.imap(_run_job_star, tasks):
+            logger.info(f"{result.name}: {result.status} in {result.seconds:.1f}s")
+            results.append(result)
+
+    summary = pd.DataFrame(results, columns=list(JobResult._fields))
+    summary["outputs"] = summary["outputs"].str.join(" ")
+    summary.to_csv(os.path.join(output_dir, BATCH_SUMMARY), index=False)
+
+    return summary
+
+
+if __name__ == "__main__":
+    # TODO: use fire
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    summary = run_batch(sys.argv[1])
+    print(summary.drop(columns="outputs").to_string(index=False))
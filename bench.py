@@ -0,0 +1,362 @@
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pulp  # type: ignore
+from pulp.constants import (  # type: ignore
+    LpSolutionIntegerFeasible,
+    LpSolutionOptimal,
+    LpStatusInfeasible,
+)
+
+from lp import CONSULTANT_MAX_HOURS, CONSULTANT_MIN_HOURS, ScheduleModel, precheck
+from read_csv import (
+    DAY_COLUMNS,
+    EMAIL_COLNAME,
+    allocate_feasible_blocks,
+    ingest_responses,
+)
+from sched_format import ScheduleFormatter
+from sched_setup import (
+    BLOCK_MINUTES,
+    PREF_NEUTRAL,
+    PREF_NOT_PREFERABLE,
+    PREF_PREFERABLE,
+    PREF_UNAVAILABLE,
+    SUNLAB_HOURS,
+    AvailabilityMatrix,
+    _time_str_to_minutes,
+    blocks_to_hours,
+)
+from solvers import DEFAULT_BACKEND
+from sweep import parameter_grid
+
+BENCH_REPORT = "bench_report.json"
+
+# lab-hour layouts the synthetic rosters can be generated for
+LAB_LAYOUTS = {
+    "sunlab": SUNLAB_HOURS,
+    "weekdays": {day: ("09:00", "17:00") for day in range(5)},
+    "late": {day: ("12:00", "02:00") for day in range(7)},
+}
+
+# cases run by run_benchmarks() when none are given
+DEFAULT_CASES = parameter_grid(
+    num_consultants=[15, 50, 200, 1000],
+    density=[0.3, 0.6],
+    block_minutes=[BLOCK_MINUTES],
+    layout=["sunlab"],
+) + parameter_grid(
+    num_consultants=[50],
+    density=[0.5],
+    block_minutes=[15, 60],
+    layout=list(LAB_LAYOUTS),
+)
+
+# pipeline stages timed by run_case(), in order
+STAGES = ["ingest", "allocate", "precheck", "build", "solve", "format"]
+
+
+def _format_time(minutes: int) -> str:
+    """
+    Minutes since midnight as a responses-style time, e.g. "9am" or "10:30pm"
+    """
+    hour, minute = divmod(minutes % (24 * 60), 60)
+    period = "am" if hour < 12 else "pm"
+    hour = hour % 12 or 12
+    return f"{hour}{period}" if minute == 0 else f"{hour}:{minute:02}{period}"
+
+
+def synthetic_responses(
+    num_consultants: int,
+    density: float = 0.5,
+    seed: int = 0,
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS,
+) -> pd.DataFrame:
+    """
+    A responses df in the same format as the responses CSV (see example/availability.csv).
+    Each consultant is available for about density of each day's opening hours, in one or two
+    ranges on a half-hour grid, and requests enough hours (at most CONSULTANT_MAX_HOURS) that the
+    requests add up to about the lab's weekly hours or more. Ranges of a late opening that start
+    after midnight are written under the next day, as a consultant would fill in the form
+    """
+    rng = np.random.default_rng(seed)
+    days = {day: number for number, day in enumerate(DAY_COLUMNS)}
+
+    # request enough hours on average to fill the lab, as allocate_feasible_blocks() requires
+    lab_hours = blocks_to_hours(AvailabilityMatrix.from_hours(hours, []).num_blocks)
+    min_request = int(
+        np.clip(
+            np.ceil(lab_hours / num_consultants),
+            CONSULTANT_MIN_HOURS,
+            CONSULTANT_MAX_HOURS,
+        )
+    )
+    open_ranges = {
+        day: (_time_str_to_minutes(open_time), _time_str_to_minutes(close_time))
+        for day, (open_time, close_time) in hours.items()
+    }
+    day_names = list(DAY_COLUMNS)
+
+    columns = {day: [] for day in DAY_COLUMNS}
+    for _ in range(num_consultants):
+        ranges = {day: [] for day in DAY_COLUMNS}
+        for day, number in days.items():
+            if number not in open_ranges or rng.random() > min(2 * density, 1):
+                continue
+
+            open_minutes, close_minutes = open_ranges[number]
+            if close_minutes <= open_minutes:
+                close_minutes += 24 * 60
+            num_slots = (close_minutes - open_minutes) // 30
+
+            # available half the days at twice the density, split into one or two ranges
+            length = max(1, round(min(2 * density, 1) * num_slots))
+            pieces = rng.integers(1, 3)
+            for piece in np.array_split(np.arange(length), pieces):
+                start = open_minutes + 30 * rng.integers(0, num_slots - len(piece) + 1)
+                range_day = number
+                if start >= 24 * 60:
+                    if number + 1 < len(day_names):
+                        # after midnight: the next day's early hours
+                        range_day, start = number + 1, start - 24 * 60
+                    else:
+                        # the week's last night has no next day in the form, so start the
+                        # range before midnight instead
+                        start = 24 * 60 - 30
+                ranges[day_names[range_day]].append(
+                    f"{_format_time(start)}-{_format_time(start + 30 * len(piece))}"
+                )
+
+        for day, day_ranges in ranges.items():
+            columns[day].append(", ".join(day_ranges) or "None")
+
+    return pd.DataFrame(
+        {
+            "Timestamp": "2/5/2025 10:30:00",
+            EMAIL_COLNAME: [
+                f"consultant{i:04}@brown.edu" for i in range(num_consultants)
+            ],
+            "Requested hours": rng.integers(
+                min_request, CONSULTANT_MAX_HOURS + 1, num_consultants
+            ),
+            **columns,
+            "Other preferences": "",
+        }
+    )
+
+
+def synthetic_preferences(availability: AvailabilityMatrix, seed: int = 0):
+    """
+    Replaces the neutral preference level of every available block with a random level, as if
+    overrides had been applied (modifies availability in place)
+    """
+    rng = np.random.default_rng(seed)
+    available = availability.values != PREF_UNAVAILABLE
+    levels = rng.choice(
+        [PREF_PREFERABLE, PREF_NEUTRAL, PREF_NOT_PREFERABLE], size=available.sum()
+    )
+    availability.values[available] = levels
+
+
+def synthetic_availability(
+    num_consultants: int,
+    density: float = 0.5,
+    seed: int = 0,
+    block_minutes: int = BLOCK_MINUTES,
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS,
+) -> AvailabilityMatrix:
+    """
+    An availability matrix where each block is available with probability density, at a random
+    preference level
+    """
+    rng = np.random.default_rng(seed)
+    availability = AvailabilityMatrix.from_hours(
+        hours,
+        [f"consultant{i:04}@brown.edu" for i in range(num_consultants)],
+        block_minutes,
+    )
+    available = rng.random(availability.values.shape) < density
+    availability.values[available] = PREF_NEUTRAL
+    synthetic_preferences(availability, seed)
+    return availability
+
+
+@contextmanager
+def _measure(results: dict, stage: str, memory: bool) -> Iterator[None]:
+    """
+    Records the wall time (and, with memory, the peak traced allocation) of the block under
+    results[stage]
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[stage] = {"seconds": time.perf_counter() - start}
+        if memory:
+            results[stage]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def run_case(
+    num_consultants: int,
+    density: float = 0.5,
+    block_minutes: int = BLOCK_MINUTES,
+    layout: str = "sunlab",
+    seed: int = 0,
+    memory: bool = True,
+    backend: str = DEFAULT_BACKEND,
+    **solver_options,
+) -> dict:
+    """
+    Runs the pipeline on a synthetic roster, timing each of STAGES separately:
+    - ingest: ingest_responses() on a generated responses CSV
+    - allocate: allocate_feasible_blocks()
+    - precheck: precheck(), as in create_schedule()
+    - build: building the (presolved) model
+    - solve: solving it, unless precheck found a violation
+    - format: ScheduleFormatter on the schedule, if the solve found one
+
+    Large rosters are usually infeasible (every consultant needs at least one block), so they only
+    time the stages up to build
+
+    memory: also record each stage's peak traced allocation (tracemalloc slows the stages down)
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+
+    Returns the case's parameters, precheck violations, model size, solve status, solution
+    status and gap, and stage measurements
+    """
+    hours = LAB_LAYOUTS[layout]
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "responses.csv")
+        synthetic_responses(num_consultants, density, seed, hours).to_csv(
+            csv_file, index=False
+        )
+        with _measure(stages, "ingest", memory):
+            responses = ingest_responses(
+                csv_file, False, block_minutes=block_minutes, hours=hours
+            )
+
+    availability = responses.availability
+    synthetic_preferences(availability, seed)
+    total_hours = blocks_to_hours(availability.num_blocks, block_minutes)
+
+    with _measure(stages, "allocate", memory):
+        feasible_blocks = allocate_feasible_blocks(
+            responses.requested_hours,
+            total_hours,
+            block_minutes=block_minutes,
+        )
+
+    with _measure(stages, "precheck", memory):
+        violations = precheck(availability, feasible_blocks)
+
+    with _measure(stages, "build", memory):
+        model = ScheduleModel(availability, feasible_blocks, presolve=True)
+
+    # create_schedule() wouldn't solve a model that fails the precheck, and CBC can take much
+    # longer to prove it infeasible than to solve a feasible one
+    status, sol_status, gap = LpStatusInfeasible, None, None
+    if not violations:
+        options = {"msg": False, **solver_options}
+        time_limit = options.pop("time_limit", None)
+        gap_rel = options.pop("gap_rel", None)
+        with _measure(stages, "solve", memory):
+            # solve_anytime() also reports the final gap. The status alone can't tell a
+            # time-limited CBC run from a proven optimum (both are "Optimal")
+            result = model.solve_anytime(time_limit, gap_rel, None, backend, **options)
+        status, sol_status, gap = (
+            result.status,
+            model.prob.sol_status,
+            result.progress.gap,
+        )
+
+    # an infeasible or unfinished solve has no schedule to format
+    if sol_status in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+        with _measure(stages, "format", memory):
+            ScheduleFormatter(model.x, availability.to_df())
+
+    return {
+        "num_consultants": num_consultants,
+        "density": density,
+        "block_minutes": block_minutes,
+        "layout": layout,
+        "seed": seed,
+        "num_blocks": availability.num_blocks,
+        "num_variables": model.stats["num_variables"],
+        "num_constraints": model.stats["num_constraints"],
+        "violations": [violation.message for violation in violations],
+        "status": pulp.LpStatus[status],
+        # "Optimal" only for proven optima, "Integer Feasible" for unproven schedules (e.g. at the
+        # time limit)
+        "solution_status": None if sol_status is None else pulp.LpSolution[sol_status],
+        "gap": gap,
+        "stages": stages,
+    }
+
+
+def run_benchmarks(
+    cases: Optional[list[dict]] = None,
+    report_file: Optional[str] = BENCH_REPORT,
+    memory: bool = True,
+    **solver_options,
+) -> dict:
+    """
+    Runs each case (keyword arguments for run_case(), defaults to DEFAULT_CASES) and writes a
+    JSON report with the environment and every case's results to report_file
+
+    solver_options: passed through to run_case(), e.g. time_limit to cap the largest rosters
+    """
+    if cases is None:
+        cases = DEFAULT_CASES
+
+    results = []
+    for case in cases:
+        result = run_case(memory=memory, **case, **solver_options)
+        results.append(result)
+        timings = ", ".join(
+            f"{stage} {result['stages'][stage]['seconds']:.3f}s"
+            for stage in STAGES
+            if stage in result["stages"]
+        )
+        print(
+            f"{result['num_consultants']} consultants, density {result['density']}, "
+            + f"{result['block_minutes']}-minute blocks, {result['layout']} hours: "
+            + f"{result['solution_status'] or result['status']} ({timings})"
+        )
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "pulp": pulp.__version__,
+        },
+        "memory_traced": memory,
+        "solver_options": solver_options,
+        "cases": results,
+    }
+    if report_file is not None:
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report written to {report_file}")
+
+    return report
+
+
+if __name__ == "__main__":
+    run_benchmarks(time_limit=60)
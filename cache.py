@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+from pulp import value  # type: ignore
+from pulp.constants import LpSolutionOptimal  # type: ignore
+
+from sched_setup import AvailabilityMatrix
+from tracing import count
+
+DEFAULT_CACHE_DIR = ".sched_cache"
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_AGE = 60 * 60 * 24 * 30  # 30 days, in seconds
+
+
+def schedule_key(
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+    preference_costs: dict[int, int],
+    shift_change_penalty: float,
+    daily_max_blocks: int,
+    solver_settings: dict,
+) -> str:
+    """
+    Stable hash of everything that determines the output of create_schedule()
+    """
+    h = hashlib.sha256()
+
+    # the block axis is week-relative, so the key doesn't depend on which week the blocks are
+    # anchored to
+    h.update(json.dumps([str(c) for c in availability.consultants]).encode())
+    h.update(availability.block_starts.tobytes())
+
+    avail = np.ascontiguousarray(availability.values)
+    h.update(str(avail.shape).encode())
+    h.update(avail.tobytes())
+
+    params = {
+        "feasible_blocks": (
+            None
+            if feasible_blocks is None
+            else sorted(
+                (str(c), int(lo), int(hi)) for c, (lo, hi) in feasible_blocks.items()
+            )
+        ),
+        "preference_costs": sorted(preference_costs.items()),
+        "shift_change_penalty": shift_change_penalty,
+        "daily_max_blocks": daily_max_blocks,
+        "solver_settings": sorted(solver_settings.items()),
+    }
+    h.update(json.dumps(params, default=str).encode())
+
+    return h.hexdigest()
+
+
+def _remove(path: str):
+    """
+    Removes path if it still exists (another process sharing the cache may have removed it first)
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SolveCache:
+    """
+    On-disk cache of solved schedules, keyed by schedule_key(). Entries are evicted once they are
+    older than max_age seconds or once there are more than max_entries of them (least recently
+    used first).
+
+    Several processes can share a directory: entries are written atomically through unique
+    temporary files, and an entry another process removes in the meantime is just a miss.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(
+        self, key: str, availability: AvailabilityMatrix
+    ) -> Optional[tuple[int, dict]]:
+        """
+        Looks up a stored (status, x) for key, mapped onto the time slots of availability. x maps each
+        available (consultant, time) pair to 1 if assigned or 0 otherwise.
+
+        Returns None on a miss.
+        """
+        path = self._path(key)
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                _remove(path)
+                raise FileNotFoundError(path)
+
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        # entries that aren't proven optima (e.g. from a time-limited solve) are never returned
+        if entry is None or entry.get("sol_status") != LpSolutionOptimal:
+            self.misses += 1
+            count("cache_misses")
+            return None
+
+        # refresh mtime so eviction is least-recently-used. Another process may have evicted the
+        # entry since it was read, which doesn't make the entry read any less valid
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        count("cache_hits")
+
+        # blocks are stored by position, which the key guarantees lines up with availability
+        assigned = np.zeros(availability.values.shape, dtype=bool)
+        if entry["assigned"]:
+            assigned[tuple(np.array(entry["assigned"]).T)] = True
+
+        return entry["status"], availability.assignments(assigned)
+
+    def put(
+        self,
+        key: str,
+        availability: AvailabilityMatrix,
+        status: int,
+        x: dict,
+        sol_status: int,
+    ):
+        """
+        Stores the status, solution status (see pulp.constants.LpSolution) and assigned
+        (consultant, time) pairs of a solved schedule. Only entries with an optimal sol_status are
+        returned by get()
+        """
+        consultant_index = {c: i for i, c in enumerate(availability.consultants)}
+        slot_index = {t: j for j, t in enumerate(availability.time_index())}
+
+        assigned = [
+            (consultant_index[c], slot_index[t])
+            for (c, t), var in x.items()
+            if (value(var) or 0) > 0.5
+        ]
+
+        # a unique temporary file, so processes storing the same key don't write over each other
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=key, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {"status": status, "sol_status": sol_status, "assigned": assigned},
+                    f,
+                )
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones beyond max_entries
+        """
+        now = time.time()
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue  # removed by another process since listdir()
+
+            if now - mtime > self.max_age:
+                _remove(path)
+            else:
+                entries.append((mtime, path))
+
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries :]:
+            _remove(path)
+
+    def clear(self):
+        """
+        Removes all cache entries and resets the hit/miss counters
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                _remove(os.path.join(self.directory, name))
+
+        self.hits = 0
+        self.misses = 0
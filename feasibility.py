@@ -0,0 +1,146 @@
+import logging
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix
+
+logger = logging.getLogger(__name__)
+
+
+class Violation(NamedTuple):
+    """
+    A necessary condition for a feasible schedule that doesn't hold
+    """
+
+    kind: str
+    message: str
+    consultants: Sequence[str] = ()
+    slots: Sequence = ()  # time slots (pd.Timestamp)
+
+
+def _names(items, limit: int = 5) -> str:
+    names = [f"{t:%a %H:%M}" if hasattr(t, "strftime") else str(t) for t in items]
+    if len(names) > limit:
+        return ", ".join(names[:limit]) + f" and {len(names) - limit} more"
+    return ", ".join(names)
+
+
+def check_feasibility(
+    availability: AvailabilityMatrix,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: int,
+) -> list[Violation]:
+    """
+    Checks necessary conditions for the scheduling model to be feasible using counts alone, so
+    obviously infeasible inputs are caught before building and solving the model. An empty list
+    doesn't guarantee the model is feasible.
+
+    day_starts: index of each day's first slot
+    weekly_min, weekly_max: (consultants,) weekly block bounds
+    daily_max: per-day block cap
+    """
+    consultants = np.asarray(availability.consultants, dtype=object)
+    time_slots = availability.time_index()
+    available = availability.values != PREF_UNAVAILABLE
+    num_slots = available.shape[1]
+    slots_per_day = np.diff(day_starts, append=num_slots)
+
+    # most blocks each consultant can work per day and per week
+    available_day = np.add.reduceat(available.astype(np.int64), day_starts, axis=1)
+    capacity_day = np.minimum(available_day, daily_max)
+    capacity_week = np.minimum(capacity_day.sum(axis=1), weekly_max)
+
+    violations = []
+
+    uncovered = ~available.any(axis=0)
+    if uncovered.any():
+        slots = list(time_slots[uncovered])
+        violations.append(
+            Violation(
+                "uncovered_slots",
+                f"{len(slots)} slots have no available consultant: {_names(slots)}",
+                slots=slots,
+            )
+        )
+
+    bad_bounds = weekly_min > weekly_max
+    if bad_bounds.any():
+        names = list(consultants[bad_bounds])
+        violations.append(
+            Violation(
+                "min_exceeds_max",
+                f"weekly minimum is above the weekly maximum for {_names(names)}",
+                consultants=names,
+            )
+        )
+
+    total_min = int(weekly_min.sum())
+    if total_min > num_slots:
+        violations.append(
+            Violation(
+                "total_min_exceeds_slots",
+                f"weekly minimums add up to {total_min} blocks but there are only "
+                + f"{num_slots} slots",
+            )
+        )
+
+    total_capacity = int(capacity_week.sum())
+    if total_capacity < num_slots:
+        violations.append(
+            Violation(
+                "total_capacity_below_slots",
+                f"consultants can work at most {total_capacity} blocks (weekly maximums and "
+                + f"daily caps) but there are {num_slots} slots",
+            )
+        )
+
+    short_available = available.sum(axis=1) < weekly_min
+    if short_available.any():
+        names = list(consultants[short_available])
+        violations.append(
+            Violation(
+                "min_exceeds_available",
+                f"fewer available blocks than the weekly minimum for {_names(names)}",
+                consultants=names,
+            )
+        )
+
+    # only report consultants not already reported above
+    short_capacity = (capacity_day.sum(axis=1) < weekly_min) & ~short_available
+    if short_capacity.any():
+        names = list(consultants[short_capacity])
+        violations.append(
+            Violation(
+                "min_exceeds_daily_capacity",
+                f"weekly minimum can't be reached within {daily_max} blocks per day for "
+                + _names(names),
+                consultants=names,
+            )
+        )
+
+    short_days = capacity_day.sum(axis=0) < slots_per_day
+    if short_days.any():
+        slots = list(time_slots[day_starts[short_days]])
+        violations.append(
+            Violation(
+                "daily_capacity_below_slots",
+                "not enough consultant blocks within the daily cap to cover "
+                + ", ".join(f"{t:%a}" for t in slots),
+                slots=slots,
+            )
+        )
+
+    return violations
+
+
+def log_violations(violations: list[Violation]):
+    """
+    Logs the violated conditions as one warning (printing them is left to CLI callers)
+    """
+    logger.warning(
+        f"Schedule is infeasible ({len(violations)} problems found before solving):"
+        + "".join(f"\n - {violation.message}" for violation in violations)
+    )
@@ -0,0 +1,609 @@
+import logging
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from lp import (
+    PREFERENCE_COSTS,
+    SHIFT_CHANGE_PENALTY,
+    _as_matrix,
+    _daily_max_blocks,
+    _day_starts,
+    _preference_cost_lookup,
+    _weekly_bounds,
+)
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix
+from shift_patterns import ShiftColumns, enumerate_shifts
+
+logger = logging.getLogger(__name__)
+
+# rounds of price updates in cover_with_prices()
+PRICE_ROUNDS = 60
+# price change per block a consultant is over/under their weekly bounds, in the first round
+PRICE_STEP = 1
+
+# in local_search(), the cost of each block above or below a weekly/daily bound. Bigger than any
+# possible saving from a single move, so moves never trade feasibility for cost
+VIOLATION_COST = 1000
+
+MAX_SEARCH_PASSES = 50
+# local_search() stops after this many seconds, keeping the moves made so far, so fast mode stays
+# quick on large rosters
+SEARCH_TIME_LIMIT = 0.25
+
+
+class _Schedule:
+    """
+    Assignment of one consultant per slot with the counts needed to evaluate moves incrementally
+    """
+
+    def __init__(
+        self,
+        owner: np.ndarray,
+        available: np.ndarray,
+        costs: np.ndarray,
+        day_of_slot: np.ndarray,
+        num_days: int,
+        weekly_min: np.ndarray,
+        weekly_max: np.ndarray,
+        daily_max: int,
+        shift_change_penalty: float,
+    ):
+        num_consultants, num_slots = available.shape
+        self.owner = owner
+        self.available = available
+        self.costs = costs
+        self.day_of_slot = day_of_slot
+        self.weekly_min = weekly_min
+        self.weekly_max = weekly_max
+        self.daily_max = daily_max
+        self.penalty = shift_change_penalty
+
+        # prev_pair[c, t]: blocks t - 1 and t are both available to c on the same day, so a shift
+        # change between them is penalized (same pairs as lp._shift_change_pairs())
+        same_day = np.zeros(num_slots, dtype=bool)
+        same_day[1:] = day_of_slot[1:] == day_of_slot[:-1]
+        self.prev_pair = np.zeros_like(available)
+        self.prev_pair[:, 1:] = (
+            available[:, 1:] & available[:, :-1] & same_day[None, 1:]
+        )
+        self.next_pair = np.zeros_like(available)
+        self.next_pair[:, :-1] = self.prev_pair[:, 1:]
+
+        self.assigned = np.zeros_like(available)
+        covered = owner >= 0
+        self.assigned[owner[covered], np.flatnonzero(covered)] = True
+        self.weekly = self.assigned.sum(axis=1)
+        self.daily = np.zeros((num_consultants, num_days), dtype=np.int64)
+        np.add.at(self.daily, (owner[covered], day_of_slot[covered]), 1)
+
+    def _weekly_violation(self, blocks: np.ndarray) -> np.ndarray:
+        return np.maximum(self.weekly_min - blocks, 0) + np.maximum(
+            blocks - self.weekly_max, 0
+        )
+
+    def _daily_violation(self, blocks: np.ndarray) -> np.ndarray:
+        return np.maximum(blocks - self.daily_max, 0)
+
+    def move_deltas(self, start: int, end: int) -> np.ndarray:
+        """
+        Change in cost from giving slots [start, end) of one day, all owned by the same
+        consultant, to each other consultant (inf where they aren't available for all of them)
+        """
+        o = self.owner[start]
+        d = self.day_of_slot[start]
+        n = end - start
+        before = (
+            self.assigned[:, start - 1] if start > 0 else np.zeros_like(self.weekly)
+        )
+        after = (
+            self.assigned[:, end]
+            if end < len(self.owner)
+            else np.zeros_like(self.weekly)
+        )
+        before = before.astype(np.int64)
+        after = after.astype(np.int64)
+
+        delta = self.costs[:, start:end].sum(axis=1) - self.costs[o, start:end].sum()
+
+        # consultants taking the slots: each end of the range bordering one of their available
+        # but unassigned blocks becomes a shift change, and bordering one of their assigned blocks
+        # stops being one
+        delta += self.penalty * (
+            self.prev_pair[:, start] * (1 - 2 * before)
+            + self.next_pair[:, end - 1] * (1 - 2 * after)
+        )
+        # the owner giving them up: the reverse
+        delta += self.penalty * (
+            self.prev_pair[o, start] * (2 * before[o] - 1)
+            + self.next_pair[o, end - 1] * (2 * after[o] - 1)
+        )
+
+        weekly = self.weekly
+        daily = self.daily[:, d]
+        delta += VIOLATION_COST * (
+            self._weekly_violation(weekly + n)
+            - self._weekly_violation(weekly)
+            + self._daily_violation(daily + n)
+            - self._daily_violation(daily)
+        )
+        delta += VIOLATION_COST * (
+            self._weekly_violation(weekly[o] - n)[o]
+            - self._weekly_violation(weekly)[o]
+            + self._daily_violation(daily[o] - n)
+            - self._daily_violation(daily[o])
+        )
+
+        delta = delta.astype(float)
+        delta[~self.available[:, start:end].all(axis=1)] = np.inf
+        delta[o] = np.inf
+        return delta
+
+    def _single_block_changes(self) -> np.ndarray:
+        """
+        Change in shift change cost if each consultant took each single block they don't have,
+        with the rest of the schedule unchanged (negated, the change from giving up a block they
+        have)
+        """
+        assigned = self.assigned.astype(np.int64)
+        prev = np.zeros_like(assigned)
+        prev[:, 1:] = assigned[:, :-1]
+        next = np.zeros_like(assigned)
+        next[:, :-1] = assigned[:, 1:]
+
+        return self.penalty * (
+            self.prev_pair * (1 - 2 * prev) + self.next_pair * (1 - 2 * next)
+        )
+
+    def _block_changes(self, c: np.ndarray, t: np.ndarray) -> np.ndarray:
+        """
+        Entries [c, t] of _single_block_changes(), without computing the whole array
+        """
+        t_prev = np.maximum(t - 1, 0)
+        t_next = np.minimum(t + 1, len(self.owner) - 1)
+        prev = self.assigned[c, t_prev].astype(np.int64)
+        next = self.assigned[c, t_next].astype(np.int64)
+        # prev_pair is False in the first slot and next_pair in the last, so the clipped indices
+        # never count
+        return self.penalty * (
+            self.prev_pair[c, t] * (1 - 2 * prev)
+            + self.next_pair[c, t] * (1 - 2 * next)
+        )
+
+    def exchange_deltas(self, t: int) -> np.ndarray:
+        """
+        Change in cost from swapping the owner of slot t with the owner of each other slot
+        (inf where that isn't possible). Slots next to t are left out, since their shift changes
+        interact
+        """
+        o = self.owner[t]
+        d = self.day_of_slot[t]
+        others = self.owner
+        valid = (
+            (others >= 0)
+            & (others != o)
+            & (np.abs(np.arange(len(others)) - t) > 1)
+            & self.available[o]
+            & self.available[others, t]
+        )
+        c = np.where(valid, others, 0)
+        slots = np.arange(len(others))
+        ts = np.full(len(others), t)
+
+        delta = (
+            self.costs[o, slots]
+            + self.costs[c, t]
+            - self.costs[o, t]
+            - self.costs[c, slots]
+            + self._block_changes(np.full(len(others), o), slots)
+            - self._block_changes(np.array([o]), np.array([t]))
+            + self._block_changes(c, ts)
+            - self._block_changes(c, slots)
+        )
+
+        # weekly counts don't change, but daily counts do if the slots are on different days
+        days = self.day_of_slot
+        other_day = days != d
+        delta += (
+            VIOLATION_COST
+            * other_day
+            * (
+                self._daily_violation(self.daily[o, d] - 1)
+                - self._daily_violation(self.daily[o, d])
+                + self._daily_violation(self.daily[o, days] + 1)
+                - self._daily_violation(self.daily[o, days])
+                + self._daily_violation(self.daily[c, days] - 1)
+                - self._daily_violation(self.daily[c, days])
+                + self._daily_violation(self.daily[c, d] + 1)
+                - self._daily_violation(self.daily[c, d])
+            )
+        )
+
+        return np.where(valid, delta, np.inf)
+
+    def chain_deltas(self, t: int) -> np.ndarray:
+        """
+        Change in cost from giving slot t to the owner of another slot t2, who in turn gives t2 to
+        a third consultant, as a (t2, third consultant) array (inf where that isn't possible). Lets
+        a consultant over a bound hand a block to someone who is already at theirs. Slots next to t
+        are left out, since their shift changes interact
+        """
+        o = self.owner[t]
+        d = self.day_of_slot[t]
+        num_slots = len(self.owner)
+        slots = np.arange(num_slots)
+        days = self.day_of_slot
+
+        c = self.owner
+        valid_slot = (
+            (c >= 0)
+            & (c != o)
+            & (np.abs(slots - t) > 1)
+            & self.available[np.maximum(c, 0), t]
+        )
+        c = np.maximum(c, 0)
+        gain = self._single_block_changes()
+
+        # o gives up t
+        delta = (
+            -self.costs[o, t]
+            - gain[o, t]
+            + VIOLATION_COST
+            * (
+                self._weekly_violation(self.weekly[o] - 1)[o]
+                - self._weekly_violation(self.weekly)[o]
+                + self._daily_violation(self.daily[o, d] - 1)
+                - self._daily_violation(self.daily[o, d])
+            )
+        )
+        # the owner c of each t2 takes t and gives up t2, so their weekly count doesn't change
+        delta_c = (
+            self.costs[c, t]
+            - self.costs[c, slots]
+            + gain[c, t]
+            - gain[c, slots]
+            + VIOLATION_COST
+            * (days != d)
+            * (
+                self._daily_violation(self.daily[c, d] + 1)
+                - self._daily_violation(self.daily[c, d])
+                + self._daily_violation(self.daily[c, days] - 1)
+                - self._daily_violation(self.daily[c, days])
+            )
+        )
+        # each third consultant k takes t2
+        weekly_k = self._weekly_violation(self.weekly + 1) - self._weekly_violation(
+            self.weekly
+        )
+        daily_k = self._daily_violation(
+            self.daily[:, days] + 1
+        ) - self._daily_violation(self.daily[:, days])
+        delta_k = (
+            self.costs.T + gain.T + VIOLATION_COST * (weekly_k[None, :] + daily_k.T)
+        )
+
+        deltas = (delta + delta_c)[:, None] + delta_k
+        valid = valid_slot[:, None] & self.available.T
+        valid[slots, c] = False
+        valid[:, o] = False
+        return np.where(valid, deltas, np.inf)
+
+    def move(self, start: int, end: int, c: int):
+        o = self.owner[start]
+        d = self.day_of_slot[start]
+        n = end - start
+
+        self.owner[start:end] = c
+        self.assigned[o, start:end] = False
+        self.assigned[c, start:end] = True
+        self.weekly[o] -= n
+        self.weekly[c] += n
+        self.daily[o, d] -= n
+        self.daily[c, d] += n
+
+    def runs(self) -> list[tuple[int, int]]:
+        """
+        [start, end) ranges of consecutive slots on the same day owned by the same consultant
+        """
+        breaks = np.flatnonzero(
+            (np.diff(self.owner) != 0) | (np.diff(self.day_of_slot) != 0)
+        )
+        starts = np.concatenate(([0], breaks + 1))
+        ends = np.concatenate((breaks + 1, [len(self.owner)]))
+        return [
+            (s, e) for s, e in zip(starts.tolist(), ends.tolist()) if self.owner[s] >= 0
+        ]
+
+    def violations(self) -> int:
+        return int(
+            self._weekly_violation(self.weekly).sum()
+            + self._daily_violation(self.daily).sum()
+        )
+
+
+def local_search(
+    schedule: _Schedule,
+    max_passes: int = MAX_SEARCH_PASSES,
+    time_limit: Optional[float] = SEARCH_TIME_LIMIT,
+) -> int:
+    """
+    Improves the schedule in place by moving single slots and whole runs of slots to other
+    consultants, and by swapping the owners of two slots, while that lowers the cost (bound
+    violations count VIOLATION_COST per block). Swaps let consultants at their weekly maximum
+    trade blocks. If bounds are still broken after that, chains of two moves are tried too.
+
+    time_limit: stop after this many seconds (None for no limit), even if moves are left
+
+    Returns the number of moves made
+    """
+    num_moves = 0
+    num_slots = len(schedule.owner)
+    deadline = None if time_limit is None else perf_counter() + time_limit
+
+    def out_of_time() -> bool:
+        return deadline is not None and perf_counter() > deadline
+
+    for _ in range(max_passes):
+        improved = False
+
+        for start, end in schedule.runs() + [
+            (t, t + 1) for t in range(num_slots) if schedule.owner[t] >= 0
+        ]:
+            if out_of_time():
+                return num_moves
+            # earlier moves in this pass may have changed the owner of part of the range
+            if (schedule.owner[start:end] != schedule.owner[start]).any():
+                continue
+
+            deltas = schedule.move_deltas(start, end)
+            c = int(np.argmin(deltas))
+            if deltas[c] < -1e-9:
+                schedule.move(start, end, c)
+                num_moves += 1
+                improved = True
+
+        for t in range(num_slots):
+            if out_of_time():
+                return num_moves
+            if schedule.owner[t] < 0:
+                continue
+
+            deltas = schedule.exchange_deltas(t)
+            other = int(np.argmin(deltas))
+            if deltas[other] < -1e-9:
+                o, c = schedule.owner[t], schedule.owner[other]
+                schedule.move(t, t + 1, c)
+                schedule.move(other, other + 1, o)
+                num_moves += 1
+                improved = True
+
+        if not improved and schedule.violations() > 0:
+            # single moves and swaps can't fix the bounds, so try chains of two moves
+            for t in range(num_slots):
+                if out_of_time():
+                    return num_moves
+                if schedule.owner[t] < 0:
+                    continue
+
+                deltas = schedule.chain_deltas(t)
+                other, k = np.unravel_index(int(np.argmin(deltas)), deltas.shape)
+                if deltas[other, k] < -1e-9:
+                    c = schedule.owner[other]
+                    schedule.move(t, t + 1, c)
+                    schedule.move(other, other + 1, k)
+                    num_moves += 1
+                    improved = True
+
+        if not improved:
+            break
+
+    return num_moves
+
+
+def _shifts_by_end(columns: ShiftColumns, num_slots: int) -> list[np.ndarray]:
+    """
+    Indices of the shifts ending at each slot boundary 0..num_slots
+    """
+    end = columns.start + columns.length
+    by_end = np.argsort(end, kind="stable")
+    bounds = np.searchsorted(end[by_end], np.arange(num_slots + 2)).tolist()
+    return [by_end[bounds[e] : bounds[e + 1]] for e in range(num_slots + 1)]
+
+
+def _cheapest_cover(
+    columns: ShiftColumns,
+    num_slots: int,
+    uncovered: np.ndarray,
+    prices: np.ndarray,
+    ends: Optional[list[np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Cheapest set of shifts covering every slot exactly once (ignoring weekly and daily bounds),
+    with each block of a shift costing an extra price. Shifts never cross days, so this is a
+    shortest path from the first slot to the last with one edge per shift.
+
+    prices: (shifts,) extra price per block of each shift
+    uncovered: slots nobody is available for, which are skipped at no cost
+    ends: _shifts_by_end() of the columns, to reuse across calls (computed here if not given)
+
+    Returns the indices of the chosen shifts
+    """
+    cost = columns.cost + prices * columns.length
+    if ends is None:
+        ends = _shifts_by_end(columns, num_slots)
+
+    dist = np.full(num_slots + 1, np.inf)
+    dist[0] = 0
+    via = np.full(
+        num_slots + 1, -1
+    )  # shift ending at each slot boundary on the best path
+    for e in range(1, num_slots + 1):
+        ks = ends[e]
+        if len(ks):
+            totals = dist[columns.start[ks]] + cost[ks]
+            best = int(np.argmin(totals))
+            dist[e], via[e] = totals[best], ks[best]
+        if uncovered[e - 1] and dist[e - 1] < dist[e]:
+            dist[e], via[e] = dist[e - 1], -1
+
+    chosen = []
+    e = num_slots
+    while e > 0:
+        if via[e] < 0:
+            e -= 1
+        else:
+            chosen.append(via[e])
+            e = columns.start[via[e]]
+
+    return np.array(chosen, dtype=np.int64)
+
+
+def cover_with_prices(
+    columns: ShiftColumns,
+    num_slots: int,
+    num_days: int,
+    uncovered: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: int,
+) -> np.ndarray:
+    """
+    Builds a schedule from whole shifts: solves _cheapest_cover() with per-block prices, raising
+    the price of consultants over their weekly maximum or a daily cap and lowering it for those
+    under their weekly minimum (a Lagrangian relaxation of the bounds), and keeps the cover that
+    breaks the bounds by the fewest blocks.
+
+    Returns the indices of the chosen shifts
+    """
+    num_consultants = len(weekly_min)
+    over_price = np.zeros(num_consultants)
+    under_price = np.zeros(num_consultants)
+    daily_price = np.zeros((num_consultants, num_days))
+
+    # the shifts don't change between rounds, only their prices
+    ends = _shifts_by_end(columns, num_slots)
+
+    best, best_score = None, None
+    for round in range(PRICE_ROUNDS):
+        prices = (
+            over_price[columns.consultant]
+            - under_price[columns.consultant]
+            + daily_price[columns.consultant, columns.day]
+        )
+        chosen = _cheapest_cover(columns, num_slots, uncovered, prices, ends)
+
+        weekly = np.zeros(num_consultants)
+        np.add.at(weekly, columns.consultant[chosen], columns.length[chosen])
+        daily = np.zeros((num_consultants, num_days))
+        np.add.at(
+            daily,
+            (columns.consultant[chosen], columns.day[chosen]),
+            columns.length[chosen],
+        )
+        over, under = weekly - weekly_max, weekly_min - weekly
+        over_daily = daily - daily_max
+
+        violation = (
+            np.maximum(over, 0).sum()
+            + np.maximum(under, 0).sum()
+            + np.maximum(over_daily, 0).sum()
+        )
+        score = (violation, columns.cost[chosen].sum())
+        if best_score is None or score < best_score:
+            best, best_score = chosen, score
+
+        if violation == 0:
+            break
+
+        # move each price by at most one step per round, so prices don't overshoot and make
+        # the cover jump between consultants
+        step = PRICE_STEP / np.sqrt(1 + round)
+        over_price = np.maximum(over_price + step * np.sign(over), 0)
+        under_price = np.maximum(under_price + step * np.sign(under), 0)
+        daily_price = np.maximum(daily_price + step * np.sign(over_daily), 0)
+
+    return best
+
+
+def heuristic_assignment(
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+) -> tuple[np.ndarray, bool]:
+    """
+    Builds a schedule without a solver: cover_with_prices() followed by local_search().
+
+    Returns ((consultants x slots) mask of assigned blocks, whether every slot is covered within
+    the weekly and daily bounds)
+    """
+    weekly_min, weekly_max = _weekly_bounds(
+        availability.consultants, feasible_blocks, availability.block_minutes
+    )
+    daily_max = _daily_max_blocks(availability.block_minutes)
+    available = availability.values != PREF_UNAVAILABLE
+    costs = _preference_cost_lookup(PREFERENCE_COSTS)[availability.values]
+    day_starts = _day_starts(availability)
+    num_slots = available.shape[1]
+    day_of_slot = np.repeat(
+        np.arange(len(day_starts)), np.diff(day_starts, append=num_slots)
+    )
+
+    columns = enumerate_shifts(availability, weekly_max)
+    uncovered = ~available.any(axis=0)
+    chosen = columns.take(
+        cover_with_prices(
+            columns,
+            num_slots,
+            len(day_starts),
+            uncovered,
+            weekly_min,
+            weekly_max,
+            daily_max,
+        )
+    )
+
+    owner = np.full(num_slots, -1)
+    for c, s, n in zip(chosen.consultant, chosen.start, chosen.length):
+        owner[s : s + n] = c
+
+    schedule = _Schedule(
+        owner,
+        available,
+        costs,
+        day_of_slot,
+        len(day_starts),
+        weekly_min,
+        weekly_max,
+        daily_max,
+        SHIFT_CHANGE_PENALTY,
+    )
+    local_search(schedule)
+
+    feasible = schedule.violations() == 0 and not uncovered.any()
+    return schedule.assigned, feasible
+
+
+def heuristic_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+) -> tuple[bool, dict]:
+    """
+    Fast mode: builds a draft schedule with heuristic_assignment() without building or solving
+    the model. The schedule isn't guaranteed to be optimal. Takes a fraction of a second when the
+    bounds can be met (about 0.3s for 1000 consultants); when they can't, every PRICE_ROUNDS
+    round and the whole SEARCH_TIME_LIMIT are used, which adds up to about a second for 1000
+    consultants.
+
+    Returns (feasible, x) where x is the same as from lp.create_schedule() and feasible is False
+    if some slots are uncovered or weekly/daily bounds are broken
+    """
+    start = perf_counter()
+    availability = _as_matrix(df)
+    assigned, feasible = heuristic_assignment(availability, feasible_blocks)
+
+    logger.info(
+        f"Heuristic schedule built in {perf_counter() - start:.3f}s"
+        + ("" if feasible else " (breaks some bounds)")
+    )
+    return feasible, availability.assignments(assigned)
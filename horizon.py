@@ -0,0 +1,343 @@
+import logging
+import multiprocessing
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from pulp.constants import LpStatusOptimal  # type: ignore
+
+from cache import schedule_key
+from lp import (
+    CONSULTANT_MAX_HOURS,
+    PREFERENCE_COSTS,
+    SHIFT_CHANGE_PENALTY,
+    ScheduleModel,
+    _as_matrix,
+    _daily_max_blocks,
+    _weekly_bounds,
+    precheck,
+)
+from overrides import PreferenceOverride, apply_overrides
+from sched_setup import (
+    PREF_UNAVAILABLE,
+    SUNLAB_HOURS,
+    AvailabilityMatrix,
+    hours_to_blocks,
+)
+from solvers import DEFAULT_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# rounds of re-solving weeks with bounds moved towards each consultant's term target
+FAIRNESS_ROUNDS = 1
+
+
+class WeekSpec(NamedTuple):
+    """
+    One week of a horizon: its Monday, the lab's hours that week (leave out a day to close the
+    lab, e.g. for a holiday) and preference overrides on top of the base availability
+    """
+
+    week_start: pd.Timestamp
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS
+    overrides: Sequence[PreferenceOverride] = ()
+
+
+class HorizonResult(NamedTuple):
+    """
+    Output of plan_horizon()
+    """
+
+    # (week_start, status, x) for each week, with x keyed by that week's own dates
+    weeks: list[tuple[pd.Timestamp, int, dict]]
+    # per consultant: term target and assigned blocks, in blocks of the availability's length
+    totals: pd.DataFrame
+    # number of week models solved over all rounds (weeks with identical inputs are solved once)
+    distinct_weeks: int
+
+
+def semester_weeks(
+    first_week: str | pd.Timestamp,
+    num_weeks: int,
+    holidays: Optional[list[str | pd.Timestamp]] = None,
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS,
+) -> list[WeekSpec]:
+    """
+    num_weeks consecutive weeks starting the week of first_week, with the lab closed on holidays
+    """
+    monday = pd.Timestamp(first_week).normalize()
+    monday -= pd.Timedelta(days=monday.weekday())
+    closed = {pd.Timestamp(day).normalize() for day in holidays or []}
+
+    weeks = []
+    for w in range(num_weeks):
+        week_start = monday + pd.Timedelta(weeks=w)
+        week_hours = {
+            day: times
+            for day, times in hours.items()
+            if week_start + pd.Timedelta(days=day) not in closed
+        }
+        weeks.append(WeekSpec(week_start, week_hours))
+    return weeks
+
+
+def week_availability(base: AvailabilityMatrix, week: WeekSpec) -> AvailabilityMatrix:
+    """
+    The base availability on the week's lab hours, anchored to its dates, with its overrides
+    applied. Blocks outside the base's hours (e.g. longer opening hours) start out unavailable
+    """
+    availability = AvailabilityMatrix.from_hours(
+        week.hours, base.consultants, base.block_minutes
+    )
+    availability.week_start = week.week_start
+
+    index = np.searchsorted(base.block_starts, availability.block_starts)
+    index = np.minimum(index, base.num_blocks - 1)
+    known = base.block_starts[index] == availability.block_starts
+    availability.values[:, known] = base.values[:, index[known]]
+
+    apply_overrides(availability, week.overrides)
+    return availability
+
+
+def week_bounds(
+    available_blocks: np.ndarray,
+    week_slots: np.ndarray,
+    full_week_slots: int,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    hard_max: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Splits each consultant's term total into per-week block bounds.
+
+    A consultant's term target is their weekly midpoint scaled by each week's number of slots
+    (so short weeks ask for fewer blocks). Weeks where they have fewer available blocks than
+    their share get what they have, and the shortfall moves to their other weeks in proportion
+    to the room left there (up to hard_max a week).
+
+    available_blocks: (weeks x consultants) available blocks of each consultant each week
+    week_slots: (weeks,) slots to cover each week
+    full_week_slots: slots in a full week, which weekly_min and weekly_max are for
+    weekly_min, weekly_max: (consultants,) bounds for a full week
+
+    Returns (min, max, share) arrays of shape (weeks x consultants), where share is the
+    (fractional) number of blocks each week is meant to get
+    """
+    scale = (week_slots / full_week_slots)[:, None]
+    mid = scale * (weekly_min + weekly_max)[None, :] / 2
+    half_width = scale * (weekly_max - weekly_min)[None, :] / 2
+    capacity = np.minimum(available_blocks, hard_max).astype(float)
+
+    share = np.minimum(mid, capacity)
+    shortfall = (mid - share).sum(axis=0)
+    room = capacity - share
+    total_room = room.sum(axis=0)
+    moved = np.divide(
+        room * shortfall[None, :],
+        total_room[None, :],
+        out=np.zeros_like(room),
+        where=total_room[None, :] > 0,
+    )
+    share += np.minimum(moved, room)
+
+    week_min = np.clip(np.floor(share - half_width), 0, capacity).astype(np.int64)
+    week_max = np.clip(np.ceil(share + half_width), week_min, hard_max).astype(np.int64)
+    return week_min, week_max, share
+
+
+def rebalance(
+    week_min: np.ndarray,
+    week_max: np.ndarray,
+    assigned: np.ndarray,
+    target: np.ndarray,
+    capacity: np.ndarray,
+    week_slots: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Adjusts per-week bounds towards each consultant's term target after a round of solves.
+    Consultants short of their target get higher minimums and ones past it lower maximums,
+    spread over the weeks with the most room to change. Minimums are only raised as far as each
+    week's minimums still add up to no more than its slots.
+
+    assigned: (weeks x consultants) blocks assigned in the last round
+    target: (consultants,) term target
+    capacity: (weeks x consultants) most blocks each consultant can work each week
+    week_slots: (weeks,) slots to cover each week
+
+    Returns (min, max) arrays of shape (weeks x consultants)
+    """
+
+    def spread(amount: np.ndarray, room: np.ndarray) -> np.ndarray:
+        total_room = room.sum(axis=0)
+        moved = np.divide(
+            room * amount[None, :],
+            total_room[None, :],
+            out=np.zeros(room.shape),
+            where=total_room[None, :] > 0,
+        )
+        return np.minimum(np.floor(moved + 0.5), room).astype(np.int64)
+
+    gap = target - assigned.sum(axis=0)
+    under, over = gap >= 1, gap <= -1
+
+    added = spread(np.where(under, gap, 0), capacity - assigned)
+    lowered = assigned - spread(np.where(over, -gap, 0), assigned - week_min)
+
+    # scale each week's additions down to fit its slots
+    base_min = np.where(under[None, :], np.maximum(week_min, assigned), week_min)
+    slack = np.maximum(week_slots - base_min.sum(axis=1), 0)
+    total_added = added.sum(axis=1)
+    fits = np.minimum(slack / np.maximum(total_added, 1), 1)
+    added = np.floor(added * fits[:, None]).astype(np.int64)
+
+    new_min = np.where(under[None, :], base_min + added, week_min)
+    new_max = np.where(over[None, :], np.minimum(week_max, lowered), week_max)
+    new_max = np.maximum(new_max, new_min)
+    return new_min, new_max
+
+
+def _solve_week(
+    availability: AvailabilityMatrix,
+    feasible_blocks: dict[str, tuple[int, int]],
+    backend: str,
+    solver_options: dict,
+) -> tuple[int, list]:
+    violations = precheck(availability, feasible_blocks)
+    if violations:
+        logger.warning(
+            f"Week of {availability.week_start:%Y-%m-%d}: {violations[0].message}"
+        )
+        return -1, []
+
+    model = ScheduleModel(availability, feasible_blocks, presolve=True)
+    status, _ = model.solve(backend, **solver_options)
+    if status != LpStatusOptimal:
+        return status, []
+    return status, np.argwhere(model.assigned_blocks()).tolist()
+
+
+def _solve_week_star(args: tuple) -> tuple[int, list]:
+    return _solve_week(*args)
+
+
+def plan_horizon(
+    df: pd.DataFrame | AvailabilityMatrix,
+    weeks: list[WeekSpec],
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    processes: Optional[int] = None,
+    fairness_rounds: int = FAIRNESS_ROUNDS,
+    backend: str = DEFAULT_BACKEND,
+    **solver_options,
+) -> HorizonResult:
+    """
+    Schedules every week of a horizon (e.g. from semester_weeks()). Each week gets the base
+    availability df on its own lab hours plus its overrides (see week_availability()), and
+    per-week block bounds that add up to each consultant's fair share of the term (see
+    week_bounds()). After each round of solves the bounds are moved towards each consultant's
+    term target (see rebalance()) and the weeks whose bounds changed are solved again.
+
+    Weeks with identical inputs are solved once, and distinct weeks are solved in parallel
+    worker processes.
+
+    feasible_blocks: dict output from allocate_feasible_blocks() in read_csv.py, for a full week
+    processes: number of worker processes (defaults to one per core, never more than there are
+        distinct weeks). With 1, everything runs in this process
+    fairness_rounds: rounds of rebalancing after the first solve
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+    """
+    base = _as_matrix(df)
+    block_minutes = base.block_minutes
+    consultants = base.consultants
+    solver_options = {"msg": False, **solver_options}
+
+    availabilities = [week_availability(base, week) for week in weeks]
+    available_blocks = np.array(
+        [(a.values != PREF_UNAVAILABLE).sum(axis=1) for a in availabilities]
+    )
+    week_slots = np.array([a.num_blocks for a in availabilities])
+
+    weekly_min, weekly_max = _weekly_bounds(consultants, feasible_blocks, block_minutes)
+    hard_max = hours_to_blocks(CONSULTANT_MAX_HOURS, block_minutes)
+    week_min, week_max, share = week_bounds(
+        available_blocks, week_slots, base.num_blocks, weekly_min, weekly_max, hard_max
+    )
+    # every slot is worked by someone, so targets are scaled to add up to the term's slots
+    target = share.sum(axis=0)
+    target *= week_slots.sum() / target.sum()
+    capacity = np.minimum(available_blocks, hard_max)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    solved = {}  # schedule_key() -> (status, assigned blocks), over all rounds
+    statuses = np.zeros(len(weeks), dtype=np.int64)
+    assigned = np.zeros((len(weeks), len(consultants)), dtype=np.int64)
+    masks = [None] * len(weeks)
+
+    for fairness_round in range(fairness_rounds + 1):
+        # weeks with the same availability (on the week-relative block axis) and bounds share a
+        # key, and keys solved in an earlier round aren't solved again
+        tasks, task_of_week = {}, []
+        for w, availability in enumerate(availabilities):
+            bounds = {
+                c: (int(lo), int(hi))
+                for c, lo, hi in zip(consultants, week_min[w], week_max[w])
+            }
+            key = schedule_key(
+                availability,
+                bounds,
+                PREFERENCE_COSTS,
+                SHIFT_CHANGE_PENALTY,
+                _daily_max_blocks(block_minutes),
+                {"backend": backend, **solver_options},
+            )
+            if key not in solved:
+                tasks[key] = (availability, bounds, backend, solver_options)
+            task_of_week.append(key)
+
+        keys = list(tasks)
+        num_processes = max(1, min(processes, len(keys)))
+        logger.info(
+            f"Round {fairness_round}: solving {len(keys)} distinct weeks of {len(weeks)} in "
+            + f"{num_processes} processes"
+        )
+        if num_processes == 1:
+            results = [_solve_week(*tasks[key]) for key in keys]
+        else:
+            with multiprocessing.Pool(num_processes) as pool:
+                results = pool.map(_solve_week_star, [tasks[key] for key in keys])
+        solved.update(zip(keys, results))
+
+        for w, (availability, key) in enumerate(zip(availabilities, task_of_week)):
+            status, blocks = solved[key]
+            # a week that becomes infeasible under rebalanced bounds keeps its last schedule
+            if status != LpStatusOptimal and masks[w] is not None:
+                continue
+
+            mask = np.zeros(availability.values.shape, dtype=bool)
+            if blocks:
+                mask[tuple(np.array(blocks).T)] = True
+            statuses[w], masks[w] = status, mask
+            assigned[w] = mask.sum(axis=1)
+
+        if fairness_round < fairness_rounds:
+            week_min, week_max = rebalance(
+                week_min, week_max, assigned, target, capacity, week_slots
+            )
+
+    week_results = [
+        (
+            week.week_start,
+            int(status),
+            availability.assignments(mask) if status == LpStatusOptimal else {},
+        )
+        for week, availability, status, mask in zip(
+            weeks, availabilities, statuses, masks
+        )
+    ]
+    totals = pd.DataFrame(
+        {"target": target, "assigned": assigned.sum(axis=0)},
+        index=pd.Index(consultants, name="consultant"),
+    )
+    return HorizonResult(week_results, totals, len(solved))
@@ -1,21 +1,59 @@
+import logging
+from time import perf_counter
 from typing import Optional
 
+import numpy as np
 import pandas as pd
-from pulp import LpProblem, LpVariable, lpSum, value  # type: ignore
-from pulp.constants import LpBinary, LpMinimize  # type: ignore
+from pulp import (  # type: ignore
+    LpAffineExpression,
+    LpConstraint,
+    LpProblem,
+    LpVariable,
+    value,
+)
+from pulp.constants import (  # type: ignore
+    LpBinary,
+    LpConstraintEQ,
+    LpConstraintGE,
+    LpConstraintLE,
+    LpContinuous,
+    LpMinimize,
+    LpSolutionOptimal,
+    LpStatusInfeasible,
+)
 
+from cache import SolveCache, schedule_key
+from feasibility import Violation, check_feasibility, log_violations
+from presolve import PresolveResult, no_presolve
+from presolve import presolve as run_presolve
 from sched_setup import (
+    BLOCK_MINUTES,
     PREF_NEUTRAL,
     PREF_NOT_PREFERABLE,
     PREF_PREFERABLE,
     PREF_UNAVAILABLE,
+    AvailabilityMatrix,
+    hours_to_blocks,
+)
+from solvers import (
+    ANYTIME_NO_SOLUTION,
+    DEFAULT_BACKEND,
+    AnytimeResult,
+    Progress,
+    ProgressCallback,
+    solve,
 )
+from solvers import solve_anytime as run_anytime
+from tracing import count, span
+
+logger = logging.getLogger(__name__)
 
 # TODO: refactor this (and other preferences) into a class or something for CLI usage
 CONSULTANT_MIN_HOURS = 2
 CONSULTANT_MAX_HOURS = 10
 
-DAILY_MAX_BLOCKS = 10  # 5 hr = 10 blocks
+DAILY_MAX_HOURS = 5
+DAILY_MAX_BLOCKS = hours_to_blocks(DAILY_MAX_HOURS)  # 5 hr = 10 half-hour blocks
 
 # TODO: refactor this into preference enum?
 PREFERENCE_COSTS = {
@@ -28,92 +66,730 @@ PREFERENCE_COSTS = {
 SHIFT_CHANGE_PENALTY = 12
 
 
-def create_schedule(
-    df: pd.DataFrame, feasible_blocks: Optional[dict[str, tuple[int, int]]] = None
-) -> tuple[int, dict]:
+def _as_matrix(availability: pd.DataFrame | AvailabilityMatrix) -> AvailabilityMatrix:
     """
-    Creates schedule based on consultant availability df generated in sched_setup.py and feasible
-    block allocations generated in read_csv.py
+    Converts an availability df to an AvailabilityMatrix (matrices are passed through as is)
     """
-    prob = LpProblem("consultant_scheduling", LpMinimize)
+    if isinstance(availability, AvailabilityMatrix):
+        return availability
+    return AvailabilityMatrix.from_df(availability)
 
-    consultants = df.columns
-    time_slots = df.index
 
-    # precompute availability and days to reduce function calls
-    availability = {(c, t): df.loc[t, c] for c in consultants for t in time_slots}
+def _day_starts(availability: AvailabilityMatrix) -> np.ndarray:
+    """
+    Index of each day's first slot. Slots are sorted by time, so each day (same grouping as
+    t.date()) is a contiguous [start, end) range of slot indices
+    """
+    return np.flatnonzero(np.diff(availability.block_days(), prepend=-1))
 
-    days = df.index.map(lambda t: t.date()).unique()
-    day_slots = {day: df.index[df.index.map(lambda t: t.date()) == day] for day in days}
 
-    # only create decision variables where consultants are available
-    x = {
-        (c, t): LpVariable(f"shift_{c}_{t}", cat=LpBinary)
-        for (c, t), avail in availability.items()
-        if avail != PREF_UNAVAILABLE
-    }
+def _shift_change_pairs(
+    available: np.ndarray, day_starts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (consultant, slot) of every available block whose next slot is available on the same day
+    """
+    same_day_next = np.ones(available.shape[1], dtype=bool)
+    same_day_next[day_starts - 1] = False  # last slot of each day (and of the week)
+
+    pair_c, pair_t = np.nonzero(
+        available[:, :-1] & available[:, 1:] & same_day_next[None, :-1]
+    )
+    return pair_c, pair_t
+
+
+def _index_variables(free: np.ndarray) -> dict:
+    """
+    Derives the decision variable index from the (consultants x slots) mask of free variables with
+    integer arithmetic.
+    """
+    num_consultants, num_slots = free.shape
+
+    # np.nonzero is row-major, so variables are sorted by consultant and then by slot
+    var_c, var_t = np.nonzero(free)
+
+    # per-consultant and per-slot lists of variable indices
+    consultant_vars = np.split(
+        np.arange(len(var_c)), np.searchsorted(var_c, np.arange(1, num_consultants))
+    )
+    by_slot = np.argsort(var_t, kind="stable")
+    slot_vars = np.split(
+        by_slot, np.searchsorted(var_t[by_slot], np.arange(1, num_slots))
+    )
 
-    # reduce number of shift changes
-    # TODO: make this daily instead of across whole schedule
-    y = {
-        (c, t): LpVariable(f"shift_change_{c}_{t}", cat=LpBinary)
-        for (c, t) in x.keys()
-        if t != time_slots[-1]
+    return {
+        "var_c": var_c,
+        "var_t": var_t,
+        "consultant_vars": consultant_vars,
+        "slot_vars": slot_vars,
     }
 
-    # objective function
-    preference_cost = lpSum(
-        x[c, t] * PREFERENCE_COSTS[availability[c, t]] for c, t in x.keys()
+
+def _weekly_bounds(
+    consultants: list[str],
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+    block_minutes: int = BLOCK_MINUTES,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (min, max) weekly blocks for each consultant as arrays. feasible_blocks must already be in
+    blocks of block_minutes
+    """
+    if feasible_blocks is None:
+        # specific hours not specified: just use generic 2-10 range
+        weekly_min = np.full(
+            len(consultants), hours_to_blocks(CONSULTANT_MIN_HOURS, block_minutes)
+        )
+        weekly_max = np.full(
+            len(consultants), hours_to_blocks(CONSULTANT_MAX_HOURS, block_minutes)
+        )
+    else:
+        # specific hours were specified in the dict - use 80-100% of the # of blocks requested
+        # (already know the hours request is bounded by 2-10 range from the allocate function)
+        weekly_min, weekly_max = (
+            np.array([feasible_blocks[c] for c in consultants], dtype=np.int64)
+            .reshape(-1, 2)
+            .T
+        )
+
+    return weekly_min, weekly_max
+
+
+def _daily_max_blocks(block_minutes: int = BLOCK_MINUTES) -> int:
+    """
+    Per-day block cap for blocks of block_minutes (DAILY_MAX_BLOCKS for the default length)
+    """
+    return hours_to_blocks(DAILY_MAX_HOURS, block_minutes)
+
+
+def _preference_cost_lookup(preference_costs: dict[int, int]) -> np.ndarray:
+    """
+    Array mapping preference level -> cost so costs can be looked up with fancy indexing
+    """
+    cost_lookup = np.zeros(max(preference_costs) + 1, dtype=np.int64)
+    for pref, cost in preference_costs.items():
+        cost_lookup[pref] = cost
+    return cost_lookup
+
+
+class ScheduleModel:
+    """
+    Scheduling LP that keeps its variables and constraints around after being built, so that
+    objective coefficients and bounds can be edited in place and the model re-solved without
+    rebuilding it from scratch.
+    """
+
+    def __init__(
+        self,
+        availability: pd.DataFrame | AvailabilityMatrix,
+        feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+        presolve: bool = False,
+        reduced: Optional[PresolveResult] = None,
+        daily_max_blocks: Optional[int] = None,
+        relax: bool = False,
+    ):
+        """
+        Build the model from the consultant availability and feasible block allocations
+
+        availability: consultant availability df or AvailabilityMatrix from sched_setup.py
+        feasible_blocks: dict output from allocate_feasible_blocks() in read_csv.py
+        presolve: shrink the model first (see presolve.py). A presolved model's bounds can't be
+            edited, since rows that were redundant under the old bounds have been dropped
+        reduced: build this reduction of the model instead (e.g. from presolve.fix_outside()).
+            Its bounds can't be edited either
+        daily_max_blocks: per-day block cap (defaults to DAILY_MAX_HOURS at the availability's
+            block length). Ignored if reduced is given, which already has its own caps
+        relax: make the decision variables continuous (the LP relaxation, e.g. for the constraint
+            duals used by scarcity.py)
+        """
+        build_start = perf_counter()
+        self.prob = LpProblem("consultant_scheduling", LpMinimize)
+
+        self.matrix = _as_matrix(availability)
+        self.consultants = self.matrix.consultants
+        self.time_slots = self.matrix.time_index()
+        self._consultant_index = {c: i for i, c in enumerate(self.consultants)}
+        self._slot_index = {t: j for j, t in enumerate(self.time_slots)}
+
+        # current preference levels, kept in sync with the objective by set_preference()
+        self.avail = self.matrix.values.copy()
+        self.preference_costs = dict(PREFERENCE_COSTS)
+        self.shift_change_penalty = SHIFT_CHANGE_PENALTY
+        cost_lookup = _preference_cost_lookup(self.preference_costs)
+
+        available = self.avail != PREF_UNAVAILABLE
+        day_starts = _day_starts(self.matrix)
+
+        block_minutes = self.matrix.block_minutes
+        weekly_min, weekly_max = _weekly_bounds(
+            self.consultants, feasible_blocks, block_minutes
+        )
+        if daily_max_blocks is None:
+            daily_max_blocks = _daily_max_blocks(block_minutes)
+
+        self.presolved = presolve or reduced is not None
+        if reduced is None:
+            reduce = run_presolve if presolve else no_presolve
+            with span("presolve", enabled=presolve):
+                reduced = reduce(
+                    available,
+                    day_starts,
+                    weekly_min,
+                    weekly_max,
+                    daily_max_blocks,
+                )
+        self.reduced = reduced
+        free, fixed = self.reduced.free, self.reduced.fixed
+
+        idx = _index_variables(free)
+        self.idx = idx
+        var_c, var_t = idx["var_c"], idx["var_t"]
+
+        # only create decision variables where consultants are available (and, after presolve,
+        # not already fixed)
+        cat = LpContinuous if relax else LpBinary
+        self.x_vars = [
+            LpVariable(f"shift_{c}_{t}", lowBound=0, upBound=1, cat=cat)
+            for c, t in zip(var_c, var_t)
+        ]
+        self.x = {
+            (self.consultants[c], self.time_slots[t]): var
+            for c, t, var in zip(var_c, var_t, self.x_vars)
+        }
+        # (consultant index, slot index) -> position in self.x_vars
+        self._var_index = {
+            (c, t): k for k, (c, t) in enumerate(zip(var_c.tolist(), var_t.tolist()))
+        }
+
+        # blocks fixed by presolve are constants rather than variables
+        fixed_c, fixed_t = np.nonzero(fixed)
+        for c, t in zip(fixed_c, fixed_t):
+            self.x[self.consultants[c], self.time_slots[t]] = 1
+        self._fixed = set(zip(fixed_c.tolist(), fixed_t.tolist()))
+
+        # objective function
+        x_costs = cost_lookup[self.avail[var_c, var_t]]
+        objective = LpAffineExpression(list(zip(self.x_vars, x_costs.tolist())))
+        objective.constant = float(cost_lookup[self.avail[fixed_c, fixed_t]].sum())
+
+        # constraints
+        # 0. penalize shift changes within same day. a shift change variable is only needed for
+        # pairs of adjacent blocks where at least one block is still free
+        self.y_vars = {}
+        self._num_constant_shift_changes = 0
+        pair_c, pair_t = _shift_change_pairs(available, day_starts)
+
+        for c, t in zip(pair_c.tolist(), pair_t.tolist()):
+            k, k_next = self._var_index.get((c, t)), self._var_index.get((c, t + 1))
+
+            if k is None and k_next is None:
+                # both ends fixed: a shift change either always or never happens
+                self._num_constant_shift_changes += ((c, t) in self._fixed) != (
+                    (c, t + 1) in self._fixed
+                )
+                continue
+
+            y = LpVariable(f"shift_change_{c}_{t}", lowBound=0, upBound=1, cat=cat)
+            self.y_vars[c, t] = y
+            objective += self.shift_change_penalty * y
+
+            if k is not None and k_next is not None:
+                x_t, x_next = self.x_vars[k], self.x_vars[k_next]
+                self.prob += LpConstraint(
+                    [(y, 1), (x_t, -1), (x_next, 1)], LpConstraintGE, f"sc_a_{c}_{t}", 0
+                )
+                self.prob += LpConstraint(
+                    [(y, 1), (x_t, 1), (x_next, -1)], LpConstraintGE, f"sc_b_{c}_{t}", 0
+                )
+            else:
+                # one end fixed: y >= |fixed - x| is a single row
+                x_free = self.x_vars[k if k is not None else k_next]
+                fixed_end = (c, t + 1) if k is not None else (c, t)
+                if fixed_end in self._fixed:
+                    self.prob += LpConstraint(
+                        [(y, 1), (x_free, 1)], LpConstraintGE, f"sc_{c}_{t}", 1
+                    )
+                else:
+                    self.prob += LpConstraint(
+                        [(y, 1), (x_free, -1)], LpConstraintGE, f"sc_{c}_{t}", 0
+                    )
+
+        objective.constant += (
+            self.shift_change_penalty * self._num_constant_shift_changes
+        )
+        self.prob += objective
+
+        # 1. one consultant per time slot
+        self.cover = {}
+        for t, ks in enumerate(idx["slot_vars"]):
+            if self.reduced.keep_cover[t]:
+                self.cover[t] = LpConstraint(
+                    [(self.x_vars[k], 1) for k in ks.tolist()],
+                    LpConstraintEQ,
+                    f"cover_{t}",
+                    1,
+                )
+                self.prob += self.cover[t]
+
+        # 2. minimum/maximum weekly hours per consultant
+        self.weekly_min, self.weekly_max = {}, {}
+        for c, ks in enumerate(idx["consultant_vars"]):
+            total_blocks = [(self.x_vars[k], 1) for k in ks.tolist()]
+
+            if self.reduced.keep_weekly_min[c]:
+                self.weekly_min[c] = LpConstraint(
+                    total_blocks,
+                    LpConstraintGE,
+                    f"weekly_min_{c}",
+                    int(self.reduced.weekly_min[c]),
+                )
+                self.prob += self.weekly_min[c]
+
+            if self.reduced.keep_weekly_max[c]:
+                self.weekly_max[c] = LpConstraint(
+                    total_blocks,
+                    LpConstraintLE,
+                    f"weekly_max_{c}",
+                    int(self.reduced.weekly_max[c]),
+                )
+                self.prob += self.weekly_max[c]
+
+        # 3. maximum 5 hours (10 blocks) per day per consultant
+        self.daily_max = {}
+        for c, ks in enumerate(idx["consultant_vars"]):
+            # consultant's variables are sorted by slot, so each day is a contiguous run of them
+            bounds = np.searchsorted(var_t[ks], day_starts).tolist() + [len(ks)]
+            for d in range(len(day_starts)):
+                if not self.reduced.keep_daily_max[c, d]:
+                    continue
+
+                day_ks = ks[bounds[d] : bounds[d + 1]].tolist()
+                self.daily_max[c, d] = LpConstraint(
+                    [(self.x_vars[k], 1) for k in day_ks],
+                    LpConstraintLE,
+                    f"daily_max_{c}_{d}",
+                    int(self.reduced.daily_max[c, d]),
+                )
+                self.prob += self.daily_max[c, d]
+
+        num_available = int(available.sum())
+        self.stats = {
+            "build_time": perf_counter() - build_start,
+            "num_variables": len(self.x_vars) + len(self.y_vars),
+            "num_constraints": len(self.prob.constraints),
+            # size of the unreduced model (one shift change variable per block but the last)
+            "unreduced_variables": num_available + int(available[:, :-1].sum()),
+            "unreduced_constraints": 2 * len(pair_c)
+            + len(self.time_slots)
+            + len(self.consultants) * (2 + len(day_starts)),
+            "fixed_blocks": len(self._fixed),
+        }
+        self._has_start = False
+
+        count("models_built")
+        count("variables", self.stats["num_variables"])
+        count("constraints", self.stats["num_constraints"])
+
+    def _check_editable_bounds(self):
+        if self.presolved:
+            raise RuntimeError(
+                "bounds of a presolved model can't be edited - rebuild with presolve=False"
+            )
+
+    def set_preference(self, consultant: str, time_slots, pref_level: int):
+        """
+        Changes a consultant's preference level on the given time slots by editing objective
+        coefficients in place. Setting PREF_UNAVAILABLE fixes the variables to 0.
+
+        Slots where the consultant was unavailable when the model was built have no variable, so
+        they can't be made available without rebuilding the model.
+        """
+        c = self._consultant_index[consultant]
+        cost = self.preference_costs[pref_level]
+
+        for time in time_slots:
+            t = self._slot_index[time]
+            k = self._var_index.get((c, t))
+
+            if (c, t) in self._fixed:
+                # fixed to 1 by presolve, so its cost is part of the objective constant
+                if pref_level == PREF_UNAVAILABLE:
+                    raise ValueError(
+                        f"{consultant} is the only consultant available at {time} - rebuild the "
+                        + "model to remove availability"
+                    )
+                self.prob.objective.constant += (
+                    cost - self.preference_costs[self.avail[c, t]]
+                )
+                self.avail[c, t] = pref_level
+                continue
+
+            if k is None:
+                if (
+                    pref_level == PREF_UNAVAILABLE
+                    or self.avail[c, t] != PREF_UNAVAILABLE
+                ):
+                    # unavailable, or fixed to 0 by presolve
+                    continue
+                raise ValueError(
+                    f"{consultant} has no variable at {time} (unavailable when the model was "
+                    + "built) - rebuild the model to add availability"
+                )
+
+            var = self.x_vars[k]
+            self.avail[c, t] = pref_level
+            var.upBound = 0 if pref_level == PREF_UNAVAILABLE else 1
+            self.prob.objective[var] = cost
+
+    def set_preference_costs(self, preference_costs: dict[int, int]):
+        """
+        Replaces the preference level -> cost mapping for every variable
+        """
+        self.preference_costs = dict(preference_costs)
+        cost_lookup = _preference_cost_lookup(self.preference_costs)
+
+        var_c, var_t = self.idx["var_c"], self.idx["var_t"]
+        x_costs = cost_lookup[self.avail[var_c, var_t]]
+
+        for var, cost in zip(self.x_vars, x_costs.tolist()):
+            self.prob.objective[var] = cost
+
+        fixed_c, fixed_t = np.nonzero(self.reduced.fixed)
+        self.prob.objective.constant = float(
+            cost_lookup[self.avail[fixed_c, fixed_t]].sum()
+            + self.shift_change_penalty * self._num_constant_shift_changes
+        )
+
+    def set_shift_change_penalty(self, penalty: float):
+        """
+        Changes the cost of each shift change (SHIFT_CHANGE_PENALTY)
+        """
+        self.prob.objective.constant += (
+            penalty - self.shift_change_penalty
+        ) * self._num_constant_shift_changes
+        self.shift_change_penalty = penalty
+
+        for y in self.y_vars.values():
+            self.prob.objective[y] = penalty
+
+    def set_feasible_blocks(self, consultant: str, blocks_min: int, blocks_max: int):
+        """
+        Changes a consultant's weekly (min, max) block range
+        """
+        self._check_editable_bounds()
+
+        c = self._consultant_index[consultant]
+        self.weekly_min[c].changeRHS(blocks_min)
+        self.weekly_max[c].changeRHS(blocks_max)
+
+    def set_daily_max_blocks(self, daily_max_blocks: int):
+        """
+        Changes the per-day block cap (DAILY_MAX_BLOCKS) for every consultant
+        """
+        self._check_editable_bounds()
+
+        for constraint in self.daily_max.values():
+            constraint.changeRHS(daily_max_blocks)
+
+    def set_start(self, assigned: np.ndarray):
+        """
+        Sets a (consultants x slots) mask of assigned blocks, e.g. from heuristic.py, as
+        the starting solution for the next solve
+        """
+        free, fixed = self.reduced.free, self.reduced.fixed
+        start = (assigned & free) | fixed
+
+        var_c, var_t = self.idx["var_c"], self.idx["var_t"]
+        for var, is_assigned in zip(self.x_vars, start[var_c, var_t].tolist()):
+            var.varValue = is_assigned
+        for (c, t), y in self.y_vars.items():
+            y.varValue = start[c, t] != start[c, t + 1]
+
+        self._has_start = True
+
+    def duals(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Constraint duals of a solved relaxation (see relax) as (cover, weekly_min, weekly_max,
+        daily) arrays, indexed by slot, consultant, consultant and (consultant, day). Rows dropped
+        by presolve have a dual of 0
+        """
+        num_consultants, num_slots = self.avail.shape
+        cover = np.zeros(num_slots)
+        for t, constraint in self.cover.items():
+            cover[t] = constraint.pi or 0
+
+        weekly_min, weekly_max = np.zeros(num_consultants), np.zeros(num_consultants)
+        for c, constraint in self.weekly_min.items():
+            weekly_min[c] = constraint.pi or 0
+        for c, constraint in self.weekly_max.items():
+            weekly_max[c] = constraint.pi or 0
+
+        daily = np.zeros(self.reduced.keep_daily_max.shape)
+        for (c, d), constraint in self.daily_max.items():
+            daily[c, d] = constraint.pi or 0
+
+        return cover, weekly_min, weekly_max, daily
+
+    def assigned_blocks(self) -> np.ndarray:
+        """
+        (consultants x slots) mask of the blocks assigned by the last solve
+        """
+        assigned = self.reduced.fixed.copy()
+        var_c, var_t = self.idx["var_c"], self.idx["var_t"]
+        assigned[var_c, var_t] = [(var.varValue or 0) > 0.5 for var in self.x_vars]
+        return assigned
+
+    def solve(
+        self, backend: str = DEFAULT_BACKEND, **solver_options
+    ) -> tuple[int, float]:
+        """
+        Solves the model, warm starting from the previous solution on re-solves (or from the one
+        given to set_start()).
+
+        Returns (status, solve_time), same as solvers.solve()
+        """
+        status, solve_time = solve(
+            self.prob, backend, warm_start=self._has_start, **solver_options
+        )
+        self._has_start = True
+        return status, solve_time
+
+    def solve_anytime(
+        self,
+        time_limit: float,
+        gap_rel: Optional[float] = None,
+        callback: Optional[ProgressCallback] = None,
+        backend: str = DEFAULT_BACKEND,
+        **solver_options,
+    ) -> AnytimeResult:
+        """
+        Solves the model within a time budget, same as solvers.solve_anytime(). Warm starts from
+        the previous solution on re-solves, so the first incumbent is never worse than it.
+        """
+        result = run_anytime(
+            self.prob,
+            time_limit,
+            gap_rel,
+            callback,
+            backend,
+            warm_start=self._has_start,
+            **solver_options,
+        )
+        self._has_start = True
+        return result
+
+
+def print_progress(progress: Progress):
+    """
+    Default progress callback for anytime_schedule()
+    """
+    objective = "-" if progress.objective is None else f"{progress.objective:.0f}"
+    bound = "-" if progress.bound is None else f"{progress.bound:.1f}"
+    gap = "-" if progress.gap is None else f"{progress.gap:.2%}"
+    print(f"{progress.elapsed:7.1f}s  objective {objective}  bound {bound}  gap {gap}")
+
+
+def precheck(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    daily_max_blocks: Optional[int] = None,
+) -> list[Violation]:
+    """
+    Checks necessary conditions for a feasible schedule without building the model (see
+    feasibility.py). Returns the violated conditions, so an empty list means the model might be
+    feasible.
+
+    daily_max_blocks: per-day block cap, same as for ScheduleModel
+    """
+    availability = _as_matrix(df)
+    block_minutes = availability.block_minutes
+    weekly_min, weekly_max = _weekly_bounds(
+        availability.consultants, feasible_blocks, block_minutes
+    )
+    if daily_max_blocks is None:
+        daily_max_blocks = _daily_max_blocks(block_minutes)
+    return check_feasibility(
+        availability,
+        _day_starts(availability),
+        weekly_min,
+        weekly_max,
+        daily_max_blocks,
+    )
+
+
+def build_model(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+) -> tuple[LpProblem, dict, dict]:
+    """
+    Builds the scheduling LP from the consultant availability and feasible block allocations.
+
+    Returns (prob, x, stats) where x maps (consultant, time) to its decision variable and stats
+    holds the build time and variable/constraint counts.
+    """
+    model = ScheduleModel(df, feasible_blocks)
+    return model.prob, model.x, model.stats
+
+
+def create_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    backend: str = DEFAULT_BACKEND,
+    cache: Optional[SolveCache] = None,
+    presolve: bool = True,
+    engine: str = "blocks",
+    check_feasible: bool = True,
+    heuristic_start: bool = False,
+    **solver_options,
+) -> tuple[int, dict]:
+    """
+    Creates schedule based on consultant availability (df or AvailabilityMatrix) generated in
+    sched_setup.py and feasible block allocations generated in read_csv.py
+
+    backend: solver backend name (see solvers.SOLVER_BACKENDS)
+    cache: if given, a repeat call with the same inputs returns the stored schedule without solving.
+        Only schedules proven optimal are stored
+    presolve: shrink the model before solving (see presolve.py)
+    engine: "blocks" for the per-block model or "shifts" for the shift-pattern model (see
+        shift_patterns.py, which doesn't presolve)
+    check_feasible: run precheck() first and skip the solve (returning an infeasible status and an
+        empty x) if any of its conditions are violated
+    heuristic_start: start the solver from the schedule of heuristic.py (blocks engine only)
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+    """
+    availability = _as_matrix(df)
+
+    if cache is not None:
+        with span("cache_lookup"):
+            key = schedule_key(
+                availability,
+                feasible_blocks,
+                PREFERENCE_COSTS,
+                SHIFT_CHANGE_PENALTY,
+                _daily_max_blocks(availability.block_minutes),
+                {
+                    "backend": backend,
+                    "engine": engine,
+                    "presolve": presolve,
+                    "check_feasible": check_feasible,
+                    "heuristic_start": heuristic_start,
+                    **solver_options,
+                },
+            )
+            cached = cache.get(key, availability)
+        if cached is not None:
+            logger.info(
+                f"Loaded schedule from cache ({cache.hits} hits, {cache.misses} misses)"
+            )
+            return cached
+
+    if check_feasible:
+        with span("precheck") as precheck_span:
+            violations = precheck(availability, feasible_blocks)
+            precheck_span.set(violations=len(violations))
+        if violations:
+            log_violations(violations)
+            return LpStatusInfeasible, {}
+
+    if engine == "shifts":
+        # imported here since shift_patterns builds on this module
+        from shift_patterns import solve_shift_model
+
+        status, shift_model = solve_shift_model(
+            availability, feasible_blocks, backend, **solver_options
+        )
+        x = availability.assignments(shift_model.assigned_blocks())
+        # only proven optima are stored, so a time-limited or failed solve is retried next time
+        if cache is not None and shift_model.prob.sol_status == LpSolutionOptimal:
+            cache.put(key, availability, status, x, shift_model.prob.sol_status)
+        return status, x
+    elif engine != "blocks":
+        raise ValueError(f'unknown engine {engine!r} (options: "blocks", "shifts")')
+
+    with span("build") as build_span:
+        model = ScheduleModel(availability, feasible_blocks, presolve)
+        stats = model.stats
+        build_span.set(**stats)
+
+    logger.info(
+        f"Model built in {stats['build_time']:.3f}s "
+        + f"({stats['num_variables']} variables, {stats['num_constraints']} constraints)"
+    )
+    if presolve:
+        logger.info(
+            f"Presolve fixed {stats['fixed_blocks']} blocks and shrank the model from "
+            + f"{stats['unreduced_variables']} variables, "
+            + f"{stats['unreduced_constraints']} constraints"
+        )
+
+    if heuristic_start:
+        # imported here since heuristic builds on this module
+        from heuristic import heuristic_assignment
+
+        with span("heuristic_start") as heuristic_span:
+            assigned, feasible = heuristic_assignment(availability, feasible_blocks)
+            heuristic_span.set(feasible=feasible)
+        if feasible:
+            model.set_start(assigned)
+
+    with span("solve"):
+        status, solve_time = model.solve(backend, **solver_options)
+    logger.info(f"Solved with {backend} in {solve_time:.3f}s")
+
+    if cache is not None and model.prob.sol_status == LpSolutionOptimal:
+        with span("cache_store"):
+            cache.put(key, availability, status, model.x, model.prob.sol_status)
+
+    return status, model.x
+
+
+def anytime_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    time_limit: float = 10,
+    gap_rel: Optional[float] = None,
+    callback: Optional[ProgressCallback] = print_progress,
+    backend: str = DEFAULT_BACKEND,
+    presolve: bool = True,
+    **solver_options,
+) -> tuple[str, dict]:
+    """
+    Creates the best schedule that can be found within time_limit seconds, for live adjustments
+    where a good schedule now beats a proven optimum later. Stops early once the schedule is within
+    gap_rel of optimal.
+
+    callback: called with a solvers.Progress (elapsed time, objective, bound and gap) on each new
+        best schedule. Defaults to printing them
+    solver_options: threads, seed and msg, passed through to solvers.solve_anytime()
+
+    Returns (quality, x) where quality is one of solvers.ANYTIME_OPTIMAL, ANYTIME_FEASIBLE (within
+    gap_rel), ANYTIME_TIME_LIMITED or ANYTIME_NO_SOLUTION, and x is the same as from
+    create_schedule()
+    """
+    availability = _as_matrix(df)
+
+    with span("precheck") as precheck_span:
+        violations = precheck(availability, feasible_blocks)
+        precheck_span.set(violations=len(violations))
+    if violations:
+        log_violations(violations)
+        return ANYTIME_NO_SOLUTION, {}
+
+    with span("build") as build_span:
+        model = ScheduleModel(availability, feasible_blocks, presolve)
+        build_span.set(**model.stats)
+
+    with span("solve") as solve_span:
+        result = model.solve_anytime(
+            time_limit, gap_rel, callback, backend, **solver_options
+        )
+        solve_span.set(quality=result.quality)
+
+    gap = "-" if result.progress.gap is None else f"{result.progress.gap:.2%}"
+    logger.info(
+        f"Solved with {backend} in {result.solve_time:.3f}s: {result.quality} (gap {gap})"
     )
 
-    # constraints
-    # 0. penalize shift changes within same day
-    for c in consultants:
-        for _, slots in day_slots.items():  # slots within each day
-            for i in range(len(slots) - 1):
-                t, t_next = slots[i], slots[i + 1]
-                if (c, t) in x and (c, t_next) in x:
-                    prob += y[c, t] >= x[c, t] - x[c, t_next]
-                    prob += y[c, t] >= x[c, t_next] - x[c, t]
-
-    shift_changes = lpSum(y.values())
-
-    prob += preference_cost + SHIFT_CHANGE_PENALTY * shift_changes
-
-    # constraints
-    # 1. one consultant per time slot
-    for t in time_slots:
-        prob += lpSum(x[c, t] for c in consultants if (c, t) in x) == 1
-
-    # 2. minimum/maximum weekly hours per consultant
-    # print(f"{feasible_blocks=}")
-    for c in consultants:
-        total_blocks = lpSum(x[c, t] for t in time_slots if (c, t) in x)
-
-        if feasible_blocks is None:
-            # specific hours not specified: just use generic 2-10 range
-            prob += total_blocks >= CONSULTANT_MIN_HOURS * 2  # convert hours to blocks
-            prob += total_blocks <= CONSULTANT_MAX_HOURS * 2  # convert hours to blocks
-
-        else:
-            # specific hours were specified in the dict - use 80-100% of the # of blocks requested
-            # (already know the hours request is bounded by 2-10 range from the allocate function)
-            consultant_blocks_min, consultant_blocks_max = feasible_blocks[c]
-
-            print(f"{c=}, {consultant_blocks_max=}, {consultant_blocks_min=}")
-
-            prob += total_blocks >= consultant_blocks_min
-            prob += total_blocks <= consultant_blocks_max
-
-    # 3. maximum 5 hours (10 blocks) per day per consultant
-    for c in consultants:
-        for day in days:
-            slots = day_slots[day]
-            prob += lpSum(x[c, t] for t in slots if (c, t) in x) <= DAILY_MAX_BLOCKS
-
-    # status = prob.solve(PULP_CBC_CMD(msg=True, gapRel=0.02))
-    status = prob.solve()
-    return status, x
+    return result.quality, model.x
 
 
 if __name__ == "__main__":
@@ -1,86 +1,199 @@
-import pandas as pd
+import logging
+import os
+from typing import Optional
+
 from pulp.constants import LpStatus, LpStatusOptimal  # type: ignore
 
+from cache import SolveCache
+from heuristic import heuristic_schedule
 from lp import (
     PREF_NEUTRAL,
     PREF_NOT_PREFERABLE,
     PREF_PREFERABLE,
     PREF_UNAVAILABLE,
+    anytime_schedule,
     create_schedule,
 )
-from read_csv import allocate_feasible_blocks, parse_availability
+from multires import coarse_to_fine_schedule
+from overrides import (
+    apply_overrides,
+    load_overrides,
+    print_override_diff,
+    write_overrides_template,
+)
+from read_csv import allocate_feasible_blocks, ingest_responses, write_failures
 from sched_format import ScheduleFormatter
+from sched_setup import BLOCK_MINUTES
+from solvers import ANYTIME_NO_SOLUTION
+from tracing import span, tracing
 
+logger = logging.getLogger(__name__)
 
-def _print_consultant_requests(csv_file: str):
-    df = pd.read_csv(csv_file)
-
-    # TODO: don't hardcode
-    email_colname = df.columns[1]
-    request_colname = df.columns[-1]
-
-    # get rows where consultants have made special requests
-    has_requests = ~df.loc[:, request_colname].isna()
+PARSE_FAILURES_FILE = "parse_failures.csv"
+OVERRIDES_FILE = "overrides.csv"
+EXPORT_FORMATS = ["csv", "json", "ics"]
 
-    df2 = df.loc[has_requests, [email_colname, request_colname]]
 
-    for _, (email, request) in df2.iterrows():
+def _print_consultant_requests(requests: dict[str, str]):
+    for email, request in requests.items():
         print(f"{email}\n{request}\n")
 
 
-def run(csv_file: str) -> dict:
-    print("\n=== PARSING AVAILABILITY ===")
-    df_avail = parse_availability(csv_file)
-    print(df_avail)
-
-    # get possible number of hours to assign to each consultant in preparation for LP
-    # TODO: refactor this to a different place probably
-    feasible_hours = allocate_feasible_blocks(csv_file)
-
-    # output to file to give the user a chance to change preference levels as per consultant
-    # requests. (really should come up with a better way of doing this)
-    tmp_filename = "tmp_avail.csv"
-    print(
-        f"\nNow outputting to {tmp_filename}... "
-        + "Please make any preference level edits now.\nKey:"
-        + f"\n {PREF_PREFERABLE}: PREFERRED"
-        + f"\n {PREF_NEUTRAL}: NEUTRAL"
-        + f"\n {PREF_NOT_PREFERABLE}: NOT PREFERRED"
-        + f"\n {PREF_UNAVAILABLE}: UNAVAILABLE"
-        + "\n\nConsultant requests:"
-    )
-    _print_consultant_requests(csv_file)
-    df_avail.to_csv("tmp_avail.csv")
-
-    # wait until user is done and presses return;
-    input("\nPress return when finished...\n>")
-
-    # use index_col to make sure the DatetimeIndex gets preserved
-    # TODO: come up with a better way of doing this
-    df_avail = pd.read_csv("tmp_avail.csv", index_col=0, parse_dates=True)
-
-    print("New df:")  # TODO: maybe instead print a diff of the two dfs?
-    print(df_avail)
-
-    print("\n=== CREATING SCHEDULE ===")
-    status, x = create_schedule(df_avail, feasible_hours)
-
-    if status == LpStatusOptimal:
-        print("\n=== SCHEDULE CREATED SUCCESSFULLY ===")
-        sched_formatter = ScheduleFormatter(x, df_avail)
-        print("=====")
-        sched_formatter.print_schedule_by_day()
-        print("=====")
-        sched_formatter.print_schedule_by_consultant()
-    else:
-        print("\n=== COULD NOT CREATE SCHEDULE ===")
-        print(f"Linear Program Status: {LpStatus[status]}")
+def run(
+    csv_file: str,
+    corrections_file: Optional[str] = None,
+    overrides_file: Optional[str] = None,
+    interactive: bool = True,
+    time_limit: Optional[float] = None,
+    gap_rel: Optional[float] = None,
+    fast: bool = False,
+    block_minutes: int = BLOCK_MINUTES,
+    coarse_minutes: Optional[int] = None,
+    export_file: Optional[str] = None,
+    trace_file: Optional[str] = None,
+    trace_memory: bool = False,
+) -> dict:
+    """
+    Runs the full scheduling pipeline on a responses CSV
+
+    corrections_file: corrections for time ranges that can't be parsed (see read_csv.py)
+    overrides_file: preference level overrides to apply before scheduling (see overrides.py)
+    interactive: ask for uncorrected time ranges manually and, if no overrides_file is given,
+        wait for overrides to be written to OVERRIDES_FILE. If False, the run never blocks and
+        unparsed time ranges are written to PARSE_FAILURES_FILE and left out of the schedule
+    time_limit: if given, stop after this many seconds with the best schedule found so far (and
+        stop early once it's within gap_rel of optimal)
+    fast: build a draft schedule with heuristic.py instead of solving, e.g. for previews while
+        responses are still coming in. The draft is printed (with a warning) even if it breaks
+        some bounds
+    block_minutes: length of a schedule block, e.g. 15, 30 or 60
+    coarse_minutes: if given, solve at this block length first and then refine at block_minutes
+        around that schedule (see multires.py)
+    export_file: also write the schedule here, as CSV, JSON or iCalendar depending on whether it
+        ends in .csv, .json or .ics
+    trace_file: if given, write timed spans of each stage, counters and solver statistics here as
+        JSON lines (see tracing.py)
+    trace_memory: also trace each stage's peak allocation, at some cost in speed
+    """
+    if export_file is not None:
+        export_format = os.path.splitext(export_file)[1].lower().lstrip(".")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(
+                f"can't export to {export_file} (options: .csv, .json, .ics)"
+            )
+
+    with tracing(trace_file, trace_memory), span("run", csv_file=csv_file):
+        logger.info("\n=== PARSING AVAILABILITY ===")
+        with span("ingest") as ingest_span:
+            responses = ingest_responses(
+                csv_file, interactive, corrections_file, block_minutes
+            )
+            availability = responses.availability
+            ingest_span.set(
+                consultants=len(availability.consultants),
+                blocks=availability.num_blocks,
+                parse_failures=len(responses.failures),
+            )
+
+        if responses.failures:
+            write_failures(responses.failures, PARSE_FAILURES_FILE)
+            logger.warning(
+                f"{len(responses.failures)} time ranges could not be parsed and were skipped. "
+                + f"Fill in the corrections in {PARSE_FAILURES_FILE} and pass it as "
+                + "corrections_file to include them."
+            )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(availability.to_df())
+
+        # get possible number of hours to assign to each consultant in preparation for LP
+        # TODO: refactor this to a different place probably
+        with span("allocate"):
+            feasible_hours = allocate_feasible_blocks(
+                responses.requested_hours, block_minutes=block_minutes
+            )
+
+        if overrides_file is None and interactive:
+            # give the user a chance to change preference levels as per consultant requests
+            overrides_file = OVERRIDES_FILE
+            write_overrides_template(overrides_file, responses.requests)
+            print(
+                f"\nNow outputting to {overrides_file}... "
+                + "Please add any preference level overrides now.\nKey:"
+                + f"\n {PREF_PREFERABLE}: PREFERRED"
+                + f"\n {PREF_NEUTRAL}: NEUTRAL"
+                + f"\n {PREF_NOT_PREFERABLE}: NOT PREFERRED"
+                + f"\n {PREF_UNAVAILABLE}: UNAVAILABLE"
+                + "\n\nConsultant requests:"
+            )
+            _print_consultant_requests(responses.requests)
+
+            # wait until user is done and presses return;
+            input("\nPress return when finished...\n>")
+
+        if overrides_file is not None:
+            with span("overrides"):
+                diff = apply_overrides(availability, load_overrides(overrides_file))
+            print("\nPreference level changes:")
+            print_override_diff(diff, block_minutes)
+
+        logger.info("\n=== CREATING SCHEDULE ===")
+        banner = "\n=== SCHEDULE CREATED SUCCESSFULLY ==="
+        with span("schedule") as schedule_span:
+            if fast:
+                feasible, x = heuristic_schedule(availability, feasible_hours)
+                # a preview is shown even if it breaks bounds, since that's likely while
+                # responses are still coming in
+                solved = True
+                if not feasible:
+                    banner = "\n=== DRAFT SCHEDULE CREATED (BREAKS SOME BOUNDS) ==="
+                    logger.warning(
+                        "Draft schedule breaks some bounds (uncovered slots or weekly/daily "
+                        + "hours) - run without fast for a valid schedule"
+                    )
+            elif coarse_minutes is not None:
+                status, x = coarse_to_fine_schedule(
+                    availability, feasible_hours, coarse_minutes
+                )
+                solved = status == LpStatusOptimal
+                status_str = f"Linear Program Status: {LpStatus[status]}"
+            elif time_limit is None:
+                status, x = create_schedule(
+                    availability, feasible_hours, cache=SolveCache()
+                )
+                solved = status == LpStatusOptimal
+                status_str = f"Linear Program Status: {LpStatus[status]}"
+            else:
+                quality, x = anytime_schedule(
+                    availability, feasible_hours, time_limit, gap_rel, msg=False
+                )
+                solved = quality != ANYTIME_NO_SOLUTION
+                status_str = f"Solution quality: {quality}"
+            schedule_span.set(solved=solved)
+
+        if solved:
+            logger.info(banner)
+            with span("format"):
+                sched_formatter = ScheduleFormatter(x, availability.to_df())
+            print("=====")
+            sched_formatter.print_schedule_by_day()
+            print("=====")
+            sched_formatter.print_schedule_by_consultant()
+
+            if export_file is not None:
+                with span("export", format=export_format):
+                    export = getattr(sched_formatter, f"export_{export_format}")
+                    export(export_file)
+                logger.info(f"\nSchedule written to {export_file}")
+        else:
+            logger.warning("\n=== COULD NOT CREATE SCHEDULE ===")
+            logger.warning(status_str)
 
     return x
 
 
 if __name__ == "__main__":
     # TODO: use fire
-    # TODO: add step where user can manually correct shift preferences
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     run("example/availability.csv")
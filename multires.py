@@ -0,0 +1,163 @@
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pulp.constants import (  # type: ignore
+    LpStatusInfeasible,
+    LpStatusOptimal,
+)
+
+from lp import (
+    PREFERENCE_COSTS,
+    ScheduleModel,
+    _as_matrix,
+    _daily_max_blocks,
+    _day_starts,
+    _weekly_bounds,
+    precheck,
+)
+from presolve import restrict
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix
+from solvers import DEFAULT_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# block length of the first, coarse solve
+COARSE_MINUTES = 60
+
+# coarse blocks on either side of each coarse assignment that the fine solve can move into
+REFINE_RADIUS = 1
+
+
+def coarse_feasible_blocks(
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+    block_minutes: int,
+    coarse_minutes: int,
+) -> Optional[dict[str, tuple[int, int]]]:
+    """
+    Converts feasible block allocations to a coarser block length. Minimums are rounded down and
+    maximums up, so a range narrower than a coarse block doesn't make the coarse model infeasible
+    """
+    if feasible_blocks is None:
+        return None
+
+    return {
+        consultant: (
+            lo * block_minutes // coarse_minutes,
+            -(-hi * block_minutes // coarse_minutes),
+        )
+        for consultant, (lo, hi) in feasible_blocks.items()
+    }
+
+
+def _dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Grows each row of a (consultants x slots) mask by radius slots on either side
+    """
+    num_slots = mask.shape[1]
+    counts = np.zeros((mask.shape[0], num_slots + 1), dtype=np.int64)
+    np.cumsum(mask, axis=1, out=counts[:, 1:])
+
+    positions = np.arange(num_slots)
+    lo = np.clip(positions - radius, 0, num_slots)
+    hi = np.clip(positions + radius + 1, 0, num_slots)
+    return counts[:, hi] > counts[:, lo]
+
+
+def coarse_to_fine_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    coarse_minutes: int = COARSE_MINUTES,
+    radius: int = REFINE_RADIUS,
+    backend: str = DEFAULT_BACKEND,
+    **solver_options,
+) -> tuple[int, dict]:
+    """
+    Solves at coarse_minutes resolution first, then at the availability's own block length with
+    each consultant's variables restricted to within radius coarse blocks of their coarse
+    schedule. Much smaller than solving the fine model outright, at the cost of optimality.
+
+    If the coarse model is infeasible (a coarse block is only available to a consultant who is
+    available for all of it) the fine model is solved in full. If the restricted fine model is
+    infeasible the radius is doubled until it is the full model.
+
+    feasible_blocks: dict output from allocate_feasible_blocks() in read_csv.py, in blocks of the
+        availability's length
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+        for both solves
+
+    Returns (status, x), same as create_schedule()
+    """
+    fine = _as_matrix(df)
+    block_minutes = fine.block_minutes
+    if coarse_minutes <= block_minutes or coarse_minutes % block_minutes:
+        raise ValueError(
+            f"coarse_minutes ({coarse_minutes}) must be a multiple of the block length "
+            + f"({block_minutes})"
+        )
+
+    violations = precheck(fine, feasible_blocks)
+    if violations:
+        logger.warning(f"Skipping coarse-to-fine solve: {violations[0].message}")
+        return LpStatusInfeasible, {}
+
+    coarse = fine.resample(coarse_minutes)
+    coarse_model = ScheduleModel(
+        coarse,
+        coarse_feasible_blocks(feasible_blocks, block_minutes, coarse_minutes),
+        presolve=True,
+    )
+    # a coarse block stands for several fine ones, so weigh its preference cost (but not shift
+    # changes) as much as theirs
+    coarse_model.set_preference_costs(
+        {
+            level: cost * coarse_minutes // block_minutes
+            for level, cost in PREFERENCE_COSTS.items()
+        }
+    )
+    status, solve_time = coarse_model.solve(backend, **solver_options)
+    logger.info(
+        f"Solved {coarse_minutes}-minute model ({coarse_model.stats['num_variables']} "
+        + f"variables) with {backend} in {solve_time:.3f}s"
+    )
+
+    available = fine.values != PREF_UNAVAILABLE
+    if status == LpStatusOptimal:
+        guide = coarse_model.assigned_blocks()[:, coarse.block_index(fine.block_starts)]
+    else:
+        logger.info("Coarse model has no schedule, solving the full model")
+        guide = None
+
+    day_starts = _day_starts(fine)
+    weekly_min, weekly_max = _weekly_bounds(
+        fine.consultants, feasible_blocks, block_minutes
+    )
+    refine_radius = radius * coarse_minutes // block_minutes
+
+    while True:
+        if guide is not None and refine_radius >= fine.num_blocks:
+            guide = None
+        allowed = (
+            available if guide is None else available & _dilate(guide, refine_radius)
+        )
+
+        reduced = restrict(
+            allowed,
+            day_starts,
+            weekly_min,
+            weekly_max,
+            _daily_max_blocks(block_minutes),
+        )
+        model = ScheduleModel(fine, feasible_blocks, reduced=reduced)
+        if guide is not None:
+            model.set_start(guide & available)
+
+        status, solve_time = model.solve(backend, **solver_options)
+        logger.info(
+            f"Solved {block_minutes}-minute model ({model.stats['num_variables']} variables) "
+            + f"with {backend} in {solve_time:.3f}s"
+        )
+        if status != LpStatusInfeasible or guide is None:
+            return status, model.x
+        refine_radius *= 2
@@ -0,0 +1,226 @@
+from typing import NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+from read_csv import DAY_COLUMNS
+from sched_setup import (
+    BLOCK_MINUTES,
+    PREF_NEUTRAL,
+    PREF_NOT_PREFERABLE,
+    PREF_PREFERABLE,
+    PREF_UNAVAILABLE,
+    AvailabilityMatrix,
+)
+
+# names that can be used instead of numbers in the level column of an overrides file
+PREF_LEVEL_NAMES = {
+    "preferred": PREF_PREFERABLE,
+    "neutral": PREF_NEUTRAL,
+    "not_preferred": PREF_NOT_PREFERABLE,
+    "unavailable": PREF_UNAVAILABLE,
+}
+
+OVERRIDE_COLUMNS = ["consultant", "day", "time", "level"]
+
+
+class PreferenceOverride(NamedTuple):
+    """
+    Sets a consultant's preference level over a time range on one day of the week
+    """
+
+    consultant: str
+    day_of_week: int
+    start_time: str
+    end_time: str
+    pref_level: int
+
+
+def _check_day(day_of_week: int) -> int:
+    if not 0 <= day_of_week < len(DAY_COLUMNS):
+        raise ValueError(
+            f"day {day_of_week} is out of range (0-{len(DAY_COLUMNS) - 1}, Monday == 0)"
+        )
+    return day_of_week
+
+
+def _check_level(pref_level: int) -> int:
+    if pref_level not in PREF_LEVEL_NAMES.values():
+        raise ValueError(
+            f"unknown preference level {pref_level} "
+            + f"(options: {sorted(PREF_LEVEL_NAMES.values())})"
+        )
+    return pref_level
+
+
+def parse_day(day: str) -> int:
+    """
+    Day of the week from its name or number (0 is Monday), as in an overrides file
+    """
+    day = day.strip()
+    if day.isdigit():
+        return _check_day(int(day))
+    if day.capitalize() not in DAY_COLUMNS:
+        raise ValueError(f"unknown day {day!r}")
+    return DAY_COLUMNS[day.capitalize()]
+
+
+def parse_level(level: str) -> int:
+    """
+    Preference level from its name or number, as in an overrides file
+    """
+    level = level.strip().lower()
+    if level.isdigit():
+        return _check_level(int(level))
+    if level not in PREF_LEVEL_NAMES:
+        raise ValueError(
+            f"unknown preference level {level!r} (options: {list(PREF_LEVEL_NAMES)})"
+        )
+    return PREF_LEVEL_NAMES[level]
+
+
+def load_overrides(overrides_file: str) -> list[PreferenceOverride]:
+    """
+    Reads an overrides file: a CSV with columns consultant, day, time, level, e.g.
+
+        consultant,day,time,level
+        test1@brown.edu,Tuesday,09:00-12:00,3
+        test2@brown.edu,Friday,14:00-16:00,not_preferred
+
+    day is a weekday name or number (Monday == 0), time is an "HH:MM-HH:MM" range (end exclusive)
+    and level is a preference level number or one of PREF_LEVEL_NAMES. Lines starting with # are
+    ignored.
+    """
+    df = pd.read_csv(overrides_file, dtype=str, comment="#", skipinitialspace=True)
+
+    missing = set(OVERRIDE_COLUMNS) - set(df.columns)
+    if missing:
+        raise RuntimeError(
+            f"Error: overrides file is missing columns {sorted(missing)}"
+        )
+
+    overrides = []
+    for consultant, day, time_range, level in df[OVERRIDE_COLUMNS].itertuples(
+        index=False, name=None
+    ):
+        try:
+            start_time, end_time = time_range.split("-")
+            overrides.append(
+                PreferenceOverride(
+                    consultant.strip(),
+                    parse_day(day),
+                    start_time.strip(),
+                    end_time.strip(),
+                    parse_level(level),
+                )
+            )
+        except (AttributeError, ValueError) as e:
+            raise ValueError(
+                f"Error: invalid override {consultant},{day},{time_range},{level} ({e})"
+            ) from e
+
+    return overrides
+
+
+def apply_overrides(
+    availability: AvailabilityMatrix, overrides: Sequence[PreferenceOverride]
+) -> pd.DataFrame:
+    """
+    Applies overrides to the availability matrix in place, in order (later overrides win where they
+    overlap). Raises ValueError for an override with an unknown consultant, day or level, before
+    any override is applied.
+
+    Returns a diff of the changed blocks, with columns consultant, time, old and new.
+    """
+    for override in overrides:
+        try:
+            availability.consultant_index(override.consultant)
+        except KeyError:
+            raise ValueError(
+                f"Error: override for unknown consultant {override.consultant!r}"
+            ) from None
+        try:
+            _check_day(override.day_of_week)
+            _check_level(override.pref_level)
+        except ValueError as e:
+            raise ValueError(f"Error: invalid override {override} ({e})") from None
+
+    before = availability.values.copy()
+
+    for override in overrides:
+        start, end = availability.block_range(
+            override.day_of_week, override.start_time, override.end_time
+        )
+        c = availability.consultant_index(override.consultant)
+        availability.values[c, start:end] = override.pref_level
+
+    changed_c, changed_t = np.nonzero(before != availability.values)
+
+    return pd.DataFrame(
+        {
+            "consultant": np.asarray(availability.consultants, dtype=object)[changed_c],
+            "time": availability.time_index()[changed_t],
+            "old": before[changed_c, changed_t],
+            "new": availability.values[changed_c, changed_t],
+        }
+    )
+
+
+def print_override_diff(diff: pd.DataFrame, block_minutes: int = BLOCK_MINUTES):
+    """
+    Prints the diff returned by apply_overrides() as one line per changed range of blocks
+
+    block_minutes: length of a block of the availability the overrides were applied to
+    """
+    if diff.empty:
+        print("No preference levels changed.")
+        return
+
+    # consolidate consecutive blocks with the same change into ranges
+    block_length = pd.Timedelta(minutes=block_minutes)
+    diff = diff.sort_values(["consultant", "time"])
+    new_range = (
+        (diff["consultant"] != diff["consultant"].shift())
+        | (diff["old"] != diff["old"].shift())
+        | (diff["new"] != diff["new"].shift())
+        | (diff["time"].diff() != block_length)
+    )
+    ranges = diff.groupby(new_range.cumsum()).agg(
+        consultant=("consultant", "first"),
+        start=("time", "first"),
+        end=("time", "last"),
+        old=("old", "first"),
+        new=("new", "first"),
+    )
+
+    for row in ranges.itertuples(index=False):
+        end = row.end + block_length
+        print(
+            f"{row.consultant}: {row.start:%a %H:%M}-{end:%H:%M} {row.old} -> {row.new}"
+        )
+
+
+def write_overrides_template(overrides_file: str, requests: dict[str, str]):
+    """
+    Writes an empty overrides file with the preference level key and consultant requests as
+    comments, to be filled in by hand
+    """
+    lines = [
+        "# Preference level overrides: one consultant,day,time,level row per change",
+        "# e.g. test1@brown.edu,Tuesday,09:00-12:00,3",
+        "#",
+        "# Key:",
+        f"#  {PREF_PREFERABLE}: PREFERRED",
+        f"#  {PREF_NEUTRAL}: NEUTRAL",
+        f"#  {PREF_NOT_PREFERABLE}: NOT PREFERRED",
+        f"#  {PREF_UNAVAILABLE}: UNAVAILABLE",
+        "#",
+        "# Consultant requests:",
+    ]
+    for email, request in requests.items():
+        lines.append(f"#  {email}: {' '.join(str(request).split())}")
+
+    lines.append(",".join(OVERRIDE_COLUMNS))
+
+    with open(overrides_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,259 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from lp import ScheduleModel, _as_matrix, _weekly_bounds, precheck
+from sched_setup import AvailabilityMatrix
+from shift_patterns import ShiftModel, enumerate_shifts
+from solvers import (
+    ANYTIME_NO_SOLUTION,
+    ANYTIME_OPTIMAL,
+    highspy,
+    solve_anytime,
+)
+
+logger = logging.getLogger(__name__)
+
+# every finished race is appended here as a line of JSON, to tune the default configuration from
+PORTFOLIO_LOG = "portfolio_log.jsonl"
+
+# seconds to wait past the deadline for workers to report their best schedule
+DEADLINE_GRACE = 5
+
+
+def default_portfolio(num_workers: Optional[int] = None) -> list[dict]:
+    """
+    A mix of formulations, backends and seeds, one single-threaded configuration per worker.
+    Configurations are keyword arguments for _solve_configuration(): engine ("blocks" or
+    "shifts"), backend, seed, threads and presolve (blocks engine only).
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    configurations = [
+        {"engine": "blocks", "backend": "cbc", "seed": 0},
+        {"engine": "shifts", "backend": "cbc", "seed": 0},
+    ]
+    if highspy is not None:
+        configurations += [
+            {"engine": "blocks", "backend": "highs", "seed": 0},
+            {"engine": "shifts", "backend": "highs", "seed": 0},
+        ]
+
+    # fill the remaining workers with more seeds of the block model
+    seed = 1
+    while len(configurations) < num_workers:
+        configurations.append({"engine": "blocks", "backend": "cbc", "seed": seed})
+        seed += 1
+
+    return [dict(config, threads=1) for config in configurations[:num_workers]]
+
+
+def _describe(config: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in config.items())
+
+
+def _solve_configuration(
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+    time_limit: float,
+    engine: str = "blocks",
+    backend: str = "cbc",
+    presolve: bool = True,
+    **solver_options,
+) -> tuple[str, Optional[float], np.ndarray]:
+    """
+    Solves with one portfolio configuration. Returns (quality, objective, assigned blocks mask)
+    """
+    if engine == "blocks":
+        model = ScheduleModel(availability, feasible_blocks, presolve)
+        result = model.solve_anytime(time_limit, None, None, backend, **solver_options)
+
+        assigned = model.assigned_blocks()
+    elif engine == "shifts":
+        weekly_min, weekly_max = _weekly_bounds(
+            availability.consultants, feasible_blocks, availability.block_minutes
+        )
+        columns = enumerate_shifts(availability, weekly_max)
+        model = ShiftModel(availability, columns, weekly_min, weekly_max)
+        result = solve_anytime(
+            model.prob, time_limit, None, None, backend, **solver_options
+        )
+        assigned = model.assigned_blocks()
+    else:
+        raise ValueError(f'unknown engine {engine!r} (options: "blocks", "shifts")')
+
+    return result.quality, result.progress.objective, assigned
+
+
+def _worker(
+    results: multiprocessing.Queue,
+    index: int,
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+    time_limit: float,
+    config: dict,
+):
+    # own process group, so cancelling the worker also stops the solver subprocess it started
+    if hasattr(os, "setsid"):
+        os.setsid()
+
+    start = time.perf_counter()
+    try:
+        quality, objective, assigned = _solve_configuration(
+            availability, feasible_blocks, time_limit, msg=False, **config
+        )
+    except Exception as e:
+        # report the failure rather than leaving the race waiting on this worker
+        logger.warning(f"Portfolio: {_describe(config)} failed: {e!r}")
+        quality, objective, assigned = ANYTIME_NO_SOLUTION, None, np.zeros((0, 0))
+
+    results.put(
+        (
+            index,
+            quality,
+            objective,
+            np.argwhere(assigned).tolist(),
+            time.perf_counter() - start,
+        )
+    )
+
+
+def _cancel(process: multiprocessing.Process):
+    if not process.is_alive():
+        return
+
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    else:
+        process.terminate()
+    process.join(timeout=1)
+    if process.is_alive():
+        process.kill()
+
+
+class PortfolioResult(NamedTuple):
+    """
+    Output of portfolio_schedule()
+    """
+
+    quality: str  # one of the solvers.ANYTIME_* constants
+    x: dict  # same as from create_schedule()
+    winner: Optional[dict]  # configuration that produced x
+    objective: Optional[float]
+    elapsed: float
+
+
+def portfolio_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    configurations: Optional[list[dict]] = None,
+    time_limit: float = 60,
+    log_file: Optional[str] = PORTFOLIO_LOG,
+) -> PortfolioResult:
+    """
+    Races several solver configurations (see default_portfolio()) in parallel processes. Returns
+    the first proven-optimal schedule, or the best one found by time_limit, and cancels the other
+    configurations.
+
+    log_file: append the race's configurations, results and winner here as a line of JSON
+    """
+    availability = _as_matrix(df)
+    if configurations is None:
+        configurations = default_portfolio()
+
+    violations = precheck(availability, feasible_blocks)
+    if violations:
+        logger.warning(f"Skipping portfolio: {violations[0].message}")
+        return PortfolioResult(ANYTIME_NO_SOLUTION, {}, None, None, 0.0)
+
+    start = time.perf_counter()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_worker,
+            args=(results, i, availability, feasible_blocks, time_limit, config),
+            daemon=True,
+        )
+        for i, config in enumerate(configurations)
+    ]
+    for process in processes:
+        process.start()
+
+    finished = {}
+    deadline = start + time_limit + DEADLINE_GRACE
+    while len(finished) < len(processes):
+        try:
+            index, quality, objective, assigned, elapsed = results.get(
+                timeout=max(deadline - time.perf_counter(), 0.01)
+            )
+        except queue.Empty:
+            break
+
+        finished[index] = (quality, objective, assigned, elapsed)
+        logger.info(
+            f"Portfolio: {_describe(configurations[index])} finished in {elapsed:.1f}s "
+            + f"({quality}, objective {objective})"
+        )
+        if quality == ANYTIME_OPTIMAL:
+            break
+
+    for process in processes:
+        _cancel(process)
+
+    solved = {i: r for i, r in finished.items() if r[1] is not None}
+    elapsed = time.perf_counter() - start
+
+    if solved:
+        best = min(
+            solved, key=lambda i: (solved[i][1], solved[i][0] != ANYTIME_OPTIMAL)
+        )
+        quality, objective, assigned, _ = solved[best]
+        winner = configurations[best]
+
+        mask = np.zeros(availability.values.shape, dtype=bool)
+        if assigned:
+            mask[tuple(np.array(assigned).T)] = True
+        x = availability.assignments(mask)
+        logger.info(
+            f"Portfolio winner: {_describe(winner)} ({quality}, objective {objective})"
+        )
+    else:
+        quality, objective, winner, x = ANYTIME_NO_SOLUTION, None, None, {}
+        logger.warning("Portfolio: no configuration found a schedule")
+
+    if log_file is not None:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "consultants": len(availability.consultants),
+            "blocks": availability.num_blocks,
+            "time_limit": time_limit,
+            "elapsed": elapsed,
+            "winner": winner,
+            "quality": quality,
+            "objective": objective,
+            "results": [
+                {
+                    "config": config,
+                    "quality": finished[i][0] if i in finished else "cancelled",
+                    "objective": finished[i][1] if i in finished else None,
+                    "elapsed": finished[i][3] if i in finished else None,
+                }
+                for i, config in enumerate(configurations)
+            ],
+        }
+        with open(log_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    return PortfolioResult(quality, x, winner, objective, elapsed)
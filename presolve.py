@@ -0,0 +1,188 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class PresolveResult(NamedTuple):
+    """
+    Reduced scheduling model. Arrays are indexed by consultant, slot and/or day.
+    """
+
+    # (consultants x slots) variables left in the model
+    free: np.ndarray
+    # (consultants x slots) variables fixed to 1 (available, not free and not fixed means fixed to 0)
+    fixed: np.ndarray
+    # (slots,) coverage constraints left in the model
+    keep_cover: np.ndarray
+    # (consultants,) weekly bounds with fixed blocks folded in, and which rows are left
+    weekly_min: np.ndarray
+    weekly_max: np.ndarray
+    keep_weekly_min: np.ndarray
+    keep_weekly_max: np.ndarray
+    # (consultants x days) daily caps with fixed blocks folded in, and which rows are left
+    daily_max: np.ndarray
+    keep_daily_max: np.ndarray
+
+
+def _per_day(mask: np.ndarray, day_starts: np.ndarray) -> np.ndarray:
+    """
+    Sums a (consultants x slots) mask over each day's contiguous range of slots
+    """
+    return np.add.reduceat(mask.astype(np.int64), day_starts, axis=1)
+
+
+def _reduce_rows(
+    free: np.ndarray,
+    fixed: np.ndarray,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: np.ndarray,
+) -> PresolveResult:
+    """
+    Folds fixed blocks into the weekly/daily bounds and drops rows that can never be violated.
+    Rows that are violated no matter what (e.g. more forced blocks than a consultant's maximum) are
+    kept so the solver still reports the model as infeasible.
+    """
+    fixed_week = fixed.sum(axis=1)
+    free_week = free.sum(axis=1)
+    fixed_day = _per_day(fixed, day_starts)
+    free_day = _per_day(free, day_starts)
+
+    weekly_min = weekly_min - fixed_week
+    weekly_max = weekly_max - fixed_week
+    daily_max = daily_max - fixed_day
+
+    return PresolveResult(
+        free=free,
+        fixed=fixed,
+        keep_cover=~fixed.any(axis=0),
+        weekly_min=weekly_min,
+        weekly_max=weekly_max,
+        keep_weekly_min=weekly_min > 0,
+        keep_weekly_max=free_week > weekly_max,
+        daily_max=daily_max,
+        keep_daily_max=free_day > daily_max,
+    )
+
+
+def no_presolve(
+    available: np.ndarray,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: np.ndarray,
+) -> PresolveResult:
+    """
+    The unreduced model: every available block is a variable and every row is kept
+    """
+    num_consultants, num_slots = available.shape
+    num_days = len(day_starts)
+
+    return PresolveResult(
+        free=available.copy(),
+        fixed=np.zeros_like(available),
+        keep_cover=np.ones(num_slots, dtype=bool),
+        weekly_min=weekly_min,
+        weekly_max=weekly_max,
+        keep_weekly_min=np.ones(num_consultants, dtype=bool),
+        keep_weekly_max=np.ones(num_consultants, dtype=bool),
+        daily_max=np.broadcast_to(daily_max, (num_consultants, num_days)).copy(),
+        keep_daily_max=np.ones((num_consultants, num_days), dtype=bool),
+    )
+
+
+def presolve(
+    available: np.ndarray,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: np.ndarray,
+) -> PresolveResult:
+    """
+    Shrinks the scheduling model without changing its optimal schedules:
+    - slots with exactly one available consultant are fixed to that consultant
+    - other consultants' blocks in covered slots are fixed to 0, as are blocks of consultants who
+      have reached their weekly or daily maximum through fixed blocks alone
+    - repeats until nothing else can be fixed (fixing to 0 can leave new single-consultant slots)
+    - fixed blocks are folded into the weekly/daily bounds and redundant rows are dropped
+
+    available: (consultants x slots) mask of available blocks
+    day_starts: index of each day's first slot
+    weekly_min, weekly_max: (consultants,) weekly block bounds
+    daily_max: per-day block cap, scalar or (consultants x days)
+    """
+    num_slots = available.shape[1]
+    day_of_slot = np.repeat(
+        np.arange(len(day_starts)), np.diff(day_starts, append=num_slots)
+    )
+    daily_max = np.broadcast_to(daily_max, (available.shape[0], len(day_starts)))
+
+    free = available.copy()
+    fixed = np.zeros_like(available)
+
+    while True:
+        covered = fixed.any(axis=0)
+        at_weekly_max = fixed.sum(axis=1) >= weekly_max
+        at_daily_max = _per_day(fixed, day_starts) >= daily_max
+
+        reduced = (
+            free
+            & ~covered[None, :]
+            & ~at_weekly_max[:, None]
+            & ~at_daily_max[:, day_of_slot]
+        )
+
+        single = ~covered & (reduced.sum(axis=0) == 1)
+        newly_fixed = reduced & single[None, :]
+        reduced &= ~newly_fixed
+
+        if not newly_fixed.any() and (reduced == free).all():
+            break
+
+        free = reduced
+        fixed |= newly_fixed
+
+    return _reduce_rows(free, fixed, day_starts, weekly_min, weekly_max, daily_max)
+
+
+def fix_outside(
+    available: np.ndarray,
+    neighborhood: np.ndarray,
+    assigned: np.ndarray,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: np.ndarray,
+) -> PresolveResult:
+    """
+    Fixes every block outside the neighborhood to a previous schedule, leaving only the
+    neighborhood's blocks as variables (see repair.py)
+
+    neighborhood: (slots,) mask of slots to re-solve
+    assigned: (consultants x slots) mask of the previous schedule's blocks. Outside the
+        neighborhood, assigned blocks must still be available
+    """
+    daily_max = np.broadcast_to(daily_max, (available.shape[0], len(day_starts)))
+    free = available & neighborhood[None, :]
+    fixed = assigned & available & ~neighborhood[None, :]
+    return _reduce_rows(free, fixed, day_starts, weekly_min, weekly_max, daily_max)
+
+
+def restrict(
+    allowed: np.ndarray,
+    day_starts: np.ndarray,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    daily_max: np.ndarray,
+) -> PresolveResult:
+    """
+    Only the allowed blocks are left as variables, every other block is fixed to 0 (see
+    multires.py)
+
+    allowed: (consultants x slots) mask of available blocks to keep
+    """
+    daily_max = np.broadcast_to(daily_max, (allowed.shape[0], len(day_starts)))
+    return _reduce_rows(
+        allowed, np.zeros_like(allowed), day_starts, weekly_min, weekly_max, daily_max
+    )
@@ -1,27 +1,53 @@
+import logging
 import re
-from math import ceil
+from typing import NamedTuple, Optional
 
+import numpy as np
 import pandas as pd
 
 from lp import CONSULTANT_MAX_HOURS, CONSULTANT_MIN_HOURS
 from sched_setup import (
+    BLOCK_MINUTES,
     PREF_NEUTRAL,
     SUNLAB_HOURS,
-    add_consultant_hours_to_df,
-    setup_consultant_availability_df,
+    AvailabilityMatrix,
+    blocks_to_hours,
+    hours_to_blocks,
 )
+from tracing import count
+
+logger = logging.getLogger(__name__)
 
 TOT_WEEKLY_SUNLAB_HOURS = 95
 
+EMAIL_COLNAME = "Email Address"
+
+# map csv column names to weekdays
+# TODO: do something clever with strptime/strftime here
+DAY_COLUMNS = {
+    "Monday": 0,
+    "Tuesday": 1,
+    "Wednesday": 2,
+    "Thursday": 3,
+    "Friday": 4,
+    "Saturday": 5,
+    "Sunday": 6,
+}
+
+# matches time ranges like "9am-2pm", "10:30am - 1pm" or "3-5pm"
+TIME_RANGE_PATTERN = (
+    r"(\d{1,2})(?::(\d{2}))?([ap]m?)? ?- ?(\d{1,2})(?::(\d{2}))?([ap]m?)?"
+)
+
+# memo of already-parsed time range strings -> (start, end) in minutes since midnight
+_time_range_memo: dict[str, tuple[float, float]] = {}
+
 
 def _convert_to_24h_format(time_str: str) -> tuple[str, str] | None:
     """
     Converts time strings like "9am-2pm" to ("09:00", "14:00") format.
     """
-    match = re.match(
-        r"(\d{1,2})(?::(\d{2}))?([ap]m?)? ?- ?(\d{1,2})(?::(\d{2}))?([ap]m?)?",
-        time_str.strip().lower(),
-    )
+    match = re.match(TIME_RANGE_PATTERN, time_str.strip().lower())
     if not match:
         return None
 
@@ -59,18 +85,89 @@ def _convert_to_24h_format(time_str: str) -> tuple[str, str] | None:
 
     tup = f"{start_hour:02}:{start_minute}", f"{end_hour:02}:{end_minute}"
 
-    print(f"{time_str} -> {tup}")
+    logger.debug(f"{time_str} -> {tup}")
 
     return tup
 
 
-def _hours_to_blocks(hours: int):
+def _hours_to_blocks(hours, block_minutes: int = BLOCK_MINUTES):
     # TODO: use this more
-    return hours * 2
+    return hours_to_blocks(hours, block_minutes)
+
+
+def water_fill_blocks(
+    requested_blocks: np.ndarray,
+    total_blocks: float,
+    weights: Optional[np.ndarray] = None,
+    leave_unfilled: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Water-filling allocation of total_blocks between consultants in one sorted sweep.
+
+    Consultants whose (weighted) request is below the running average of what's left get exactly
+    their request. Everyone else shares the rest in proportion to their weight, with an 85-105%
+    range around their share.
+
+    requested_blocks: number of blocks requested by each consultant
+    weights: relative share of each consultant (all equal if not given)
+    leave_unfilled: allow every request to fit with hours left over (instead of raising)
+
+    Returns (min_blocks, max_blocks) arrays, in the same order as requested_blocks
+    """
+    requested_blocks = np.asarray(requested_blocks, dtype=float)
+    weights = (
+        np.ones_like(requested_blocks)
+        if weights is None
+        else np.asarray(weights, dtype=float)
+    )
+
+    # sort by request per unit weight. the running average (water level) only rises as requests
+    # below it are granted, so everyone who gets their request comes before everyone who doesn't
+    order = np.argsort(requested_blocks / weights, kind="stable")
+    requested_sorted = requested_blocks[order]
+    weights_sorted = weights[order]
+
+    # blocks and weight left before each consultant in the sweep
+    remaining_blocks = total_blocks - np.cumsum(requested_sorted) + requested_sorted
+    remaining_weight = weights_sorted[::-1].cumsum()[::-1]
+    water_level = remaining_blocks / remaining_weight
+
+    below_level = requested_sorted < weights_sorted * water_level
+    num_granted = len(order) if below_level.all() else int(np.argmin(below_level))
+
+    min_blocks = np.empty(len(order), dtype=np.int64)
+    max_blocks = np.empty(len(order), dtype=np.int64)
+
+    # make sure they get exactly their request if they requested less than average
+    granted = order[:num_granted]
+    min_blocks[granted] = requested_blocks[granted]
+    max_blocks[granted] = requested_blocks[granted]
+
+    if num_granted == len(order):
+        if not leave_unfilled:
+            raise RuntimeError("Warning: Unallocated hours remaining.")
+        return min_blocks, max_blocks
+
+    # need to allocate blocks to everyone who requested over average
+    sharing = order[num_granted:]
+    share = weights[sharing] * water_level[num_granted]
+
+    # TODO: add some sort of validation to make sure this doesn't leave the people who requested
+    # more hours with less than the ones who requested fewer
+    min_blocks[sharing] = np.ceil(0.85 * share)
+    max_blocks[sharing] = np.ceil(1.05 * share)
+
+    return min_blocks, max_blocks
 
 
 def allocate_feasible_blocks(
-    csv_file: str, total_hours: int = TOT_WEEKLY_SUNLAB_HOURS
+    requested_hours: dict[str, int] | str,
+    total_hours: int = TOT_WEEKLY_SUNLAB_HOURS,
+    weights: Optional[dict[str, float]] = None,
+    leave_unfilled: bool = False,
+    block_minutes: int = BLOCK_MINUTES,
+    min_hours: int = CONSULTANT_MIN_HOURS,
+    max_hours: int = CONSULTANT_MAX_HOURS,
 ) -> dict[str, tuple[int, int]]:
     """
     Allocates feasible blocks to consultants based on their requested hours.
@@ -79,73 +176,164 @@ def allocate_feasible_blocks(
     they get their request. Any consultants who have requested more than what is possible get the
     average of however many hours remain.
 
+    requested_hours: requested_hours from ingest_responses(), or the path to the responses CSV
+    weights: optional relative share of the remaining hours for each consultant (default 1)
+    leave_unfilled: allow the requests to add up to fewer than total_hours
+    block_minutes: length of a block (same as the availability matrix's)
+    min_hours, max_hours: the legal range of weekly hours a consultant can request
+
     Returns dict in form {"consultant_email@brown.edu": (min_blocks), (max_blocks)}
-    (note: 2 blocks per hour)
+    (note: 2 blocks per hour at the default block length)
     """
-    df = pd.read_csv(csv_file)
+    if isinstance(requested_hours, str):
+        requested_hours = _read_requested_hours(pd.read_csv(requested_hours))
 
-    # TODO: don't hardcode column indices - maybe rename columns or set standard?
-    requested_blocks = df.iloc[:, 1:3].dropna()
+    emails = list(requested_hours)
     # convert hours to blocks
-    requested_blocks.iloc[:, 1] = requested_blocks.iloc[:, 1].astype(int) * 2
-
-    allocation = {}
-    remaining_blocks = _hours_to_blocks(total_hours)
-    remaining_consultants = len(requested_blocks)
-
-    while remaining_consultants > 0:
-        avg_blocks = remaining_blocks / remaining_consultants
-        reassess = []
-
-        for _, (email, blocks) in requested_blocks.iterrows():
-            if (blocks < _hours_to_blocks(CONSULTANT_MIN_HOURS)) or (
-                blocks > _hours_to_blocks(CONSULTANT_MAX_HOURS)
-            ):
-                raise RuntimeError(
-                    f"consultant {email} requested illegal number of hours: {blocks / 2} "
-                    + f"(min: {CONSULTANT_MIN_HOURS}, max: {CONSULTANT_MAX_HOURS})"
-                )
-
-            if blocks < avg_blocks:
-                # make sure they get exactly their request if they requested less than average
-                allocation[email] = (blocks, blocks)
-                remaining_blocks -= blocks
-                remaining_consultants -= 1
-            else:
-                reassess.append((email, blocks))
-
-        if len(reassess) == remaining_consultants:
-            break
-
-    if len(reassess) == 0:
-        # TODO: remove this later if i want to add flexibility to leave some hours empty
-        raise RuntimeError("Warning: Unallocated hours remaining.")
+    requested_blocks = _hours_to_blocks(
+        np.array([requested_hours[email] for email in emails], dtype=np.int64),
+        block_minutes,
+    )
 
-    # need to allocate blocks to everyone who requested over average
-    avg_blocks = remaining_blocks / remaining_consultants
+    illegal = (requested_blocks < _hours_to_blocks(min_hours, block_minutes)) | (
+        requested_blocks > _hours_to_blocks(max_hours, block_minutes)
+    )
+    if illegal.any():
+        email = emails[int(np.argmax(illegal))]
+        raise RuntimeError(
+            f"consultant {email} requested illegal number of hours: {requested_hours[email]} "
+            + f"(min: {min_hours}, max: {max_hours})"
+        )
+
+    min_blocks, max_blocks = water_fill_blocks(
+        requested_blocks,
+        _hours_to_blocks(total_hours, block_minutes),
+        None if weights is None else [weights.get(email, 1) for email in emails],
+        leave_unfilled,
+    )
 
-    max_default_allocation = ceil(1.05 * avg_blocks)
+    allocation = {
+        email: (int(lo), int(hi))
+        for email, lo, hi in zip(emails, min_blocks, max_blocks)
+    }
 
-    # TODO: add some sort of validation to make sure this doesn't leave the people who requested
-    # more hours with less than the ones who requested fewer
-    min_default_allocation = ceil(0.85 * avg_blocks)
+    if logger.isEnabledFor(logging.INFO):
+        alloc_str = [
+            f"{email}: {blocks_to_hours(min, block_minutes):.1f}-"
+            + f"{blocks_to_hours(max, block_minutes):.1f} hrs ({min}-{max} blocks)"
+            for email, (min, max) in allocation.items()
+        ]
+        logger.info("HOURS ALLOCATION:\n" + "\n".join(alloc_str))
 
-    for email, _ in reassess:
-        allocation[email] = (min_default_allocation, max_default_allocation)
+    return allocation
 
-    print("HOURS ALLOCATION:")
-    alloc_str = [
-        f"{email}: {min / 2:.1f}-{max / 2:.1f} hrs ({min}-{max} blocks)"
-        for email, (min, max) in allocation.items()
-    ]
-    print("\n".join(alloc_str))
 
-    return allocation
+class ParseFailure(NamedTuple):
+    """
+    A time range from the responses CSV that could not be parsed
+    """
 
+    email: str
+    day: str
+    raw: str
 
-def parse_availability(csv_file: str) -> pd.DataFrame:
+
+class IngestResult(NamedTuple):
     """
-    Parses consultant availability from a CSV file and returns a DataFrame.
+    Everything main.run needs from a responses CSV, read in a single pass
+    """
+
+    availability: AvailabilityMatrix
+    # {"consultant_email@brown.edu": hours}
+    requested_hours: dict[str, int]
+    # {"consultant_email@brown.edu": free-text request} for consultants who made one
+    requests: dict[str, str]
+    # time ranges that couldn't be parsed (and weren't corrected)
+    failures: list[ParseFailure]
+
+
+def _parse_time_ranges(slots: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized version of _convert_to_24h_format. Parses every time range string in slots in bulk
+    and returns a DataFrame (same index as slots) with "start" and "end" columns in minutes since
+    midnight, or NaN where the string could not be parsed.
+
+    Results are memoized, so each distinct range string is only ever parsed once.
+    """
+    unseen = pd.Series(slots[~slots.isin(_time_range_memo)].unique(), dtype=str)
+
+    if len(unseen) > 0:
+        groups = unseen.str.strip().str.lower().str.extract("^" + TIME_RANGE_PATTERN)
+
+        start_hour = groups[0].astype(float)
+        start_minute = groups[1].fillna("0").astype(float)
+        end_hour = groups[3].astype(float)
+        end_minute = groups[4].fillna("0").astype(float)
+        # normalize "am" and "pm" to "a" and "p". end period should be there no matter what
+        start_period = groups[2].str[0].fillna("")
+        end_period = groups[5].str[0]
+
+        # handle "3-5pm" as 3pm-5pm instead of 3am-5pm
+        start_period = start_period.mask(
+            (start_period == "") & (end_period == "p"), "p"
+        )
+
+        start_hour = start_hour.mask(
+            (start_period == "p") & (start_hour != 12), start_hour + 12
+        )
+        start_hour = start_hour.mask((start_period == "a") & (start_hour == 12), 0)
+        end_hour = end_hour.mask((end_period == "p") & (end_hour != 12), end_hour + 12)
+        end_hour = end_hour.mask((end_period == "a") & (end_hour == 12), 0)
+
+        parsed = pd.DataFrame(
+            {"start": start_hour * 60 + start_minute, "end": end_hour * 60 + end_minute}
+        )
+
+        failed = (
+            end_period.isna()
+            | parsed.isna().any(axis=1)
+            | (start_hour > 23)
+            | (end_hour > 23)
+            | (start_minute > 59)
+            | (end_minute > 59)
+        )
+        parsed[failed] = np.nan
+
+        _time_range_memo.update(zip(unseen, parsed.itertuples(index=False, name=None)))
+
+    starts, ends = zip(*slots.map(_time_range_memo)) if len(slots) else ((), ())
+    return pd.DataFrame({"start": starts, "end": ends}, index=slots.index, dtype=float)
+
+
+def _read_requested_hours(df: pd.DataFrame) -> dict[str, int]:
+    """
+    Gets each consultant's requested weekly hours from the responses df
+    """
+    # TODO: don't hardcode column indices - maybe rename columns or set standard?
+    requested_hours = df.iloc[:, 1:3].dropna()
+    return dict(zip(requested_hours.iloc[:, 0], requested_hours.iloc[:, 1].astype(int)))
+
+
+def ingest_responses(
+    csv_file: str,
+    interactive: bool = True,
+    corrections: Optional[dict[tuple[str, str, str], Optional[str]] | str] = None,
+    block_minutes: int = BLOCK_MINUTES,
+    hours: dict[int, tuple[str, str]] = SUNLAB_HOURS,
+) -> IngestResult:
+    """
+    Reads the responses CSV once and parses availability, requested hours and free-text requests
+    from it.
+
+    Time ranges for every day column are parsed in bulk and written straight into the availability
+    matrix. Ones that can't be parsed are queued up rather than stopping the parse.
+
+    interactive: ask for the queued failures manually once everything else is parsed. If False,
+        the run never blocks and uncorrected failures are returned in IngestResult.failures
+    corrections: corrections mapping (or path to a corrections file) applied to the failures before
+        anything is asked for - see apply_corrections()
+    block_minutes: length of each block of the availability matrix
+    hours: the lab's opening hours, which the availability matrix covers
     """
     try:
         df = pd.read_csv(csv_file)
@@ -153,70 +341,162 @@ def parse_availability(csv_file: str) -> pd.DataFrame:
         raise RuntimeError(f"Error reading CSV file: {e}") from e
 
     # extract consultant emails
-    if "Email Address" not in df.columns:
-        raise RuntimeError("Error: 'Email Address' column not found in CSV.")
-
-    consultants = df["Email Address"].dropna().unique().tolist()
-
-    # initialize availability df
-    availability_df = setup_consultant_availability_df(SUNLAB_HOURS, consultants)  # type: ignore
-
-    # map csv column names to weekdays
-    # TODO: do something clever with strptime/strftime here
-    days = {
-        "Monday": 0,
-        "Tuesday": 1,
-        "Wednesday": 2,
-        "Thursday": 3,
-        "Friday": 4,
-        "Saturday": 5,
-        "Sunday": 6,
+    if EMAIL_COLNAME not in df.columns:
+        raise RuntimeError(f"Error: '{EMAIL_COLNAME}' column not found in CSV.")
+
+    df = df[df[EMAIL_COLNAME].notna()].reset_index(drop=True)
+    consultants = df[EMAIL_COLNAME].unique().tolist()
+
+    # initialize availability matrix (only converted to a df once parsing is done)
+    availability = AvailabilityMatrix.from_hours(hours, consultants, block_minutes)
+
+    # one row per (response, day) cell, then one row per comma-separated time range in the cell
+    day_columns = [day for day in DAY_COLUMNS if day in df.columns]
+    cells = df[day_columns].stack().astype(str).str.strip()
+    cells = cells[~cells.str.lower().isin(["none", "na", ""])]
+
+    slots = cells.str.split(",").explode().str.strip()
+    slots = slots[slots != ""]
+
+    parsed = _parse_time_ranges(slots)
+    ok = parsed["start"].notna().to_numpy()
+
+    rows = slots.index.get_level_values(0).to_numpy()
+    days = slots.index.get_level_values(1).map(DAY_COLUMNS).to_numpy()
+    consultant_indices = (
+        df[EMAIL_COLNAME].map(availability.consultant_index).to_numpy()[rows]
+    )
+
+    # write all parsed intervals into the matrix at once
+    # TODO: maybe account for adding preference levels during this stage?
+    # for now just do manually
+    day_offsets = days[ok] * 24 * 60
+    starts, ends = availability.block_ranges(
+        day_offsets + parsed["start"].to_numpy()[ok].astype(int),
+        day_offsets + parsed["end"].to_numpy()[ok].astype(int),
+    )
+    availability.set_blocks(consultant_indices[ok], starts, ends, PREF_NEUTRAL)
+
+    failures = [
+        ParseFailure(df.at[row, EMAIL_COLNAME], day, slot)
+        for (row, day), slot in slots[~ok].items()
+    ]
+    count("responses", len(df))
+    count("parsed_slots", int(ok.sum()))
+    count("unparsed_slots", len(failures))
+    if corrections is not None:
+        failures = apply_corrections(availability, failures, corrections)
+    if interactive and failures:
+        failures = apply_corrections(
+            availability, failures, _prompt_for_corrections(failures)
+        )
+
+    # TODO: don't hardcode
+    request_colname = df.columns[-1]
+    has_requests = df[request_colname].notna()
+    requests = dict(
+        zip(df.loc[has_requests, EMAIL_COLNAME], df.loc[has_requests, request_colname])
+    )
+
+    count("parse_failures", len(failures))
+    return IngestResult(availability, _read_requested_hours(df), requests, failures)
+
+
+def _prompt_for_corrections(
+    failures: list[ParseFailure],
+) -> dict[tuple[str, str, str], Optional[str]]:
+    """
+    Asks for a manual correction of each parse failure
+    """
+    return {
+        failure: input(
+            f"Cannot parse time slot '{failure.raw}' for {failure.email} on {failure.day}. "
+            + 'Please enter in "HH:MM-HH:MM" format or "None": '
+        )
+        for failure in failures
     }
 
-    for _, row in df.iterrows():
-        email = row.get("Email Address")
-        if pd.isna(email):
+
+def load_corrections(
+    corrections_file: str,
+) -> dict[tuple[str, str, str], Optional[str]]:
+    """
+    Reads a corrections CSV with columns email, day, raw, correction (the format written by
+    write_failures(), with the correction column filled in)
+    """
+    df = pd.read_csv(corrections_file, dtype=str, keep_default_na=False)
+    return {
+        (email, day, raw): correction
+        for email, day, raw, correction in df[
+            ["email", "day", "raw", "correction"]
+        ].itertuples(index=False, name=None)
+    }
+
+
+def write_failures(failures: list[ParseFailure], corrections_file: str):
+    """
+    Writes parse failures to a corrections CSV with an empty correction column to be filled in and
+    passed back through load_corrections()/apply_corrections()
+    """
+    df = pd.DataFrame(failures, columns=list(ParseFailure._fields))
+    df["correction"] = ""
+    df.to_csv(corrections_file, index=False)
+
+
+def apply_corrections(
+    availability: AvailabilityMatrix,
+    failures: list[ParseFailure],
+    corrections: dict[tuple[str, str, str], Optional[str]] | str,
+) -> list[ParseFailure]:
+    """
+    Applies a batch of corrections to the parse failures of an already-parsed availability matrix
+    (modified in place), without re-parsing the CSV.
+
+    corrections: {(email, day, raw): "HH:MM-HH:MM"}, or a path to a corrections file. A correction
+        of "None" (or None) means the consultant isn't available for that range after all. Blank
+        corrections (e.g. rows of a corrections file that weren't filled in) stay in the queue
+
+    Returns the failures that are still uncorrected.
+    """
+    if isinstance(corrections, str):
+        corrections = load_corrections(corrections)
+
+    remaining = []
+
+    for failure in failures:
+        if failure not in corrections:
+            remaining.append(failure)
+            continue
+
+        correction = corrections[failure]
+        if correction is None or correction.strip().lower() == "none":
+            continue
+        if not correction.strip():
+            # not corrected yet
+            remaining.append(failure)
             continue
 
-        for day, day_index in days.items():
-            raw_times = row.get(day, "None")
-
-            if (
-                pd.isna(raw_times)
-                or raw_times.strip().lower() == "none"
-                or raw_times.strip().lower() == "na"
-            ):
-                continue
-
-            for slot in raw_times.split(","):
-                slot = slot.strip()
-                parsed_time = _convert_to_24h_format(slot)
-
-                if parsed_time:  # parse succeeded
-                    start_time, end_time = parsed_time
-
-                else:  # parse failed - get manual input
-                    user_input = input(
-                        f"Cannot parse time slot '{slot}' for {email} on {day}. "
-                        + 'Please enter in "HH:MM-HH:MM" format or "None": '
-                    )
-                    if user_input.strip().lower() == "none":
-                        continue
-
-                    start_time, end_time = user_input.strip().split("-")
-
-                # TODO: maybe account for adding preference levels during this stage?
-                # for now just do manually
-                add_consultant_hours_to_df(
-                    availability_df,
-                    email,
-                    day_index,
-                    start_time,
-                    end_time,
-                    PREF_NEUTRAL,
-                )
-
-    return availability_df
+        try:
+            start_time, end_time = correction.strip().split("-")
+            availability.set_interval(
+                failure.email,
+                DAY_COLUMNS[failure.day],
+                start_time.strip(),
+                end_time.strip(),
+                PREF_NEUTRAL,
+            )
+        except ValueError:
+            # malformed correction - leave it in the queue
+            remaining.append(failure)
+
+    return remaining
+
+
+def parse_availability(csv_file: str) -> pd.DataFrame:
+    """
+    Parses consultant availability from a CSV file and returns a DataFrame.
+    """
+    return ingest_responses(csv_file).availability.to_df()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import logging
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from pulp import value  # type: ignore
+from pulp.constants import LpStatusInfeasible, LpStatusOptimal  # type: ignore
+
+from lp import (
+    ScheduleModel,
+    _as_matrix,
+    _daily_max_blocks,
+    _day_starts,
+    _weekly_bounds,
+)
+from presolve import fix_outside
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix
+from solvers import DEFAULT_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# cost of each block that differs from the previous schedule. Above what moving a block can save
+# (the worst preference cost plus two shift changes), so blocks only move when they have to
+CHANGE_PENALTY = 50
+
+# slots on either side of a changed slot that are re-solved with it (4 blocks = 2 hours)
+NEIGHBORHOOD_RADIUS = 4
+
+
+class RepairResult(NamedTuple):
+    """
+    Output of repair_schedule()
+    """
+
+    status: int  # PuLP status of the last (widest) neighborhood tried
+    x: dict  # same as from create_schedule()
+    moved_shifts: int  # previous shifts that aren't in the new schedule as they were
+    changed_blocks: int  # blocks assigned in only one of the previous and new schedules
+    objective: Optional[float]  # without the change penalty, comparable to a full solve
+    free_variables: int  # blocks re-solved in the last neighborhood tried
+
+
+def _assigned_mask(availability: AvailabilityMatrix, x: dict) -> np.ndarray:
+    """
+    Converts an x dict from create_schedule() back to a (consultants x slots) mask
+    """
+    slot_index = {t: j for j, t in enumerate(availability.time_index())}
+    assigned = np.zeros(availability.values.shape, dtype=bool)
+    for (consultant, time), var in x.items():
+        if (value(var) or 0) > 0.5:
+            assigned[availability.consultant_index(consultant), slot_index[time]] = True
+    return assigned
+
+
+def shifts(assigned: np.ndarray, day_starts: np.ndarray) -> set[tuple[int, int, int]]:
+    """
+    Each consultant's shifts (runs of consecutive blocks within a day) as (consultant, first
+    slot, number of blocks)
+    """
+    new_day = np.zeros(assigned.shape[1], dtype=bool)
+    new_day[day_starts] = True
+
+    # a run starts where the previous slot is unassigned or on another day, and likewise ends
+    before = np.zeros_like(assigned)
+    before[:, 1:] = assigned[:, :-1]
+    after = np.zeros_like(assigned)
+    after[:, :-1] = assigned[:, 1:]
+    ends_day = np.roll(new_day, -1)
+
+    # nonzero() goes row by row, so the i-th start and i-th end belong to the same run
+    start_c, start_t = np.nonzero(assigned & (~before | new_day[None, :]))
+    _, end_t = np.nonzero(assigned & (~after | ends_day[None, :]))
+    lengths = end_t - start_t + 1
+    return set(zip(start_c.tolist(), start_t.tolist(), lengths.tolist()))
+
+
+def neighborhood(
+    changed: np.ndarray,
+    assigned: np.ndarray,
+    available: np.ndarray,
+    day_starts: np.ndarray,
+    radius: int = NEIGHBORHOOD_RADIUS,
+    same_day: bool = False,
+    consultants: bool = True,
+) -> np.ndarray:
+    """
+    Slots to re-solve around a change in availability
+
+    changed: (consultants x slots) mask of blocks whose availability changed
+    assigned: (consultants x slots) mask of the previous schedule
+    available: (consultants x slots) mask of the new availability
+    radius: also re-solve this many slots on either side of each changed slot
+    same_day: re-solve the whole day of each changed slot
+    consultants: re-solve every slot the consultants involved were assigned to or are now
+        available for, so they can pick up or give away hours elsewhere in the week
+
+    Returns a (slots,) mask
+    """
+    num_slots = changed.shape[1]
+    slots = changed.any(axis=0)
+
+    # a slot is within radius of a changed one if there's one in the window around it
+    counts = np.concatenate([[0], np.cumsum(slots)])
+    positions = np.arange(num_slots)
+    lo = np.clip(positions - radius, 0, num_slots)
+    hi = np.clip(positions + radius + 1, 0, num_slots)
+    nearby = counts[hi] > counts[lo]
+
+    if same_day:
+        day_of_slot = np.repeat(
+            np.arange(len(day_starts)), np.diff(day_starts, append=num_slots)
+        )
+        changed_days = np.unique(day_of_slot[slots])
+        nearby |= np.isin(day_of_slot, changed_days)
+
+    if consultants:
+        involved = changed.any(axis=1)
+        nearby |= (assigned[involved] | available[involved]).any(axis=0)
+
+    return nearby
+
+
+def _penalize_changes(model: ScheduleModel, previous: np.ndarray, penalty: float):
+    """
+    Adds penalty to the objective for every free block that differs from the previous schedule
+    """
+    var_c, var_t = model.idx["var_c"], model.idx["var_t"]
+    was_assigned = previous[var_c, var_t].tolist()
+    for var, assigned in zip(model.x_vars, was_assigned):
+        if assigned:
+            # penalty * (1 - x)
+            model.prob.objective[var] -= penalty
+            model.prob.objective.constant += penalty
+        else:
+            model.prob.objective[var] += penalty
+
+
+def repair_schedule(
+    previous_df: pd.DataFrame | AvailabilityMatrix,
+    df: pd.DataFrame | AvailabilityMatrix,
+    x: dict,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    radius: int = NEIGHBORHOOD_RADIUS,
+    same_day: bool = False,
+    consultants: bool = True,
+    change_penalty: float = CHANGE_PENALTY,
+    backend: str = DEFAULT_BACKEND,
+    **solver_options,
+) -> RepairResult:
+    """
+    Re-solves a schedule after some availability changed (e.g. a consultant leaving, marked
+    unavailable everywhere), keeping the previous schedule fixed outside a neighborhood of the
+    change (see neighborhood()) and changing as few blocks as possible inside it.
+
+    If the neighborhood can't be made feasible it's widened (doubling the radius) until it covers
+    the whole week.
+
+    previous_df, df: availability the previous schedule was made for and the new availability,
+        with the same consultants and time slots
+    x: the previous schedule, as returned by create_schedule()
+    change_penalty: objective cost of each block that differs from the previous schedule
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+    """
+    previous_availability = _as_matrix(previous_df)
+    availability = _as_matrix(df)
+    if previous_availability.values.shape != availability.values.shape:
+        raise ValueError(
+            "previous and new availability must have the same consultants and time slots"
+        )
+
+    day_starts = _day_starts(availability)
+    weekly_min, weekly_max = _weekly_bounds(
+        availability.consultants, feasible_blocks, availability.block_minutes
+    )
+    available = availability.values != PREF_UNAVAILABLE
+    previous = _assigned_mask(availability, x)
+    changed = previous_availability.values != availability.values
+
+    while True:
+        nearby = neighborhood(
+            changed, previous, available, day_starts, radius, same_day, consultants
+        )
+        if radius >= availability.num_blocks:
+            nearby[:] = True
+        reduced = fix_outside(
+            available,
+            nearby,
+            previous,
+            day_starts,
+            weekly_min,
+            weekly_max,
+            _daily_max_blocks(availability.block_minutes),
+        )
+        model = ScheduleModel(availability, feasible_blocks, reduced=reduced)
+        _penalize_changes(model, previous, change_penalty)
+        model.set_start(previous & available)
+
+        status, solve_time = model.solve(backend, **solver_options)
+        logger.info(
+            f"Repaired {int(nearby.sum())} slots ({len(model.x_vars)} free blocks) with "
+            + f"{backend} in {solve_time:.3f}s"
+        )
+        if status != LpStatusInfeasible or nearby.all():
+            break
+        radius = 2 * radius + 1
+
+    if status != LpStatusOptimal:
+        return RepairResult(status, model.x, 0, 0, None, len(model.x_vars))
+
+    assigned = model.assigned_blocks()
+    differs = assigned != previous
+    changed_blocks = int(differs.sum())
+    moved_shifts = len(shifts(previous, day_starts) - shifts(assigned, day_starts))
+
+    # only free blocks were penalized (previous blocks that became unavailable weren't)
+    penalized = int(differs[model.idx["var_c"], model.idx["var_t"]].sum())
+    objective = value(model.prob.objective) - change_penalty * penalized
+
+    logger.info(f"Repair moved {moved_shifts} shifts ({changed_blocks} blocks changed)")
+    return RepairResult(
+        status, model.x, moved_shifts, changed_blocks, objective, len(model.x_vars)
+    )
@@ -0,0 +1,151 @@
+import logging
+import sys
+from typing import NamedTuple, Optional
+
+import pandas as pd
+from pulp import value  # type: ignore
+from pulp.constants import LpStatus, LpStatusInfeasible, LpStatusOptimal  # type: ignore
+
+from feasibility import _names, log_violations
+from lp import ScheduleModel, _as_matrix, precheck
+from read_csv import DAY_COLUMNS, allocate_feasible_blocks, ingest_responses
+from sched_setup import AvailabilityMatrix
+from solvers import DEFAULT_BACKEND
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# how many slots and consultants print_scarcity() lists by default
+TOP = 10
+
+
+class ScarcityResult(NamedTuple):
+    """
+    Marginal costs from the LP relaxation of the scheduling model: each price is the rate at
+    which the relaxation's cost changes per block of the constraint's bound. They're estimates
+    for ranking what-ifs, not exact re-solves - the relaxation usually has many optimal prices,
+    so a change can save less than its price suggests. The price fields are None if the
+    relaxation wasn't solved to optimality
+    """
+
+    status: int  # PuLP status of the relaxation (see pulp.constants.LpStatus)
+    bound: Optional[float]  # relaxation cost, a lower bound on the schedule's cost
+    # cover dual per time slot: the cost of the last block of coverage there. High where few
+    # or expensive consultants are available, negative where coverage is spare
+    slot_prices: Optional[pd.Series]
+    heatmap: Optional[pd.DataFrame]  # slot_prices as time of day x weekday
+    # weekly_min and weekly_max duals per consultant: the cost of one more required block, and
+    # of one more allowed block (negative if letting them work more would save cost)
+    consultant_prices: Optional[pd.DataFrame]
+    solve_time: float
+
+
+def scarcity_heatmap(
+    slot_prices: pd.Series, availability: AvailabilityMatrix
+) -> pd.DataFrame:
+    """
+    Arranges per-slot prices (one per block of availability) as a (time of day x weekday) table,
+    NaN where the lab is closed. Hours after midnight go under the day the lab opened, below that
+    day's evening
+    """
+    days = availability.opening_days()
+    # minutes since midnight of the opening day, so the early hours sort after the evening
+    minutes = availability.block_starts - days * 24 * 60
+    heatmap = pd.Series(slot_prices.to_numpy(), index=[minutes, days]).unstack()
+
+    heatmap.index = [f"{m // 60 % 24:02d}:{m % 60:02d}" for m in heatmap.index]
+    heatmap.columns = [list(DAY_COLUMNS)[day] for day in heatmap.columns]
+    return heatmap
+
+
+def scarcity_analysis(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    backend: str = DEFAULT_BACKEND,
+    check_feasible: bool = True,
+    **solver_options,
+) -> ScarcityResult:
+    """
+    Solves the LP relaxation of the create_schedule() model once and prices its constraints: how
+    scarce coverage is in each slot and what each consultant's weekly bounds cost. Much cheaper
+    than re-solving the integer model for each what-if (recruiting for a slot, granting a request
+    for more or fewer hours).
+
+    The model isn't presolved, so every slot and consultant has its rows (and a price)
+
+    check_feasible: run precheck() first and skip the solve (returning an infeasible status) if
+        any of its conditions are violated
+    solver_options: threads, time_limit and msg, passed through to solvers.solve()
+    """
+    availability = _as_matrix(df)
+
+    if check_feasible:
+        with span("precheck") as precheck_span:
+            violations = precheck(availability, feasible_blocks)
+            precheck_span.set(violations=len(violations))
+        if violations:
+            log_violations(violations)
+            return ScarcityResult(LpStatusInfeasible, None, None, None, None, 0.0)
+
+    with span("build") as build_span:
+        model = ScheduleModel(availability, feasible_blocks, relax=True)
+        build_span.set(**model.stats)
+
+    with span("solve"):
+        status, solve_time = model.solve(backend, **{"msg": False, **solver_options})
+    logger.info(
+        f"Relaxation solved with {backend} in {solve_time:.3f}s: {LpStatus[status]}"
+    )
+    if status != LpStatusOptimal:
+        return ScarcityResult(status, None, None, None, None, solve_time)
+
+    cover, weekly_min, weekly_max, _ = model.duals()
+    slot_prices = pd.Series(cover, index=model.time_slots, name="price")
+
+    consultant_prices = pd.DataFrame(
+        {"weekly_min": weekly_min, "weekly_max": weekly_max},
+        index=pd.Index(model.consultants, name="consultant"),
+    )
+
+    return ScarcityResult(
+        status,
+        value(model.prob.objective),
+        slot_prices,
+        scarcity_heatmap(slot_prices, model.matrix),
+        consultant_prices,
+        solve_time,
+    )
+
+
+def print_scarcity(result: ScarcityResult, top: int = TOP):
+    """
+    Prints the scarcest slots and the consultants whose weekly bounds cost the most
+    """
+    if result.slot_prices is None:
+        print(f"No prices: relaxation status {LpStatus[result.status]}")
+        return
+
+    print(f"Relaxation bound: {result.bound:.1f} (solved in {result.solve_time:.3f}s)")
+
+    print("\nScarcest slots (cost of covering one more block):")
+    for time, price in result.slot_prices.nlargest(top).items():
+        print(f" {_names([time])}  {price:7.2f}")
+
+    print("\nConsultants whose minimum hours cost the most (per block):")
+    weekly_min = result.consultant_prices["weekly_min"]
+    for consultant, price in weekly_min[weekly_min > 0].nlargest(top).items():
+        print(f" {consultant}  {price:7.2f}")
+
+    print("\nConsultants whose maximum hours bind the most (saving per extra block):")
+    weekly_max = result.consultant_prices["weekly_max"]
+    for consultant, price in weekly_max[weekly_max < 0].nsmallest(top).items():
+        print(f" {consultant}  {-price:7.2f}")
+
+
+if __name__ == "__main__":
+    # TODO: use fire
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    responses = ingest_responses(sys.argv[1], False)
+    feasible_blocks = allocate_feasible_blocks(responses.requested_hours)
+    print_scarcity(scarcity_analysis(responses.availability, feasible_blocks))
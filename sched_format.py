@@ -1,13 +1,49 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import IO, Iterator
+
+import numpy as np
 import pandas as pd
-from pulp import value  # type: ignore
+
+from sched_setup import BLOCK_MINUTES
 
 # name of column that gets added to consultant availability df
 CONSULTANT_COLNAME = "consultant"
 
+# columns of the exported shifts, in order
+EXPORT_COLUMNS = [CONSULTANT_COLNAME, "start", "end"]
+
+# iCalendar date-time format (local "floating" time, same as the schedule's timestamps)
+ICS_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def _solution_values(values) -> np.ndarray:
+    """
+    Solution values of a sequence of variables (or plain numbers) as a float array
+    """
+    return np.fromiter(
+        (getattr(v, "varValue", v) or 0 for v in values), dtype=float, count=len(values)
+    )
+
+
+@contextmanager
+def _open_output(output: str | IO) -> Iterator[IO]:
+    """
+    Opens output for writing if it's a path, or passes an open file (e.g. sys.stdout) through
+    """
+    if isinstance(output, str):
+        with open(output, "w", newline="") as f:
+            yield f
+    else:
+        yield output
+
 
 class ScheduleFormatter:
     """
-    Takes raw schedule output from create_schedule() and prints formatted output
+    Takes raw schedule output from create_schedule() and prints or exports formatted output
     """
 
     def __init__(
@@ -24,6 +60,12 @@ class ScheduleFormatter:
         self.assignments = assignments
         self.df_orig = consultant_availability.copy()
 
+        # block length is the smallest gap between time slots
+        gaps = self.df_orig.index.to_series().diff().dropna()
+        self.block_length = (
+            gaps.min() if len(gaps) else pd.Timedelta(minutes=BLOCK_MINUTES)
+        )
+
         # transformation pipeline. after completion, self.shifts is a df containing the consolidated
         # shifts for all consultants
         self.df_shifts = self.df_orig.copy()
@@ -41,62 +83,63 @@ class ScheduleFormatter:
         Sets self.df_shifts to the resulting DataFrame with new 'consultant' column containing
         active consultant names
         """
-        self.df_shifts[CONSULTANT_COLNAME] = None
+        keys = list(self.assignments)
+        assigned = _solution_values(list(self.assignments.values())) > 0.5
+
+        # at most one consultant per time slot, so the assigned keys index a series by time
+        consultants = [consultant for (consultant, _), a in zip(keys, assigned) if a]
+        times = [time for (_, time), a in zip(keys, assigned) if a]
+        by_time = pd.Series(consultants, index=pd.DatetimeIndex(times), dtype=object)
 
-        # Fill in assignments
-        for consultant, time in self.assignments:
-            if value(self.assignments[consultant, time]) == 1:
-                self.df_shifts.loc[time, CONSULTANT_COLNAME] = consultant
+        self.df_shifts[CONSULTANT_COLNAME] = by_time.reindex(self.df_shifts.index)
 
     def _consolidate_shifts(self):
         """
-        Consolidates consecutive 30-minute blocks into single shifts.
+        Consolidates consecutive blocks into single shifts.
 
         df: DataFrame with datetime index and consultant column
         """
-        df = self.df_shifts.copy()
-
-        # Mark where consultant changes or there's a time gap
-        df["new_shift"] = (
-            # Consultant changed
-            (df[CONSULTANT_COLNAME] != df[CONSULTANT_COLNAME].shift())
-            |
-            # Time gap (more than 30 min)
-            (df.index.to_series().diff() > pd.Timedelta(minutes=30))
+        consultants = self.df_shifts[CONSULTANT_COLNAME].to_numpy()
+        times = self.df_shifts.index
+
+        # run-length pass: a shift starts where the consultant changes or there's a time gap
+        # (more than one block)
+        new_shift = np.ones(len(times), dtype=bool)
+        new_shift[1:] = (consultants[1:] != consultants[:-1]) | (
+            np.diff(times.to_numpy()) > self.block_length.to_timedelta64()
         )
 
-        # Create group numbers for each shift
-        df["shift_group"] = df["new_shift"].cumsum()
-
-        # group by shift and aggregate
-        shifts = df.groupby("shift_group")[CONSULTANT_COLNAME].first().to_frame()
-
-        # add start and end times from the index
-        shifts["start"] = df.groupby("shift_group").apply(lambda x: x.index[0])  # type: ignore
-        shifts["end"] = df.groupby("shift_group").apply(lambda x: x.index[-1])  # type: ignore
-
-        # add 30 minutes to end time (since each block represents the start time)
-        shifts["end"] = shifts["end"] + pd.Timedelta(minutes=30)
+        df = pd.DataFrame(
+            {CONSULTANT_COLNAME: consultants, "time": times},
+            index=pd.Index(np.cumsum(new_shift), name="shift_group"),
+        )
+        shifts = df.groupby(level=0).agg(
+            **{
+                CONSULTANT_COLNAME: (CONSULTANT_COLNAME, "first"),
+                "start": ("time", "first"),
+                "end": ("time", "last"),
+            }
+        )
 
-        # sort by start time
-        shifts = shifts.sort_values("start")
+        # add a block to end time (since each block represents the start time)
+        shifts["end"] = shifts["end"] + self.block_length
 
-        # set back to class df field
-        self.df_shifts = shifts
+        # set back to class df field, sorted by start time
+        self.df_shifts = shifts.sort_values("start")
 
     def print_schedule_by_day(self):
         """Print schedule grouped by day"""
         current_day = None
 
-        for _, row in self.df_shifts.iterrows():
-            day = f"{row['start']:%A}"
+        for consultant, start, end in self.df_shifts[EXPORT_COLUMNS].itertuples(
+            index=False, name=None
+        ):
+            day = f"{start:%A}"
             if day != current_day:
                 print(f"\n{day}:")
                 current_day = day
 
-            start_time = f"{row['start']:%H:%M}"
-            end_time = f"{row['end']:%H:%M}"
-            print(f"{start_time}-{end_time} {row[CONSULTANT_COLNAME]}")
+            print(f"{start:%H:%M}-{end:%H:%M} {consultant}")
 
     def print_schedule_by_consultant(self):
         """Print schedule grouped by consultant"""
@@ -116,8 +159,64 @@ class ScheduleFormatter:
             print(f"\n*{consultant}:*")
 
             # Sort shifts by start time
-            for _, shift in consultant_shifts.sort_values("start").iterrows():
-                day = f"{shift['start']:%a}"
-                start_time = format_time(shift["start"])
-                end_time = format_time(shift["end"])
-                print(f"{day} {start_time}-{end_time}")
+            shifts = consultant_shifts.sort_values("start")
+            for start, end in zip(shifts["start"], shifts["end"]):
+                print(f"{start:%a} {format_time(start)}-{format_time(end)}")
+
+    def _export_rows(self) -> Iterator[tuple[str, pd.Timestamp, pd.Timestamp]]:
+        """
+        (consultant, start, end) of every assigned shift, sorted by start time
+        """
+        shifts = self.df_shifts[self.df_shifts[CONSULTANT_COLNAME].notna()]
+        return shifts[EXPORT_COLUMNS].itertuples(index=False, name=None)
+
+    def export_csv(self, output: str | IO = sys.stdout):
+        """
+        Writes one consultant,start,end row per shift (ISO 8601 times) to a path or open file
+        """
+        with _open_output(output) as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for consultant, start, end in self._export_rows():
+                writer.writerow([consultant, start.isoformat(), end.isoformat()])
+
+    def export_json(self, output: str | IO = sys.stdout):
+        """
+        Writes a JSON array of {"consultant", "start", "end"} shifts (ISO 8601 times) to a path
+        or open file, one shift at a time
+        """
+        with _open_output(output) as f:
+            f.write("[")
+            for i, (consultant, start, end) in enumerate(self._export_rows()):
+                shift = {
+                    CONSULTANT_COLNAME: consultant,
+                    "start": start.isoformat(),
+                    "end": end.isoformat(),
+                }
+                f.write(("\n  " if i == 0 else ",\n  ") + json.dumps(shift))
+            f.write("\n]\n")
+
+    def export_ics(
+        self, output: str | IO = sys.stdout, calendar_name: str = "Sunlab schedule"
+    ):
+        """
+        Writes an iCalendar (.ics) file with one event per shift to a path or open file
+        """
+        stamp = f"{datetime.now(timezone.utc):{ICS_TIME_FORMAT}}Z"
+
+        with _open_output(output) as f:
+            f.write(
+                "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//sunlab-scheduler//EN\r\n"
+                + f"X-WR-CALNAME:{calendar_name}\r\n"
+            )
+            for consultant, start, end in self._export_rows():
+                f.write(
+                    "BEGIN:VEVENT\r\n"
+                    + f"UID:{start:{ICS_TIME_FORMAT}}-{consultant}\r\n"
+                    + f"DTSTAMP:{stamp}\r\n"
+                    + f"DTSTART:{start:{ICS_TIME_FORMAT}}\r\n"
+                    + f"DTEND:{end:{ICS_TIME_FORMAT}}\r\n"
+                    + f"SUMMARY:{consultant}\r\n"
+                    + "END:VEVENT\r\n"
+                )
+            f.write("END:VCALENDAR\r\n")
@@ -1,5 +1,7 @@
 from datetime import date, datetime, timedelta
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 
 SUNLAB_HOURS = {
@@ -20,6 +22,9 @@ PREF_NOT_PREFERABLE = 1
 PREF_NEUTRAL = 2
 PREF_PREFERABLE = 3
 
+# default length of a schedule block. Other lengths should divide an hour (e.g. 15 or 60)
+BLOCK_MINUTES = 30
+
 
 def _get_date_for_day_of_current_week(day_of_week: int) -> date:
     """
@@ -59,43 +64,301 @@ def _get_range_start_end_datetimes(
     return start_datetime, end_datetime
 
 
-def _generate_time_blocks(hours: dict[int, tuple[str, str]]) -> list[datetime]:
+def _time_str_to_minutes(time_str: str) -> int:
+    """
+    Converts a "HH:MM" string to minutes since midnight
+    """
+    hour, minute = time_str.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def hours_to_blocks(hours, block_minutes: int = BLOCK_MINUTES):
+    """
+    Converts hours (a number or array) to a number of blocks
+    """
+    return hours * 60 // block_minutes
+
+
+def blocks_to_hours(blocks, block_minutes: int = BLOCK_MINUTES):
+    """
+    Converts a number of blocks (a number or array) to hours
+    """
+    return blocks * block_minutes / 60
+
+
+def week_relative_minutes(time_slots: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Converts time slots to minutes since midnight on the Monday of the first slot's week.
+
+    Time slots are anchored to the current week (see _get_date_for_day_of_current_week), so the
+    same lab hours give different timestamps each week - this gives a date-independent block axis.
     """
-    Generates a list of datetimes in half-hour increments for each day of the week according to that
-    day's lab opening hours.
+    first = time_slots[0]
+    monday = first.normalize() - pd.Timedelta(days=first.weekday())
+    return np.asarray((time_slots - monday) // pd.Timedelta(minutes=1), dtype=np.int64)
+
+
+class AvailabilityMatrix:
     """
-    # make list iteratively by day
-    time_blocks = []
+    Compact consultant availability: an int8 (consultants x blocks) array of preference levels on
+    a week-relative integer block axis (minutes since Monday 00:00 of each block's start). Blocks
+    are block_minutes long (half an hour by default).
+
+    Converts to/from the datetime-indexed availability df only at the edges of the pipeline.
+    """
+
+    def __init__(
+        self,
+        consultants: list[str],
+        block_starts: np.ndarray,
+        values: Optional[np.ndarray] = None,
+        week_start: Optional[pd.Timestamp] = None,
+        block_minutes: Optional[int] = None,
+    ):
+        """
+        consultants: consultant names, one per row of values
+        block_starts: sorted start of each block, in minutes since Monday 00:00
+        values: (consultants x blocks) preference levels (all PREF_UNAVAILABLE if not given)
+        week_start: Monday the block axis is anchored to when converting to datetimes (defaults
+            to this week's Monday)
+        block_minutes: length of each block (defaults to the smallest gap between block starts,
+            or BLOCK_MINUTES if there's only one block)
+        """
+        self.consultants = list(consultants)
+        self.block_starts = np.asarray(block_starts, dtype=np.int64)
+
+        if block_minutes is None:
+            gaps = np.diff(self.block_starts)
+            block_minutes = int(gaps.min()) if len(gaps) else BLOCK_MINUTES
+        self.block_minutes = block_minutes
+
+        if values is None:
+            values = np.full(
+                (len(self.consultants), len(self.block_starts)),
+                PREF_UNAVAILABLE,
+                dtype=np.int8,
+            )
+        self.values = np.asarray(values, dtype=np.int8)
+
+        if week_start is None:
+            week_start = pd.Timestamp(_get_date_for_day_of_current_week(0))
+        self.week_start = week_start
+
+        self._consultant_index = {c: i for i, c in enumerate(self.consultants)}
+
+    @classmethod
+    def from_hours(
+        cls,
+        hours: dict[int, tuple[str, str]],
+        consultants: list[str],
+        block_minutes: int = BLOCK_MINUTES,
+    ) -> "AvailabilityMatrix":
+        """
+        Empty (all unavailable) matrix with a block axis built from the lab's hours
+        """
+        block_starts = []
+
+        for day_of_week, (open_time_str, close_time_str) in hours.items():
+            open_minutes = day_of_week * 24 * 60 + _time_str_to_minutes(open_time_str)
+            close_minutes = day_of_week * 24 * 60 + _time_str_to_minutes(close_time_str)
+
+            if close_minutes < open_minutes:
+                # lab closes at midnight - make sure it registers as the next day
+                close_minutes += 24 * 60
+
+            num_blocks = (close_minutes - open_minutes) // block_minutes
+            block_starts.append(open_minutes + block_minutes * np.arange(num_blocks))
 
-    for day_of_week, (open_time_str, close_time_str) in hours.items():
-        # parse lab opening, closing times into datetimes for the current week
-        open_datetime, close_datetime = _get_range_start_end_datetimes(
-            day_of_week, open_time_str, close_time_str
+        return cls(
+            consultants, np.concatenate(block_starts), block_minutes=block_minutes
         )
 
-        # get all half-hour blocks between open and close datetimes
-        seconds_diff = (close_datetime - open_datetime).total_seconds()
-        minutes_diff = seconds_diff / 60
-        num_blocks = int(minutes_diff / 30)  # integer division should be ok here
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "AvailabilityMatrix":
+        """
+        Converts a datetime-indexed availability df (time slots x consultants)
+        """
+        first = df.index[0]
+        return cls(
+            list(df.columns),
+            week_relative_minutes(df.index),
+            df.to_numpy(dtype=np.int8).T,
+            first.normalize() - pd.Timedelta(days=first.weekday()),
+        )
+
+    def time_index(self) -> pd.DatetimeIndex:
+        """
+        Datetime of each block in the week starting at self.week_start
+        """
+        return self.week_start + pd.to_timedelta(self.block_starts, unit="min")
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Converts to a datetime-indexed availability df (time slots x consultants)
+        """
+        return pd.DataFrame(
+            self.values.T, index=self.time_index(), columns=self.consultants
+        )
+
+    def assignments(self, assigned: np.ndarray) -> dict:
+        """
+        Converts a (consultants x blocks) mask of assigned blocks to the x dict returned by
+        create_schedule(): every available (consultant, time) pair maps to 1 if assigned or 0
+        otherwise
+        """
+        # plain lists, since indexing a DatetimeIndex one element at a time is slow
+        time_slots = list(self.time_index())
+        var_c, var_t = np.nonzero(self.values != PREF_UNAVAILABLE)
+        return {
+            (self.consultants[c], time_slots[t]): value
+            for c, t, value in zip(
+                var_c.tolist(),
+                var_t.tolist(),
+                assigned[var_c, var_t].astype(int).tolist(),
+            )
+        }
+
+    def copy(self) -> "AvailabilityMatrix":
+        return AvailabilityMatrix(
+            self.consultants,
+            self.block_starts,
+            self.values.copy(),
+            self.week_start,
+            self.block_minutes,
+        )
 
-        time_blocks += [
-            open_datetime + timedelta(minutes=30 * n) for n in range(num_blocks)
-        ]
+    def resample(self, block_minutes: int) -> "AvailabilityMatrix":
+        """
+        The same availability with blocks of another length (a multiple or divisor of the current
+        one). A coarser block gets the lowest preference level of the blocks it covers, so it's
+        only available if all of them are. Finer blocks get the level of the block they split.
+        """
+        if block_minutes >= self.block_minutes:
+            coarse_starts = self.block_starts // block_minutes * block_minutes
+            block_starts, first = np.unique(coarse_starts, return_index=True)
+            values = np.minimum.reduceat(self.values, first, axis=1)
+        else:
+            offsets = block_minutes * np.arange(self.block_minutes // block_minutes)
+            block_starts = (self.block_starts[:, None] + offsets[None, :]).ravel()
+            values = np.repeat(self.values, len(offsets), axis=1)
 
-    return time_blocks
+        return AvailabilityMatrix(
+            self.consultants, block_starts, values, self.week_start, block_minutes
+        )
+
+    def block_index(self, block_starts: np.ndarray) -> np.ndarray:
+        """
+        Index of the block containing each of the given times (in week-relative minutes), e.g.
+        to map the blocks of a finer resample() onto this matrix
+        """
+        return np.searchsorted(self.block_starts, block_starts, side="right") - 1
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.block_starts)
+
+    def block_days(self) -> np.ndarray:
+        """
+        Day of each block, counted from Monday (blocks after midnight count as the next day)
+        """
+        return self.block_starts // (24 * 60)
+
+    def opening_days(self) -> np.ndarray:
+        """
+        Day each block's opening started on, counted from Monday: the same as block_days(), except
+        that blocks after midnight of an opening that started the day before (e.g. 00:00-02:00 of
+        a lab open 12:00-02:00) count as that day
+        """
+        days = self.block_days()
+
+        # each run of consecutive blocks is one opening
+        new_run = np.diff(self.block_starts, prepend=-1) != self.block_minutes
+        run_start = self.block_starts[np.flatnonzero(new_run)][np.cumsum(new_run) - 1]
+
+        carried = (days == run_start // (24 * 60) + 1) & (
+            self.block_starts % (24 * 60) < run_start % (24 * 60)
+        )
+        return np.where(carried, days - 1, days)
+
+    def consultant_index(self, consultant: str) -> int:
+        return self._consultant_index[consultant]
+
+    def block_range(
+        self, day_of_week: int, start_time: str, end_time: str
+    ) -> tuple[int, int]:
+        """
+        Converts a time interval on a given day of the week to a [start, end) range of block
+        indices. The end time is exclusive, so ("09:00", "10:00") covers the 9am and 9:30am blocks.
+        """
+        start_minutes = day_of_week * 24 * 60 + _time_str_to_minutes(start_time)
+        end_minutes = day_of_week * 24 * 60 + _time_str_to_minutes(end_time)
+
+        start, end = self.block_ranges(
+            np.array([start_minutes]), np.array([end_minutes])
+        )
+        return int(start[0]), int(end[0])
+
+    def block_ranges(
+        self, start_minutes: np.ndarray, end_minutes: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized block_range(): converts arrays of interval start/end times (in week-relative
+        minutes) to arrays of [start, end) block indices. Intervals whose end is before their
+        start wrap past midnight.
+        """
+        end_minutes = np.where(
+            end_minutes < start_minutes, end_minutes + 24 * 60, end_minutes
+        )
+        return (
+            np.searchsorted(self.block_starts, start_minutes),
+            np.searchsorted(self.block_starts, end_minutes),
+        )
+
+    def set_interval(
+        self,
+        consultant: str,
+        day_of_week: int,
+        start_time: str,
+        end_time: str,
+        pref_level: int,
+    ):
+        """
+        Sets the consultant's preference level between the start and end times on the given day
+        of the week (same semantics as add_consultant_hours_to_df)
+        """
+        start, end = self.block_range(day_of_week, start_time, end_time)
+        self.values[self._consultant_index[consultant], start:end] = pref_level
+
+    def set_blocks(
+        self,
+        consultant_indices: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        pref_level: int,
+    ):
+        """
+        Sets pref_level on a batch of [start, end) block ranges in one pass, where range i belongs
+        to the consultant at row consultant_indices[i]
+        """
+        # mark range starts/ends in a difference array; its running sum is > 0 inside any range
+        coverage = np.zeros(
+            (len(self.consultants), self.num_blocks + 1), dtype=np.int32
+        )
+        np.add.at(coverage, (consultant_indices, starts), 1)
+        np.add.at(coverage, (consultant_indices, ends), -1)
+
+        self.values[np.cumsum(coverage, axis=1)[:, :-1] > 0] = pref_level
 
 
 def setup_consultant_availability_df(
-    hours: dict[int, tuple[str, str]], consultants: list[str]
+    hours: dict[int, tuple[str, str]],
+    consultants: list[str],
+    block_minutes: int = BLOCK_MINUTES,
 ) -> pd.DataFrame:
     """
     Sets up the consultant availability df using the lab's opening hours and a list of consultants.
     """
-    time_blocks = _generate_time_blocks(hours)
-    df = pd.DataFrame(index=time_blocks, columns=consultants)
-
-    df_filled = df.fillna(PREF_UNAVAILABLE)  # use -1 (not available) as default value
-    return df_filled
+    return AvailabilityMatrix.from_hours(hours, consultants, block_minutes).to_df()
 
 
 def add_consultant_hours_to_df(
@@ -0,0 +1,445 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from pulp.constants import LpStatus, LpStatusOptimal  # type: ignore
+
+from cache import SolveCache
+from lp import create_schedule
+from read_csv import allocate_feasible_blocks, ingest_responses
+from sched_format import ScheduleFormatter
+from sched_setup import BLOCK_MINUTES, blocks_to_hours
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# submissions waiting for a worker beyond this are turned away (503) rather than queued
+MAX_QUEUED_JOBS = 32
+# finished jobs kept for status and result requests (oldest are forgotten first)
+MAX_FINISHED_JOBS = 256
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# formats a finished schedule can be downloaded in, with their content types
+SCHEDULE_FORMATS = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "ics": "text/calendar",
+}
+
+# workers are started from a clean process rather than forked, so they don't inherit the server's
+# sockets (a forked worker would hold a client's connection open until its solve finished)
+_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+def solve_upload(
+    csv_text: str,
+    block_minutes: int = BLOCK_MINUTES,
+    time_limit: Optional[float] = None,
+) -> dict:
+    """
+    Runs the pipeline headlessly on the text of a responses CSV (unparseable time ranges are
+    skipped). Returns the solve status, roster size, parse failures and, if a schedule was found,
+    the schedule in each of SCHEDULE_FORMATS
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "responses.csv")
+        with open(csv_file, "w") as f:
+            f.write(csv_text)
+        responses = ingest_responses(csv_file, False, block_minutes=block_minutes)
+
+    availability = responses.availability
+    feasible_blocks = allocate_feasible_blocks(
+        responses.requested_hours,
+        blocks_to_hours(availability.num_blocks, block_minutes),
+        block_minutes=block_minutes,
+    )
+    status, x = create_schedule(
+        availability,
+        feasible_blocks,
+        cache=SolveCache(),
+        time_limit=time_limit,
+        msg=False,
+    )
+
+    schedules = {}
+    if status == LpStatusOptimal:
+        formatter = ScheduleFormatter(x, availability.to_df())
+        for schedule_format in SCHEDULE_FORMATS:
+            output = io.StringIO()
+            getattr(formatter, f"export_{schedule_format}")(output)
+            schedules[schedule_format] = output.getvalue()
+
+    return {
+        "status": LpStatus[status],
+        "consultants": len(availability.consultants),
+        "parse_failures": [failure._asdict() for failure in responses.failures],
+        "schedules": schedules,
+    }
+
+
+def _worker(conn: Connection, csv_text: str, block_minutes: int, time_limit):
+    # own process group, so cancelling the job also stops the solver subprocess it started
+    if hasattr(os, "setsid"):
+        os.setsid()
+
+    try:
+        conn.send((JOB_DONE, solve_upload(csv_text, block_minutes, time_limit)))
+    except Exception as e:
+        conn.send((JOB_FAILED, repr(e)))
+    finally:
+        conn.close()
+
+
+def _wait(process: multiprocessing.Process, conn: Connection) -> Optional[tuple]:
+    """
+    Waits for a worker's (status, result) and for it to exit. Returns None if it died without
+    sending one (killed by cancel(), or crashed)
+    """
+    try:
+        message = conn.recv()
+    except EOFError:
+        message = None
+    finally:
+        conn.close()
+    process.join()
+    return message
+
+
+class Job:
+    """
+    A submitted responses CSV and its progress through the queue
+    """
+
+    def __init__(self, key: str, csv_text: str, block_minutes: int, time_limit):
+        self.id = uuid.uuid4().hex
+        self.key = key  # identical submissions have the same key
+        self.csv_text = csv_text
+        self.block_minutes = block_minutes
+        self.time_limit = time_limit
+
+        self.status = JOB_QUEUED
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.process: Optional[multiprocessing.Process] = None
+        self.cancel_requested = False
+
+    def describe(self) -> dict:
+        description = {
+            "id": self.id,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+        if self.result is not None:
+            description.update(
+                solve_status=self.result["status"],
+                consultants=self.result["consultants"],
+                parse_failures=self.result["parse_failures"],
+                formats=list(self.result["schedules"]),
+            )
+        return description
+
+
+class SchedulingService:
+    """
+    Local HTTP service that queues uploaded responses CSVs and solves them in worker processes,
+    so solves never block the event loop:
+
+        POST /jobs?block_minutes=30&time_limit=60   body: responses CSV -> job status
+        GET /jobs/<id>                              job status
+        GET /jobs/<id>/schedule?format=csv          schedule as CSV, JSON or iCalendar
+        DELETE /jobs/<id>                           cancel a queued or running job
+
+    An identical submission (same CSV and settings) returns the existing job instead of solving
+    again, and solves themselves go through the on-disk SolveCache.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_queued: int = MAX_QUEUED_JOBS,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.jobs: dict[str, Job] = {}
+        self._job_by_key: dict[str, Job] = {}
+        self.max_queued = max_queued
+        self._queue: asyncio.Queue = asyncio.Queue(max_queued)
+
+    def submit(
+        self, csv_text: str, block_minutes: int = BLOCK_MINUTES, time_limit=None
+    ) -> tuple[Job, bool]:
+        """
+        Queues a responses CSV. Returns (job, whether it's new); raises asyncio.QueueFull if the
+        queue is full
+        """
+        settings = json.dumps([block_minutes, time_limit])
+        key = hashlib.sha256((settings + csv_text).encode()).hexdigest()
+
+        existing = self._job_by_key.get(key)
+        if existing is not None and existing.status not in (JOB_FAILED, JOB_CANCELLED):
+            return existing, False
+
+        job = Job(key, csv_text, block_minutes, time_limit)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self._job_by_key[key] = job
+        logger.info(f"Job {job.id} queued ({self._queue.qsize()} waiting)")
+        return job, True
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Cancels a queued or running job. Returns False if it had already finished
+        """
+        if job.status == JOB_QUEUED:
+            # left in the queue, and skipped when it comes up
+            self._finish(job, JOB_CANCELLED)
+        elif job.status == JOB_RUNNING:
+            job.cancel_requested = True
+            process = job.process
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except (AttributeError, ProcessLookupError):
+                # no process groups on this platform, or the worker hasn't called setsid() yet
+                process.terminate()
+            # the dispatcher sees the worker die and marks the job cancelled
+        else:
+            return False
+
+        logger.info(f"Job {job.id} cancelled")
+        return True
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.csv_text = ""  # no longer needed
+
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for old in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[old.id]
+            if self._job_by_key.get(old.key) is old:
+                del self._job_by_key[old.key]
+
+    async def _dispatch(self):
+        """
+        One worker slot: takes jobs off the queue and solves each in its own process
+        """
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context(_START_METHOD)
+        # waiting on a worker blocks a thread, so each slot gets its own
+        waiter = ThreadPoolExecutor(1)
+
+        while True:
+            job = await self._queue.get()
+            if job.status != JOB_QUEUED:
+                continue  # cancelled while waiting
+
+            receiver, sender = context.Pipe(duplex=False)
+            job.process = context.Process(
+                target=_worker,
+                args=(sender, job.csv_text, job.block_minutes, job.time_limit),
+            )
+            job.status = JOB_RUNNING
+            job.started = time.time()
+            job.process.start()
+            sender.close()
+
+            message = await loop.run_in_executor(waiter, _wait, job.process, receiver)
+            job.process = None
+
+            if job.cancel_requested:
+                # even if the worker finished before the cancellation reached it
+                status = JOB_CANCELLED
+            elif message is None:
+                status = JOB_FAILED
+                job.error = "worker process exited without a result"
+            else:
+                status, result = message
+                if status == JOB_DONE:
+                    job.result = result
+                else:
+                    job.error = result
+            self._finish(job, status)
+            logger.info(f"Job {job.id} {status} in {job.finished - job.started:.1f}s")
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        code: int,
+        body: dict | str,
+        content_type: str = "application/json",
+    ):
+        data = (json.dumps(body) if isinstance(body, dict) else body).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {code} {HTTP_REASONS[code]}\r\n"
+                + f"Content-Type: {content_type}\r\n"
+                + f"Content-Length: {len(data)}\r\n"
+                + "Connection: close\r\n\r\n"
+            ).encode()
+            + data
+        )
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def _route(
+        self, method: str, path: str, query: dict, body: bytes
+    ) -> tuple[int, dict | str, str]:
+        """
+        Returns (status code, response body, content type) for a request
+        """
+        parts = path.strip("/").split("/")
+        if parts[0] != "jobs" or len(parts) > 3:
+            return 404, {"error": f"no such endpoint {path}"}, "application/json"
+
+        if len(parts) == 1:
+            if method != "POST":
+                return 405, {"error": "submit with POST /jobs"}, "application/json"
+            try:
+                block_minutes = int(query.get("block_minutes", BLOCK_MINUTES))
+                time_limit = query.get("time_limit")
+                time_limit = None if time_limit is None else float(time_limit)
+                job, created = self.submit(body.decode(), block_minutes, time_limit)
+            except (ValueError, UnicodeDecodeError) as e:
+                return 400, {"error": str(e)}, "application/json"
+            except asyncio.QueueFull:
+                return 503, {"error": "too many jobs queued"}, "application/json"
+            return 202 if created else 200, job.describe(), "application/json"
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            return 404, {"error": f"no job {parts[1]}"}, "application/json"
+
+        if len(parts) == 3:
+            if parts[2] != "schedule" or method != "GET":
+                return 404, {"error": f"no such endpoint {path}"}, "application/json"
+            schedule_format = query.get("format", "csv")
+            if schedule_format not in SCHEDULE_FORMATS:
+                return (
+                    400,
+                    {"error": f"unknown format {schedule_format}"},
+                    "application/json",
+                )
+            if job.result is None or not job.result["schedules"]:
+                return (
+                    409,
+                    {**job.describe(), "error": "job has no schedule"},
+                    "application/json",
+                )
+            return (
+                200,
+                job.result["schedules"][schedule_format],
+                SCHEDULE_FORMATS[schedule_format],
+            )
+
+        if method == "GET":
+            return 200, job.describe(), "application/json"
+        if method == "DELETE":
+            if not self.cancel(job):
+                return (
+                    409,
+                    {**job.describe(), "error": "job already finished"},
+                    "application/json",
+                )
+            return 200, job.describe(), "application/json"
+        return 405, {"error": f"{method} not allowed"}, "application/json"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handles one HTTP/1.1 request per connection
+        """
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) != 3:
+                return await self._respond(writer, 400, {"error": "bad request line"})
+            method, target, _ = request_line
+
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, header_value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = header_value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_UPLOAD_BYTES:
+                return await self._respond(writer, 413, {"error": "upload too large"})
+            body = await reader.readexactly(length)
+
+            url = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            code, response, content_type = await self._route(
+                method, url.path, query, body
+            )
+            await self._respond(writer, code, response, content_type)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """
+        Serves until cancelled
+        """
+        dispatchers = [
+            asyncio.create_task(self._dispatch()) for _ in range(self.workers)
+        ]
+
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Serving on http://{host}:{port} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+            for job in self.jobs.values():
+                if job.status == JOB_RUNNING:
+                    self.cancel(job)
+
+
+def run_service(
+    host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: Optional[int] = None
+):
+    asyncio.run(SchedulingService(workers).serve(host, port))
+
+
+if __name__ == "__main__":
+    # TODO: use fire
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    run_service()
@@ -0,0 +1,391 @@
+import logging
+from time import perf_counter
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from pulp import (  # type: ignore
+    LpAffineExpression,
+    LpConstraint,
+    LpProblem,
+    LpVariable,
+)
+from pulp.constants import (  # type: ignore
+    LpBinary,
+    LpConstraintEQ,
+    LpConstraintGE,
+    LpConstraintLE,
+    LpContinuous,
+    LpMinimize,
+    LpStatusOptimal,
+)
+
+from lp import (
+    PREFERENCE_COSTS,
+    SHIFT_CHANGE_PENALTY,
+    _as_matrix,
+    _daily_max_blocks,
+    _day_starts,
+    _preference_cost_lookup,
+    _weekly_bounds,
+)
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix
+from solvers import DEFAULT_BACKEND, solve
+
+logger = logging.getLogger(__name__)
+
+# column generation stops after this many rounds even if columns with negative reduced cost remain
+MAX_PRICING_ROUNDS = 50
+# reduced costs above -PRICING_TOLERANCE are treated as non-negative
+PRICING_TOLERANCE = 1e-6
+
+
+class ShiftColumns(NamedTuple):
+    """
+    Candidate shifts: each one is a contiguous run of available blocks on one day for one
+    consultant. Arrays are indexed by shift.
+    """
+
+    consultant: np.ndarray
+    start: np.ndarray  # index of the first slot
+    length: np.ndarray  # number of blocks
+    day: np.ndarray
+    cost: np.ndarray
+
+    def take(self, keep: np.ndarray) -> "ShiftColumns":
+        return ShiftColumns(*(a[keep] for a in self))
+
+
+def enumerate_shifts(
+    availability: AvailabilityMatrix,
+    weekly_max: np.ndarray,
+    preference_costs: dict[int, int] = PREFERENCE_COSTS,
+    shift_change_penalty: float = SHIFT_CHANGE_PENALTY,
+    daily_max_blocks: Optional[int] = None,
+) -> ShiftColumns:
+    """
+    Enumerates every shift of 1 to daily_max_blocks blocks that lies within one of a consultant's
+    runs of available blocks on a day (and isn't longer than their weekly maximum).
+
+    A shift costs the preference cost of its blocks plus shift_change_penalty for each end that
+    borders an available block, same as the shift change variables of the block model. Two
+    adjacent shifts are charged for the change between them, but the merged shift is never more
+    expensive, so optimal schedules have the same cost under both models.
+
+    daily_max_blocks: defaults to DAILY_MAX_BLOCKS scaled to the matrix's block length
+    """
+    if daily_max_blocks is None:
+        daily_max_blocks = _daily_max_blocks(availability.block_minutes)
+    available = availability.values != PREF_UNAVAILABLE
+    num_slots = available.shape[1]
+    day_starts = _day_starts(availability)
+    slots = np.arange(num_slots)
+
+    # runs of available blocks are broken by unavailable blocks and by day boundaries
+    new_day = np.zeros(num_slots, dtype=bool)
+    new_day[day_starts] = True
+    prev_available = np.zeros_like(available)
+    prev_available[:, 1:] = available[:, :-1]
+    prev_available[:, new_day] = False
+    next_available = np.zeros_like(available)
+    next_available[:, :-1] = available[:, 1:] & ~new_day[None, 1:]
+
+    # start and (exclusive) end of the run each available block belongs to
+    run_start = np.maximum.accumulate(
+        np.where(available & ~prev_available, slots, -1), axis=1
+    )
+    run_end = np.minimum.accumulate(
+        np.where(available & ~next_available, slots + 1, num_slots + 1)[:, ::-1],
+        axis=1,
+    )[:, ::-1]
+
+    cost_lookup = _preference_cost_lookup(preference_costs)
+    block_costs = np.where(available, cost_lookup[availability.values], 0)
+    cost_prefix = np.zeros((available.shape[0], num_slots + 1), dtype=np.int64)
+    np.cumsum(block_costs, axis=1, out=cost_prefix[:, 1:])
+
+    day_of_slot = np.searchsorted(day_starts, slots, side="right") - 1
+
+    consultant, start, length = [], [], []
+    for n in range(1, daily_max_blocks + 1):
+        c, s = np.nonzero(available & (run_end - slots >= n))
+        keep = weekly_max[c] >= n
+        consultant.append(c[keep])
+        start.append(s[keep])
+        length.append(np.full(keep.sum(), n))
+
+    consultant = np.concatenate(consultant)
+    start = np.concatenate(start)
+    length = np.concatenate(length)
+    end = start + length
+
+    num_changes = (start != run_start[consultant, start]).astype(np.int64) + (
+        end != run_end[consultant, start]
+    )
+    cost = (
+        cost_prefix[consultant, end]
+        - cost_prefix[consultant, start]
+        + shift_change_penalty * num_changes
+    )
+
+    return ShiftColumns(consultant, start, length, day_of_slot[start], cost)
+
+
+class ShiftModel:
+    """
+    Set-partitioning scheduling model over a subset of candidate shifts: every slot is covered by
+    exactly one chosen shift, with the same weekly and daily block bounds as the block model.
+    """
+
+    def __init__(
+        self,
+        availability: AvailabilityMatrix,
+        columns: ShiftColumns,
+        weekly_min: np.ndarray,
+        weekly_max: np.ndarray,
+        relax: bool = False,
+        daily_max_blocks: Optional[int] = None,
+    ):
+        """
+        relax: make the shift variables continuous (the LP relaxation used for pricing)
+        daily_max_blocks: defaults to DAILY_MAX_BLOCKS scaled to the matrix's block length
+        """
+        if daily_max_blocks is None:
+            daily_max_blocks = _daily_max_blocks(availability.block_minutes)
+        self.columns = columns
+        self.prob = LpProblem("consultant_shift_scheduling", LpMinimize)
+
+        cat = LpContinuous if relax else LpBinary
+        self.z = [
+            LpVariable(f"pattern_{k}", lowBound=0, upBound=1, cat=cat)
+            for k in range(len(columns.cost))
+        ]
+        self.prob += LpAffineExpression(list(zip(self.z, columns.cost.tolist())))
+
+        num_consultants, num_slots = availability.values.shape
+        num_days = len(_day_starts(availability))
+
+        cover_terms = [[] for _ in range(num_slots)]
+        weekly_terms = [[] for _ in range(num_consultants)]
+        daily_terms = {}
+        for z, c, s, n, d in zip(
+            self.z,
+            columns.consultant.tolist(),
+            columns.start.tolist(),
+            columns.length.tolist(),
+            columns.day.tolist(),
+        ):
+            for t in range(s, s + n):
+                cover_terms[t].append((z, 1))
+            weekly_terms[c].append((z, n))
+            daily_terms.setdefault((c, d), []).append((z, n))
+
+        # 1. one consultant per time slot
+        self.cover = [
+            LpConstraint(terms, LpConstraintEQ, f"cover_{t}", 1)
+            for t, terms in enumerate(cover_terms)
+        ]
+        # 2. minimum/maximum weekly hours per consultant
+        self.weekly_min = [
+            LpConstraint(terms, LpConstraintGE, f"weekly_min_{c}", int(weekly_min[c]))
+            for c, terms in enumerate(weekly_terms)
+        ]
+        self.weekly_max = [
+            LpConstraint(terms, LpConstraintLE, f"weekly_max_{c}", int(weekly_max[c]))
+            for c, terms in enumerate(weekly_terms)
+        ]
+        # 3. maximum 5 hours (10 blocks) per day per consultant, only needed where the shifts of
+        # the day can add up to more than that
+        self.daily_max = {
+            (c, d): LpConstraint(
+                terms, LpConstraintLE, f"daily_max_{c}_{d}", daily_max_blocks
+            )
+            for (c, d), terms in daily_terms.items()
+            if len(terms) > 1
+        }
+
+        for constraint in (
+            self.cover
+            + self.weekly_min
+            + self.weekly_max
+            + list(self.daily_max.values())
+        ):
+            self.prob += constraint
+
+        self._num_days = num_days
+        self._shape = (num_consultants, num_slots)
+
+    def duals(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Constraint duals of a solved relaxation as (cover, weekly, daily) arrays, indexed by slot,
+        consultant and (consultant, day). weekly combines the min and max rows.
+        """
+        cover = np.array([con.pi or 0 for con in self.cover], dtype=float)
+        weekly = np.array(
+            [
+                (lo.pi or 0) + (hi.pi or 0)
+                for lo, hi in zip(self.weekly_min, self.weekly_max)
+            ],
+            dtype=float,
+        )
+        daily = np.zeros((len(self.weekly_min), self._num_days))
+        for (c, d), con in self.daily_max.items():
+            daily[c, d] = con.pi or 0
+
+        return cover, weekly, daily
+
+    def chosen(self) -> np.ndarray:
+        """
+        Mask of the shifts picked by the last solve
+        """
+        return np.array([(z.varValue or 0) > 0.5 for z in self.z], dtype=bool)
+
+    def assigned_blocks(self) -> np.ndarray:
+        """
+        (consultants x slots) mask of the blocks covered by the shifts picked by the last solve
+        """
+        assigned = np.zeros(self._shape, dtype=bool)
+        chosen = self.columns.take(self.chosen())
+        for c, s, n in zip(chosen.consultant, chosen.start, chosen.length):
+            assigned[c, s : s + n] = True
+        return assigned
+
+
+def _initial_columns(columns: ShiftColumns) -> np.ndarray:
+    """
+    Starting set for column generation: every single-block shift (so the restricted model is
+    feasible whenever the full one is) and the longest shifts starting at each block
+    """
+    longest = np.zeros(len(columns.cost), dtype=bool)
+    order = np.lexsort((-columns.length, columns.start, columns.consultant))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (np.diff(columns.consultant[order]) != 0) | (
+        np.diff(columns.start[order]) != 0
+    )
+    longest[order[first]] = True
+
+    return (columns.length == 1) | longest
+
+
+def _reduced_costs(
+    columns: ShiftColumns, cover: np.ndarray, weekly: np.ndarray, daily: np.ndarray
+) -> np.ndarray:
+    """
+    Reduced cost of every candidate shift under the given duals
+    """
+    cover_prefix = np.concatenate(([0.0], np.cumsum(cover)))
+    end = columns.start + columns.length
+
+    return (
+        columns.cost
+        - (cover_prefix[end] - cover_prefix[columns.start])
+        - columns.length
+        * (weekly[columns.consultant] + daily[columns.consultant, columns.day])
+    )
+
+
+def _generate_columns(
+    availability: AvailabilityMatrix,
+    columns: ShiftColumns,
+    weekly_min: np.ndarray,
+    weekly_max: np.ndarray,
+    backend: str,
+    solver_options: dict,
+) -> tuple[np.ndarray, int]:
+    """
+    Grows a restricted set of shifts by column generation on the LP relaxation: solve the
+    restricted relaxation, add the shifts with the most negative reduced cost, repeat until none
+    are left.
+
+    Returns (mask of selected shifts, number of rounds)
+    """
+    selected = _initial_columns(columns)
+    # enough columns per round for a few shifts per consultant and day
+    batch = max(100, len(availability.consultants) * len(_day_starts(availability)))
+
+    for rounds in range(1, MAX_PRICING_ROUNDS + 1):
+        model = ShiftModel(
+            availability,
+            columns.take(selected),
+            weekly_min,
+            weekly_max,
+            relax=True,
+        )
+        status, _ = solve(model.prob, backend, **solver_options)
+        if status != LpStatusOptimal:
+            break
+
+        reduced_costs = _reduced_costs(columns, *model.duals())
+        reduced_costs[selected] = 0
+
+        candidates = np.flatnonzero(reduced_costs < -PRICING_TOLERANCE)
+        if len(candidates) == 0:
+            break
+
+        best = candidates[np.argsort(reduced_costs[candidates], kind="stable")[:batch]]
+        selected[best] = True
+
+    return selected, rounds
+
+
+def solve_shift_model(
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    backend: str = DEFAULT_BACKEND,
+    column_generation: bool = False,
+    **solver_options,
+) -> tuple[int, ShiftModel]:
+    """
+    Builds and solves the shift model (see create_shift_schedule()), returning (status, model) so
+    callers can inspect the solved problem, e.g. its sol_status
+
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+    """
+    build_start = perf_counter()
+    weekly_min, weekly_max = _weekly_bounds(
+        availability.consultants, feasible_blocks, availability.block_minutes
+    )
+
+    columns = enumerate_shifts(availability, weekly_max)
+    logger.info(
+        f"Enumerated {len(columns.cost)} shifts in {perf_counter() - build_start:.3f}s"
+    )
+
+    if column_generation:
+        selected, rounds = _generate_columns(
+            availability, columns, weekly_min, weekly_max, backend, solver_options
+        )
+        columns = columns.take(selected)
+        logger.info(
+            f"Column generation kept {len(columns.cost)} shifts after {rounds} rounds"
+        )
+
+    model = ShiftModel(availability, columns, weekly_min, weekly_max)
+    status, solve_time = solve(model.prob, backend, **solver_options)
+    logger.info(f"Solved with {backend} in {solve_time:.3f}s")
+
+    return status, model
+
+
+def create_shift_schedule(
+    df: pd.DataFrame | AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    backend: str = DEFAULT_BACKEND,
+    column_generation: bool = False,
+    **solver_options,
+) -> tuple[int, dict]:
+    """
+    Creates a schedule by picking whole shifts rather than individual blocks. Same inputs and
+    output as lp.create_schedule(), except x maps every available (consultant, time) pair to 1 if
+    assigned or 0 otherwise.
+
+    column_generation: solve over a subset of shifts grown from the LP relaxation instead of all
+        of them. The integer model is then only solved over the generated shifts, so the schedule
+        is not guaranteed to be optimal
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+    """
+    availability = _as_matrix(df)
+    status, model = solve_shift_model(
+        availability, feasible_blocks, backend, column_generation, **solver_options
+    )
+    return status, availability.assignments(model.assigned_blocks())
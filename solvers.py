@@ -0,0 +1,471 @@
+import os
+import re
+import subprocess
+from time import perf_counter
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+from pulp import PULP_CBC_CMD, LpProblem, PulpSolverError, value  # type: ignore
+from pulp.constants import (  # type: ignore
+    LpConstraintGE,
+    LpConstraintLE,
+    LpContinuous,
+    LpSolution,
+    LpSolutionInfeasible,
+    LpSolutionIntegerFeasible,
+    LpSolutionNoSolutionFound,
+    LpSolutionOptimal,
+    LpSolutionUnbounded,
+    LpStatus,
+    LpStatusInfeasible,
+    LpStatusNotSolved,
+    LpStatusOptimal,
+    LpStatusUnbounded,
+)
+
+from tracing import count, is_tracing, span
+
+try:
+    import highspy  # type: ignore
+except ImportError:  # highspy is optional - only needed for the "highs" backend
+    highspy = None
+
+try:
+    import pty
+except (
+    ImportError
+):  # not available on Windows, where CBC's log is read from a plain pipe
+    pty = None
+
+SOLVER_BACKENDS = ("cbc", "highs")
+DEFAULT_BACKEND = "cbc"
+
+# quality of the schedule returned by solve_anytime()
+ANYTIME_OPTIMAL = "optimal"
+ANYTIME_FEASIBLE = "feasible"  # within the requested gap
+ANYTIME_TIME_LIMITED = (
+    "time_limited"  # stopped by the time limit before reaching the gap
+)
+ANYTIME_NO_SOLUTION = "no_solution"  # infeasible, or no schedule found in time
+
+# relative gap below which a solution counts as optimal
+OPTIMALITY_GAP = 1e-9
+
+CBC_SOLUTION_PATTERN = re.compile(r"Cbc00(?:04|12)I Integer solution of (\S+)")
+CBC_PROGRESS_PATTERN = re.compile(
+    r"Cbc0010I After \d+ nodes, \d+ on tree, (\S+) best solution, best possible (\S+)"
+)
+CBC_BOUND_PATTERN = re.compile(r"Lower bound:\s+(\S+)")
+
+
+class Progress(NamedTuple):
+    """
+    Solver progress: objective of the best schedule found so far (None before the first one),
+    best bound on the optimal objective and the relative gap between them
+    """
+
+    elapsed: float  # seconds since the solve started
+    objective: Optional[float]
+    bound: Optional[float]
+    gap: Optional[float]
+
+
+ProgressCallback = Callable[[Progress], None]
+
+
+def _progress(
+    elapsed: float, objective: Optional[float], bound: Optional[float]
+) -> Progress:
+    if bound is not None and not np.isfinite(bound):
+        bound = None  # no bound yet
+
+    gap = None
+    if objective is not None and bound is not None:
+        gap = abs(objective - bound) / max(abs(objective), 1e-10)
+    return Progress(elapsed, objective, bound, gap)
+
+
+def _solve_cbc(
+    prob: LpProblem,
+    threads: Optional[int],
+    time_limit: Optional[float],
+    gap_rel: Optional[float],
+    seed: Optional[int],
+    msg: bool,
+    warm_start: bool,
+    callback: Optional[ProgressCallback],
+) -> tuple[int, Optional[Progress]]:
+    """
+    Solves prob with PuLP's bundled CBC (writes an MPS file and runs CBC as a subprocess)
+    """
+    options = [] if seed is None else [f"randomCbcSeed {seed}", f"randomSeed {seed}"]
+    solver = PULP_CBC_CMD(
+        msg=msg,
+        threads=threads,
+        timeLimit=time_limit,
+        gapRel=gap_rel,
+        options=options,
+        warmStart=warm_start,  # CBC reads the start from each variable's current varValue
+    )
+    if callback is None:
+        return prob.solve(solver), None
+    return _run_cbc_streaming(prob, solver, msg, callback)
+
+
+def _run_cbc_streaming(
+    prob: LpProblem, solver: PULP_CBC_CMD, msg: bool, callback: ProgressCallback
+) -> tuple[int, Progress]:
+    """
+    Same as prob.solve(solver) (see pulp's COIN_CMD.solve_CBC), but reads CBC's log while it runs
+    and reports each new incumbent and bound. The log is read through a pseudo-terminal where
+    possible, since CBC only flushes its output line by line when writing to a terminal.
+    """
+    tmp_mps, tmp_sol, tmp_mst = solver.create_tmp_files(prob.name, "mps", "sol", "mst")
+    vs, variable_names, constraint_names, _ = prob.writeMPS(tmp_mps, rename=1)
+
+    args = [solver.path, tmp_mps]
+    if solver.optionsDict.get("warmStart", False):
+        solver.writesol(tmp_mst, prob, vs, variable_names, constraint_names)
+        args += ["-mips", tmp_mst]
+    if solver.timeLimit is not None:
+        args += ["-sec", str(solver.timeLimit)]
+    for option in solver.options + solver.getOptions():
+        args += f"-{option}".split()
+    args += ["-branch" if solver.mip else "-initialSolve"]
+    args += ["-printingOptions", "all", "-solution", tmp_sol]
+
+    start = perf_counter()
+    if pty is not None:
+        master, slave = pty.openpty()
+        cbc = subprocess.Popen(
+            args, stdout=slave, stderr=slave, stdin=subprocess.DEVNULL
+        )
+        os.close(slave)
+        log = open(master, errors="replace")
+    else:
+        cbc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+        )
+        log = cbc.stdout
+
+    objective = bound = final_bound = None
+    try:
+        for line in log:
+            if msg:
+                print(line.rstrip())
+
+            if match := CBC_SOLUTION_PATTERN.search(line):
+                objective = float(match[1])
+            elif match := CBC_PROGRESS_PATTERN.search(line):
+                bound = float(match[2])
+            elif match := CBC_BOUND_PATTERN.search(line):
+                # only printed in the summary when CBC stops before proving optimality
+                final_bound = float(match[1])
+                continue
+            else:
+                continue
+
+            callback(_progress(perf_counter() - start, objective, bound))
+    except OSError:
+        pass  # reading a pseudo-terminal fails with EIO once CBC exits
+    finally:
+        log.close()
+
+    if cbc.wait() != 0 or not os.path.exists(tmp_sol):
+        raise PulpSolverError(f"Pulp: Error while executing {solver.path}")
+
+    status, values, reduced_costs, shadow_prices, slacks, sol_status = (
+        solver.readsol_MPS(tmp_sol, prob, vs, variable_names, constraint_names)
+    )
+    prob.assignVarsVals(values)
+    prob.assignVarsDj(reduced_costs)
+    prob.assignConsPi(shadow_prices)
+    prob.assignConsSlack(slacks, activity=True)
+    prob.assignStatus(status, sol_status)
+    solver.delete_tmp_files(tmp_mps, tmp_sol, tmp_mst)
+
+    if sol_status in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+        objective = value(prob.objective)
+        if final_bound is not None:
+            bound = final_bound
+        elif sol_status == LpSolutionOptimal:
+            bound = objective
+    else:
+        objective = None
+
+    return status, _progress(perf_counter() - start, objective, bound)
+
+
+def _problem_to_matrix(prob: LpProblem) -> dict:
+    """
+    Converts a PuLP problem to row-wise (CSR) matrix form without writing any files.
+    """
+    variables = prob.variables()
+    col_of = {var.name: j for j, var in enumerate(variables)}
+
+    inf = float("inf")
+    col_cost = np.zeros(len(variables))
+    for var, coef in prob.objective.items():
+        col_cost[col_of[var.name]] = coef
+    col_lower = [-inf if v.lowBound is None else v.lowBound for v in variables]
+    col_upper = [inf if v.upBound is None else v.upBound for v in variables]
+    integrality = [v.cat != LpContinuous for v in variables]
+
+    row_lower, row_upper, row_start, index, values = [], [], [0], [], []
+    for constraint in prob.constraints.values():
+        rhs = -constraint.constant
+        row_lower.append(-inf if constraint.sense == LpConstraintLE else rhs)
+        row_upper.append(inf if constraint.sense == LpConstraintGE else rhs)
+        for var, coef in constraint.items():
+            index.append(col_of[var.name])
+            values.append(coef)
+        row_start.append(len(index))
+
+    return {
+        "variables": variables,
+        "constraints": list(prob.constraints.values()),
+        "col_cost": col_cost,
+        "col_lower": np.array(col_lower, dtype=float),
+        "col_upper": np.array(col_upper, dtype=float),
+        "integrality": np.array(integrality, dtype=bool),
+        "row_lower": np.array(row_lower, dtype=float),
+        "row_upper": np.array(row_upper, dtype=float),
+        "row_start": np.array(row_start, dtype=np.int32),
+        "index": np.array(index, dtype=np.int32),
+        "values": np.array(values, dtype=float),
+        "offset": prob.objective.constant,
+    }
+
+
+def _solve_highs(
+    prob: LpProblem,
+    threads: Optional[int],
+    time_limit: Optional[float],
+    gap_rel: Optional[float],
+    seed: Optional[int],
+    msg: bool,
+    warm_start: bool,
+    callback: Optional[ProgressCallback],
+) -> tuple[int, Optional[Progress]]:
+    """
+    Passes the constraint matrix straight to an in-process HiGHS instance (no LP file or
+    subprocess round trip) and writes the solution back into the PuLP variables.
+    """
+    if highspy is None:
+        raise RuntimeError('The "highs" backend requires highspy (pip install highspy)')
+
+    m = _problem_to_matrix(prob)
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = len(m["col_cost"])
+    lp.num_row_ = len(m["row_lower"])
+    lp.offset_ = m["offset"]
+    lp.col_cost_ = m["col_cost"]
+    lp.col_lower_ = m["col_lower"]
+    lp.col_upper_ = m["col_upper"]
+    lp.row_lower_ = m["row_lower"]
+    lp.row_upper_ = m["row_upper"]
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    lp.a_matrix_.num_col_ = lp.num_col_
+    lp.a_matrix_.num_row_ = lp.num_row_
+    lp.a_matrix_.start_ = m["row_start"]
+    lp.a_matrix_.index_ = m["index"]
+    lp.a_matrix_.value_ = m["values"]
+    lp.integrality_ = [
+        highspy.HighsVarType.kInteger if is_int else highspy.HighsVarType.kContinuous
+        for is_int in m["integrality"]
+    ]
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", msg)
+    if threads is not None:
+        h.setOptionValue("threads", threads)
+    if time_limit is not None:
+        h.setOptionValue("time_limit", float(time_limit))
+    if gap_rel is not None:
+        h.setOptionValue("mip_rel_gap", float(gap_rel))
+    if seed is not None:
+        h.setOptionValue("random_seed", seed)
+
+    h.passModel(lp)
+
+    if warm_start:
+        start = highspy.HighsSolution()
+        start.col_value = [var.varValue or 0 for var in m["variables"]]
+        start.value_valid = True
+        h.setSolution(start)
+
+    if callback is not None:
+        h.cbMipImprovingSolution.subscribe(
+            lambda event: callback(
+                _progress(
+                    event.data_out.running_time,
+                    event.data_out.objective_function_value,
+                    event.data_out.mip_dual_bound,
+                )
+            )
+        )
+
+    h.run()
+
+    model_status = h.getModelStatus()
+    has_solution = h.getInfo().primal_solution_status == 2  # kSolutionStatusFeasible
+
+    solution = h.getSolution()
+    if has_solution:
+        for var, val in zip(m["variables"], solution.col_value):
+            var.varValue = val
+    if solution.dual_valid:
+        # only available for LPs (e.g. relaxations), same as with CBC
+        for constraint, dual in zip(m["constraints"], solution.row_dual):
+            constraint.pi = dual
+
+    # map to PuLP status codes so callers don't need to know which backend ran
+    if model_status == highspy.HighsModelStatus.kOptimal:
+        status, sol_status = LpStatusOptimal, LpSolutionOptimal
+    elif model_status == highspy.HighsModelStatus.kInfeasible:
+        status, sol_status = LpStatusInfeasible, LpSolutionInfeasible
+    elif model_status == highspy.HighsModelStatus.kUnbounded:
+        status, sol_status = LpStatusUnbounded, LpSolutionUnbounded
+    elif has_solution:
+        # stopped early (e.g. time limit) with a feasible solution
+        status, sol_status = LpStatusOptimal, LpSolutionIntegerFeasible
+    else:
+        status, sol_status = LpStatusNotSolved, LpSolutionNoSolutionFound
+
+    prob.status, prob.sol_status = status, sol_status
+
+    info = h.getInfo()
+    progress = _progress(
+        h.getRunTime(),
+        info.objective_function_value if has_solution else None,
+        (
+            info.mip_dual_bound
+            if m["integrality"].any()
+            else info.objective_function_value
+        ),
+    )
+    return status, progress
+
+
+def solve(
+    prob: LpProblem,
+    backend: str = DEFAULT_BACKEND,
+    threads: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    gap_rel: Optional[float] = None,
+    seed: Optional[int] = None,
+    msg: bool = True,
+    warm_start: bool = False,
+    callback: Optional[ProgressCallback] = None,
+) -> tuple[int, float]:
+    """
+    Solves prob with the named backend (see SOLVER_BACKENDS).
+
+    threads: number of solver threads
+    time_limit: wall-clock limit in seconds
+    gap_rel: relative MIP gap at which to stop
+    seed: random seed
+    warm_start: start from the variables' current values (e.g. the previous solution)
+    callback: called with a Progress on each new best schedule (and, with CBC, each new bound)
+
+    Returns (status, solve_time) where status is a PuLP status code and solve_time is in seconds.
+    """
+    status, _, solve_time = _run_backend(
+        prob,
+        backend,
+        threads,
+        time_limit,
+        gap_rel,
+        seed,
+        msg,
+        warm_start,
+        callback,
+    )
+    return status, solve_time
+
+
+def _run_backend(prob: LpProblem, backend: str, *options) -> tuple:
+    solvers = {"cbc": _solve_cbc, "highs": _solve_highs}
+    if backend not in solvers:
+        raise ValueError(
+            f"unknown solver backend {backend!r} (options: {SOLVER_BACKENDS})"
+        )
+
+    with span("solver", backend=backend) as solver_span:
+        solve_start = perf_counter()
+        status, progress = solvers[backend](prob, *options)
+        solve_time = perf_counter() - solve_start
+
+        count("solves")
+        # walking the problem for its size and objective is only worth it if it's recorded
+        if is_tracing():
+            solver_span.set(
+                num_variables=prob.numVariables(),
+                num_constraints=prob.numConstraints(),
+                status=LpStatus[status],
+                solution_status=LpSolution[prob.sol_status],
+                solve_time=solve_time,
+            )
+            if prob.sol_status in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+                solver_span.set(objective=value(prob.objective))
+            if progress is not None:
+                solver_span.set(bound=progress.bound, gap=progress.gap)
+
+    return status, progress, solve_time
+
+
+class AnytimeResult(NamedTuple):
+    """
+    Output of solve_anytime()
+    """
+
+    status: int  # PuLP status code
+    quality: str  # one of the ANYTIME_* constants
+    progress: Progress  # final objective, bound and gap
+    solve_time: float
+
+
+def solve_anytime(
+    prob: LpProblem,
+    time_limit: float,
+    gap_rel: Optional[float] = None,
+    callback: Optional[ProgressCallback] = None,
+    backend: str = DEFAULT_BACKEND,
+    threads: Optional[int] = None,
+    seed: Optional[int] = None,
+    msg: bool = False,
+    warm_start: bool = False,
+) -> AnytimeResult:
+    """
+    Solves prob for at most time_limit seconds, stopping early once the best schedule is within
+    gap_rel of optimal, and keeps the best schedule found in the variables.
+
+    callback: called with a Progress on each new best schedule (and, with CBC, each new bound)
+    """
+    status, progress, solve_time = _run_backend(
+        prob,
+        backend,
+        threads,
+        time_limit,
+        gap_rel,
+        seed,
+        msg,
+        warm_start,
+        callback or (lambda progress: None),
+    )
+
+    if progress.objective is None:
+        quality = ANYTIME_NO_SOLUTION
+    elif progress.gap is not None and progress.gap <= OPTIMALITY_GAP:
+        quality = ANYTIME_OPTIMAL
+    elif progress.gap is not None and gap_rel is not None and progress.gap <= gap_rel:
+        quality = ANYTIME_FEASIBLE
+    else:
+        quality = ANYTIME_TIME_LIMITED
+
+    return AnytimeResult(status, quality, progress, solve_time)
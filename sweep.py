@@ -0,0 +1,157 @@
+import itertools
+import multiprocessing
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pulp import value  # type: ignore
+
+from lp import (
+    DAILY_MAX_BLOCKS,
+    PREFERENCE_COSTS,
+    SHIFT_CHANGE_PENALTY,
+    ScheduleModel,
+    _as_matrix,
+    _daily_max_blocks,
+    _day_starts,
+    _preference_cost_lookup,
+    _shift_change_pairs,
+)
+from sched_setup import PREF_UNAVAILABLE, AvailabilityMatrix, blocks_to_hours
+from solvers import DEFAULT_BACKEND
+
+# parameters that can be swept, and their values when a parameter set leaves them out (the daily
+# cap is scaled to the availability's block length)
+SWEEP_DEFAULTS = {
+    "shift_change_penalty": SHIFT_CHANGE_PENALTY,
+    "preference_costs": PREFERENCE_COSTS,
+    "daily_max_blocks": DAILY_MAX_BLOCKS,
+}
+
+# trade-offs compared by pareto_frontier(), all minimized
+TRADE_OFF_COLUMNS = ["preference_cost", "shift_changes", "hours_spread"]
+
+# model built once per worker process by _init_worker()
+_model: Optional[ScheduleModel] = None
+
+
+def parameter_grid(**values: list) -> list[dict]:
+    """
+    Every combination of the given parameter values, e.g.
+    parameter_grid(shift_change_penalty=[0, 12, 24], daily_max_blocks=[8, 10])
+    """
+    names = list(values)
+    return [dict(zip(names, combo)) for combo in itertools.product(*values.values())]
+
+
+def _init_worker(
+    availability: AvailabilityMatrix,
+    feasible_blocks: Optional[dict[str, tuple[int, int]]],
+):
+    global _model
+    # no presolve: it drops rows based on the daily cap, which is one of the swept bounds
+    _model = ScheduleModel(availability, feasible_blocks, presolve=False)
+
+
+def _trade_offs(model: ScheduleModel) -> dict:
+    """
+    Preference cost (at the default PREFERENCE_COSTS, so parameter sets can be compared), number
+    of shift changes and spread between the most and least hours assigned, of the last solve
+    """
+    var_c, var_t = model.idx["var_c"], model.idx["var_t"]
+    assigned = np.zeros(model.avail.shape, dtype=bool)
+    assigned[var_c, var_t] = [(value(var) or 0) > 0.5 for var in model.x_vars]
+
+    cost_lookup = _preference_cost_lookup(PREFERENCE_COSTS)
+    preference_cost = cost_lookup[model.avail[assigned]].sum()
+
+    available = model.matrix.values != PREF_UNAVAILABLE
+    pair_c, pair_t = _shift_change_pairs(available, _day_starts(model.matrix))
+    shift_changes = (assigned[pair_c, pair_t] != assigned[pair_c, pair_t + 1]).sum()
+
+    hours = blocks_to_hours(assigned.sum(axis=1), model.matrix.block_minutes)
+    return {
+        "preference_cost": int(preference_cost),
+        "shift_changes": int(shift_changes),
+        "hours_spread": float(hours.max() - hours.min()),
+    }
+
+
+def _solve_parameter_set(params: dict, backend: str, solver_options: dict) -> dict:
+    daily_max_blocks = _daily_max_blocks(_model.matrix.block_minutes)
+    params = {**SWEEP_DEFAULTS, "daily_max_blocks": daily_max_blocks, **params}
+
+    # only edits objective coefficients and bounds, so each solve warm starts from the last one
+    _model.set_shift_change_penalty(params["shift_change_penalty"])
+    _model.set_preference_costs(params["preference_costs"])
+    _model.set_daily_max_blocks(params["daily_max_blocks"])
+
+    status, solve_time = _model.solve(backend, **solver_options)
+
+    row = {**params, "status": status, "objective": value(_model.prob.objective)}
+    if status == 1:
+        row.update(_trade_offs(_model))
+    row["solve_time"] = solve_time
+    return row
+
+
+def _solve_parameter_set_star(args: tuple) -> dict:
+    return _solve_parameter_set(*args)
+
+
+def sweep(
+    df: pd.DataFrame | AvailabilityMatrix,
+    parameter_sets: list[dict],
+    feasible_blocks: Optional[dict[str, tuple[int, int]]] = None,
+    processes: Optional[int] = None,
+    backend: str = DEFAULT_BACKEND,
+    **solver_options,
+) -> pd.DataFrame:
+    """
+    Solves the schedule under each parameter set (dicts of SWEEP_DEFAULTS keys, e.g. from
+    parameter_grid()). Each worker process builds the model once and then only changes its
+    objective coefficients and bounds between solves.
+
+    processes: number of worker processes (defaults to one per core, never more than there are
+        parameter sets). With 1, everything runs in this process
+    solver_options: threads, time_limit, gap_rel, seed and msg, passed through to solvers.solve()
+
+    Returns one row per parameter set with its status, objective, solve time and the trade-offs
+    in TRADE_OFF_COLUMNS
+    """
+    availability = _as_matrix(df)
+    solver_options = {"msg": False, **solver_options}
+    tasks = [(params, backend, solver_options) for params in parameter_sets]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+
+    if processes == 1:
+        _init_worker(availability, feasible_blocks)
+        rows = [_solve_parameter_set(*task) for task in tasks]
+    else:
+        with multiprocessing.Pool(
+            processes, _init_worker, (availability, feasible_blocks)
+        ) as pool:
+            rows = pool.map(_solve_parameter_set_star, tasks)
+
+    return pd.DataFrame(rows)
+
+
+def pareto_frontier(
+    results: pd.DataFrame, columns: list[str] = TRADE_OFF_COLUMNS
+) -> pd.DataFrame:
+    """
+    Rows of sweep() results that no other row beats on every column (all minimized), sorted by
+    the first column
+    """
+    solved = results.dropna(subset=columns)
+    points = solved[columns].to_numpy(dtype=float)
+
+    # dominated[i, j]: row j is at least as good as row i everywhere and better somewhere
+    at_least_as_good = (points[None, :, :] <= points[:, None, :]).all(axis=2)
+    better = (points[None, :, :] < points[:, None, :]).any(axis=2)
+    dominated = (at_least_as_good & better).any(axis=1)
+
+    return solved[~dominated].sort_values(columns)
@@ -0,0 +1,211 @@
+import json
+import sys
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, time
+from typing import IO, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows, where max RSS isn't recorded
+    resource = None
+
+
+class Span:
+    """
+    A timed stage of a traced run. Fields set on it (e.g. model size, solver status) are written
+    with its trace line when it ends
+    """
+
+    __slots__ = ("name", "path", "start", "fields", "peak")
+
+    def __init__(self, name: str, path: str, start: float, fields: dict):
+        self.name = name
+        self.path = path
+        self.start = start
+        self.fields = fields
+        self.peak = 0  # highest traced allocation seen in child spans
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class _NullSpan:
+    """
+    Stand-in for Span when tracing is off
+    """
+
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = nullcontext(_NullSpan())
+
+
+def _max_rss() -> Optional[int]:
+    """
+    Peak resident memory of this process in bytes
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Tracer:
+    """
+    Writes spans (see span()) as JSON lines, one per line as each span ends, followed by a summary
+    line with the counters (see count()) and peak memory when the tracer is closed
+    """
+
+    def __init__(self, output: str | IO, memory: bool = False):
+        """
+        output: path or open file to write the JSON lines to
+        memory: also record the peak traced (tracemalloc) allocation of each span. Slows down
+            allocation-heavy stages, so it's off by default. Peak resident memory is always
+            recorded where the platform supports it
+        """
+        self._file = open(output, "w") if isinstance(output, str) else output
+        self._owns_file = isinstance(output, str)
+        self.memory = memory
+        self.counters: Counter[str] = Counter()
+        self._stack: list[Span] = []
+        self._start = perf_counter()
+        self._started_tracemalloc = memory and not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+
+    def emit(self, record: dict):
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    @contextmanager
+    def span(self, name: str, **fields) -> Iterator[Span]:
+        parent = self._stack[-1] if self._stack else None
+        path = name if parent is None else f"{parent.path}/{name}"
+        span = Span(name, path, perf_counter(), fields)
+
+        if self.memory:
+            # the traced peak can only be reset, not saved, so each span keeps the highest peak
+            # of its finished children and its own since the last reset
+            if parent is not None:
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        self._stack.append(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            self._stack.pop()
+            end = perf_counter()
+            record = {
+                "type": "span",
+                "name": name,
+                "path": path,
+                "start": span.start - self._start,
+                "seconds": end - span.start,
+                **span.fields,
+            }
+            if error is not None:
+                record["error"] = error
+            if self.memory:
+                peak = max(span.peak, tracemalloc.get_traced_memory()[1])
+                record["peak_traced_bytes"] = peak
+                if parent is not None:
+                    parent.peak = max(parent.peak, peak)
+            if resource is not None:
+                record["max_rss_bytes"] = _max_rss()
+            self.emit(record)
+
+    def close(self):
+        summary = {
+            "type": "summary",
+            "time": time(),
+            "seconds": perf_counter() - self._start,
+            "counters": dict(self.counters),
+        }
+        if self.memory:
+            summary["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        if resource is not None:
+            summary["max_rss_bytes"] = _max_rss()
+        self.emit(summary)
+
+        if self._owns_file:
+            self._file.close()
+
+
+# tracer of the current run, if tracing is on
+_tracer: Optional[Tracer] = None
+
+
+def start_tracing(output: str | IO, memory: bool = False) -> Tracer:
+    """
+    Starts recording spans and counters to output (see Tracer)
+    """
+    global _tracer
+    if _tracer is not None:
+        raise RuntimeError("tracing has already been started")
+    _tracer = Tracer(output, memory)
+    return _tracer
+
+
+def stop_tracing():
+    """
+    Writes the summary line and stops recording
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+@contextmanager
+def tracing(output: Optional[str | IO], memory: bool = False) -> Iterator[None]:
+    """
+    Records spans and counters to output for the duration of the block (does nothing if output
+    is None)
+    """
+    if output is None:
+        yield
+        return
+
+    start_tracing(output, memory)
+    try:
+        yield
+    finally:
+        stop_tracing()
+
+
+def is_tracing() -> bool:
+    """
+    Whether tracing is on, for skipping work that only produces span fields
+    """
+    return _tracer is not None
+
+
+def span(name: str, **fields):
+    """
+    Context manager that times the block as a named span, nested under the enclosing span. Yields
+    the span so fields can be added with span.set(). A no-op when tracing is off
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **fields)
+
+
+def count(name: str, n: int = 1):
+    """
+    Adds n to a named counter. A no-op when tracing is off
+    """
+    if _tracer is not None:
+        _tracer.counters[name] += n